@@ -1,12 +1,32 @@
 # app.py - ИСПРАВЛЕННАЯ И УЛУЧШЕННАЯ ВЕРСИЯ
 import os
+import math
 import random
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response
+import threading
+import multiprocessing
+import hashlib
+import base64
+import binascii
+import uuid
+import logging
+import time
+import click
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import wraps
+from flask import Flask, Request, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, g, has_request_context, abort, send_file, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import RequestEntityTooLarge
 from datetime import datetime, date, timedelta
 import json
+import re
+import workout_analytics
+import photo_pipeline
+import photo_storage
 
 # Инициализация приложения
 app = Flask(__name__)
@@ -22,6 +42,53 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///fitness.db'
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['EXPORT_BATCH_SIZE'] = 200  # Тренировок на одну страницу выгрузки
+app.config['IMPORT_CHUNK_SIZE'] = 200  # Тренировок на одну транзакцию импорта
+app.config['DERIVATION_WORKERS'] = int(os.environ.get('DERIVATION_WORKERS', 2))  # Потоков пересчета (0 - сразу после коммита)
+app.config['DERIVATION_POLL_SECONDS'] = 5  # Интервал опроса очереди пересчета
+app.config['DERIVATION_MAX_ATTEMPTS'] = 3  # Попыток на задачу пересчета
+app.config['RESPONSE_CACHE_BACKEND'] = os.environ.get('RESPONSE_CACHE_BACKEND', 'lru')  # lru или redis
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = 1024  # Граница размера LRU-кэша ответов
+app.config['RESPONSE_CACHE_TTL'] = 3600  # Секунд хранения ответа в Redis
+app.config['RESPONSE_CACHE_REDIS_URL'] = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+app.config['SQL_BUDGET_STRICT'] = os.environ.get('SQL_BUDGET_STRICT') == '1'  # Превышение бюджета запросов - ошибка (в тестах всегда)
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO').upper()  # DEBUG включает пошаговые сообщения
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # Bearer-токен /metrics; без него доступ только напрямую с localhost
+app.config['PROGRESS_MAX_POINTS'] = int(os.environ.get('PROGRESS_MAX_POINTS', 200))  # Лимит точек на график прогресса
+app.config['FORECAST_WINDOW_POINTS'] = 60  # Последних тренировочных дней в ряду прогноза прогрессии
+app.config['FORECAST_MIN_POINTS'] = 3  # Меньше точек - используется скорость по умолчанию
+app.config['WEIGHT_PREDICTION_HISTORY'] = 5  # Последних выполнений упражнения для рекомендации веса
+app.config['PHOTO_MAX_BYTES'] = 20 * 1024 * 1024  # Лимит размера загружаемой фотографии
+app.config['PHOTO_FORM_OVERHEAD'] = 64 * 1024  # Запас на остальные поля и разметку multipart сверх PHOTO_MAX_BYTES
+app.config['PHOTO_MAX_SIZE'] = 2048  # Длинная сторона полноразмерной фотографии после перекодирования, px
+app.config['PHOTO_THUMBNAIL_SIZES'] = (640, 1280)  # Миниатюры по длинной стороне, px (сетка 1x и 2x)
+app.config['PHOTO_QUALITY'] = 82  # Качество WebP
+app.config['PHOTO_WORKERS'] = int(os.environ.get('PHOTO_WORKERS', 2))  # Процессов обработки фото (0 - в запросе)
+app.config['LIST_PAGE_SIZE'] = 20  # Записей на странице списков API (?limit=)
+app.config['LIST_MAX_PAGE_SIZE'] = 100  # Предел ?limit= для списков API
+app.config['CALENDAR_MAX_DAYS'] = 731  # Предел диапазона /api/workout-calendar
+app.config['SYNC_MAX_OPERATIONS'] = 100  # Операций офлайн-очереди в одном запросе /api/sync
+app.config['PHOTO_WORK_FOLDER'] = os.environ.get('PHOTO_WORK_FOLDER', os.path.join(app.instance_path, 'photo-work'))  # Загрузки до обработки
+app.config['PHOTO_STORAGE_BACKEND'] = os.environ.get('PHOTO_STORAGE_BACKEND', 'filesystem')  # filesystem или s3
+app.config['PHOTO_STORAGE_ROOT'] = os.environ.get('PHOTO_STORAGE_ROOT', os.path.join(app.instance_path, 'photos'))  # Каталог бэкенда filesystem
+app.config['PHOTO_S3_BUCKET'] = os.environ.get('PHOTO_S3_BUCKET', 'progress-photos')
+app.config['PHOTO_S3_ENDPOINT_URL'] = os.environ.get('PHOTO_S3_ENDPOINT_URL')  # Например, http://localhost:9000 для MinIO
+app.config['PHOTO_S3_ACCESS_KEY'] = os.environ.get('PHOTO_S3_ACCESS_KEY')
+app.config['PHOTO_S3_SECRET_KEY'] = os.environ.get('PHOTO_S3_SECRET_KEY')
+app.config['PHOTO_S3_REGION'] = os.environ.get('PHOTO_S3_REGION')
+app.config['PHOTO_PUBLIC_URL'] = os.environ.get('PHOTO_PUBLIC_URL')  # Если задан, файлы отдаются по нему напрямую (nginx, CDN, бакет) без проверки владельца
+app.config['PHOTO_SENDFILE'] = os.environ.get('PHOTO_SENDFILE', '')  # x-accel (nginx) или x-sendfile; пусто - отдает Flask
+app.config['PHOTO_ACCEL_PREFIX'] = '/protected-photos'  # internal-location nginx, указывающий на PHOTO_STORAGE_ROOT
+app.config['USE_X_SENDFILE'] = app.config['PHOTO_SENDFILE'] == 'x-sendfile'
+
+# Логирование: сообщения ниже LOG_LEVEL отбрасываются до форматирования
+logger = logging.getLogger('fitness')
+logger.setLevel(app.config['LOG_LEVEL'])
+if not logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+    logger.addHandler(log_handler)
+    logger.propagate = False
 
 # Инициализация расширений
 db = SQLAlchemy(app)
@@ -57,6 +124,8 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(128), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     weight = db.Column(db.Float, default=70.0)  # НОВОЕ: вес пользователя
+    data_version = db.Column(db.Integer, default=0, nullable=False)  # Растет при каждой записи данных пользователя
+    calendar_version = db.Column(db.Integer, default=0, nullable=False)  # Растет при изменении тренировок прошлых месяцев
     
     # Связи
     workout_sessions = db.relationship('WorkoutSession', backref='user', lazy=True, cascade='all, delete-orphan')
@@ -86,17 +155,30 @@ class WorkoutSession(db.Model):
     
     exercises = db.relationship('WorkoutExercise', backref='session', lazy=True, cascade='all, delete-orphan')
     calorie_trackings = db.relationship('CalorieTracking', backref='workout_session', lazy=True, cascade='all, delete-orphan')
+    progress_points = db.relationship('ProgressPoint', backref='workout_session', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        db.Index('ix_workout_session_user_date', 'user_id', 'date'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'date': self.date.isoformat(),
+            'name': self.name,
+            'duration_minutes': self.duration_minutes,
+            'total_calories': self.total_calories
+        }
     
     def calculate_calories(self, user_weight=70.0, workout_type="strength"):
         """Улучшенный расчет калорий"""
-        total_volume = 0
-        for exercise in self.exercises:
-            sets_data = exercise.get_sets_data()
-            for set_data in sets_data:
-                weight = safe_float(set_data.get('weight'), 0)
-                reps = safe_int(set_data.get('reps'), 0)
-                if weight > 0 and reps > 0:
-                    total_volume += weight * reps
+        total_volume = db.session.query(
+            db.func.coalesce(db.func.sum(WorkoutSet.weight * WorkoutSet.reps), 0.0)
+        ).filter(
+            WorkoutSet.session_id == self.id,
+            WorkoutSet.weight > 0,
+            WorkoutSet.reps > 0
+        ).scalar()
         
         duration = safe_float(self.duration_minutes, 60.0)
         if duration <= 0:
@@ -110,41 +192,47 @@ class WorkoutSession(db.Model):
         return calculator.get_spent_calories()
     
     def calculate_volume_load(self):
-        """Расчет объемной нагрузки"""
+        """Расчет объемной нагрузки (GROUP BY по таблице подходов)"""
+        rows = db.session.query(
+            WorkoutExercise.exercise_type,
+            db.func.sum(WorkoutSet.weight * WorkoutSet.reps),
+            db.func.count(WorkoutSet.id),
+            db.func.sum(WorkoutSet.reps),
+            db.func.max(WorkoutSet.weight)
+        ).join(WorkoutSet, WorkoutSet.exercise_id == WorkoutExercise.id).filter(
+            WorkoutExercise.session_id == self.id,
+            WorkoutSet.weight > 0,
+            WorkoutSet.reps > 0
+        ).group_by(WorkoutExercise.exercise_type).all()
+        
         volume_data = {}
-        for exercise in self.exercises:
-            sets_data = exercise.get_sets_data()
-            if sets_data:
-                weights = []
-                reps_list = []
-                volume_load = 0.0
-                
-                for s in sets_data:
-                    weight = safe_float(s.get('weight'), 0)
-                    reps = safe_int(s.get('reps'), 0)
-                    
-                    if weight > 0 and reps > 0:
-                        weights.append(weight)
-                        reps_list.append(reps)
-                        volume_load += weight * reps
-                
-                if weights and reps_list:
-                    volume_data[exercise.exercise_type] = {
-                        'volume_load': volume_load,
-                        'sets_count': len(weights),
-                        'reps_count': sum(reps_list),
-                        'max_weight': max(weights)
-                    }
+        for exercise_type, volume_load, sets_count, reps_count, max_weight in rows:
+            volume_data[exercise_type] = {
+                'volume_load': float(volume_load),
+                'sets_count': sets_count,
+                'reps_count': int(reps_count),
+                'max_weight': max_weight
+            }
         return volume_data
 
 class WorkoutExercise(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('workout_session.id'), nullable=False)
     exercise_type = db.Column(db.String(100), nullable=False)
-    sets_data = db.Column(db.Text, nullable=False)
+    sets_data = db.Column(db.Text, nullable=False)  # Устаревшая JSON-копия, источник данных - WorkoutSet
     order = db.Column(db.Integer, default=0)
     
+    sets = db.relationship('WorkoutSet', backref='exercise', lazy=True, cascade='all, delete-orphan',
+                           order_by='WorkoutSet.set_number')
+    
+    __table_args__ = (
+        db.Index('ix_workout_exercise_session_type', 'session_id', 'exercise_type'),
+    )
+    
     def get_sets_data(self):
+        if self.sets:
+            return [s.to_dict() for s in self.sets]
+        # Строки, еще не перенесенные в workout_set (см. backfill_workout_sets)
         try:
             return json.loads(self.sets_data) if self.sets_data else []
         except json.JSONDecodeError:
@@ -152,6 +240,36 @@ class WorkoutExercise(db.Model):
     
     def set_sets_data(self, data):
         self.sets_data = json.dumps(data, ensure_ascii=False)
+        self.sets = [
+            WorkoutSet(
+                session_id=self.session_id,
+                set_number=safe_int(set_data.get('set_number'), idx + 1),
+                weight=safe_float(set_data.get('weight'), 0.0),
+                reps=safe_int(set_data.get('reps'), 0)
+            )
+            for idx, set_data in enumerate(data)
+        ]
+
+class WorkoutSet(db.Model):
+    """Модель отдельного подхода (нормализованная замена WorkoutExercise.sets_data)"""
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('workout_session.id'), nullable=False)
+    exercise_id = db.Column(db.Integer, db.ForeignKey('workout_exercise.id'), nullable=False)
+    set_number = db.Column(db.Integer, nullable=False, default=1)
+    weight = db.Column(db.Float, nullable=False, default=0.0)  # Вес в кг
+    reps = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('ix_workout_set_exercise_number', 'exercise_id', 'set_number'),
+        db.Index('ix_workout_set_session', 'session_id'),
+    )
+    
+    def to_dict(self):
+        return {
+            'set_number': self.set_number,
+            'weight': self.weight,
+            'reps': self.reps
+        }
 
 class FitnessGoal(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -167,6 +285,10 @@ class FitnessGoal(db.Model):
     is_completed = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_fitness_goal_user_type', 'user_id', 'exercise_type'),
+    )
+    
     @property
     def progress_percentage(self):
         target_w = safe_float(self.target_weight, 0.0)
@@ -184,28 +306,15 @@ class FitnessGoal(db.Model):
         return max(0, remaining)  # ИСПРАВЛЕНО: не возвращаем отрицательные значения
     
     def update_progress(self):
-        latest_exercise = WorkoutExercise.query.join(WorkoutSession).filter(
-            WorkoutSession.user_id == self.user_id,
-            WorkoutExercise.exercise_type == self.exercise_type
-        ).order_by(WorkoutSession.date.desc()).first()
-        
-        if latest_exercise:
-            sets_data = latest_exercise.get_sets_data()
-            if sets_data:
-                valid_weights = []
-                valid_reps = []
-                
-                for s in sets_data:
-                    weight = safe_float(s.get('weight'), 0)
-                    reps = safe_int(s.get('reps'), 0)
-                    if weight > 0 and reps > 0:
-                        valid_weights.append(weight)
-                        valid_reps.append(reps)
-                
-                if valid_weights and valid_reps:
-                    self.current_weight = max(valid_weights)
-                    self.current_reps = max(valid_reps)
-                    self.current_sets = len(valid_weights)
+        stats = latest_exercise_stats(self.user_id, [self.exercise_type])
+        self.apply_progress(stats.get(self.exercise_type))
+    
+    def apply_progress(self, latest_exercise):
+        """Обновляет текущие показатели по агрегатам последнего выполнения упражнения"""
+        if latest_exercise and latest_exercise.sets_count:
+            self.current_weight = latest_exercise.max_weight
+            self.current_reps = latest_exercise.max_reps
+            self.current_sets = latest_exercise.sets_count
         
         current_w = safe_float(self.current_weight, 0.0)
         current_r = safe_int(self.current_reps, 0)
@@ -223,6 +332,10 @@ class WorkoutTemplate(db.Model):
     exercises_data = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_workout_template_user_created', 'user_id', 'created_at'),
+    )
+    
     def get_exercises_data(self):
         try:
             return json.loads(self.exercises_data) if self.exercises_data else []
@@ -240,6 +353,11 @@ class CalorieTracking(db.Model):
     calories_burned = db.Column(db.Float, nullable=False, default=0.0)
     workout_duration = db.Column(db.Float, default=0.0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_calorie_tracking_user_date', 'user_id', 'date'),
+        db.Index('ix_calorie_tracking_session', 'workout_session_id'),
+    )
 
 class ProgressionPlan(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -254,6 +372,10 @@ class ProgressionPlan(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_progression_plan_user_type', 'user_id', 'exercise_type'),
+    )
+    
     def get_next_weight(self, current_reps, target_reps=8):
         current_r = safe_int(current_reps, 0)
         target_r = safe_int(target_reps, 8)
@@ -274,8 +396,27 @@ class WorkoutStreak(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    def update_streak(self):
-        today = date.today()
+    __table_args__ = (
+        db.Index('ix_workout_streak_user_type', 'user_id', 'streak_type'),
+    )
+    
+    def projected_streak(self, activity_date=None):
+        """Длина цепочки после активности в указанный день (без изменения записи)"""
+        today = activity_date or date.today()
+        
+        if self.last_activity_date is None:
+            return 1
+        if self.last_activity_date >= today:
+            return self.current_streak or 1
+        if self.last_activity_date == today - timedelta(days=1):
+            return (self.current_streak or 0) + 1
+        return 1
+    
+    def update_streak(self, activity_date=None):
+        today = activity_date or date.today()
+        
+        if self.last_activity_date is not None and self.last_activity_date > today:
+            return
         
         if self.last_activity_date is None:
             self.current_streak = 1
@@ -309,6 +450,132 @@ class VolumeLoadTracking(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     workout_session = db.relationship('WorkoutSession', backref='volume_loads')
+    
+    __table_args__ = (
+        db.Index('ix_volume_load_tracking_user_date', 'user_id', 'date'),
+        db.Index('ix_volume_load_tracking_user_type_date', 'user_id', 'exercise_type', 'date'),
+        db.Index('ix_volume_load_tracking_session', 'session_id'),
+    )
+
+class ProgressPoint(db.Model):
+    """Точка ряда прогресса по упражнению (обновляется при записи тренировки)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    session_id = db.Column(db.Integer, db.ForeignKey('workout_session.id'), nullable=False)
+    exercise_id = db.Column(db.Integer, db.ForeignKey('workout_exercise.id'), nullable=False, unique=True)
+    exercise_type = db.Column(db.String(100), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    max_weight = db.Column(db.Float, nullable=False)
+    avg_weight = db.Column(db.Float, default=0.0)
+    avg_reps = db.Column(db.Float, default=0.0)
+    volume = db.Column(db.Float, default=0.0)
+    
+    __table_args__ = (
+        db.Index('ix_progress_point_user_type_date', 'user_id', 'exercise_type', 'date'),
+        db.Index('ix_progress_point_session', 'session_id'),
+    )
+
+class WorkoutRollup(db.Model):
+    """Агрегаты тренировок пользователя за день или неделю"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    period = db.Column(db.String(10), nullable=False)  # day, week
+    period_start = db.Column(db.Date, nullable=False)  # День или понедельник недели
+    workouts_count = db.Column(db.Integer, default=0, nullable=False)
+    total_calories = db.Column(db.Float, default=0.0, nullable=False)
+    
+    __table_args__ = (db.UniqueConstraint('user_id', 'period', 'period_start'),)
+
+class ExerciseRollup(db.Model):
+    """Агрегаты по упражнению пользователя за день или неделю"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    period = db.Column(db.String(10), nullable=False)  # day, week
+    period_start = db.Column(db.Date, nullable=False)
+    exercise_type = db.Column(db.String(100), nullable=False)
+    sessions_count = db.Column(db.Integer, default=0, nullable=False)
+    volume_load = db.Column(db.Float, default=0.0, nullable=False)
+    max_weight = db.Column(db.Float, default=0.0, nullable=False)
+    
+    __table_args__ = (db.UniqueConstraint('user_id', 'period', 'period_start', 'exercise_type'),)
+
+class DerivationJob(db.Model):
+    """Задача пересчета производных данных тренировки (выполняется вне запроса)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    session_id = db.Column(db.Integer, nullable=False)  # Без внешнего ключа: тренировку могут удалить до обработки
+    job_type = db.Column(db.String(50), nullable=False, default='workout_session')
+    activity_date = db.Column(db.Date, nullable=False, default=date.today)  # День активности для цепочки
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)  # pending, running, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class UserFeatureSnapshot(db.Model):
+    """Признаки пользователя для ИИ помощника (пересчитываются при записи тренировок)"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_workouts = db.Column(db.Integer, nullable=False, default=0)
+    features_data = db.Column(db.Text, nullable=False, default='{}')  # JSON, см. refresh_feature_snapshot
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def get_features(self):
+        try:
+            return json.loads(self.features_data) if self.features_data else {}
+        except json.JSONDecodeError:
+            return {}
+    
+    def set_features(self, data):
+        self.features_data = json.dumps(data, ensure_ascii=False)
+
+# Стандартные упражнения - начальное наполнение каталога (см. seed_exercise_catalog)
+STANDARD_EXERCISES = [
+    {'name': 'Жим лежа', 'muscle_group': 'Грудь', 'met': 6.0, 'aliases': ['Жим штанги лежа']},
+    {'name': 'Сведение рук в кроссовере на грудь', 'muscle_group': 'Грудь', 'met': 5.0, 'aliases': ['Сведение рук в кроссовере']},
+    {'name': 'Разгибания на трицепс с канатной рукоятью в кроссовере', 'muscle_group': 'Руки', 'met': 4.0, 'aliases': []},
+    {'name': 'Сгибания на бицепс в рычажном тренажере', 'muscle_group': 'Руки', 'met': 4.0, 'aliases': []},
+    {'name': 'Махи на плечи со свободным весом', 'muscle_group': 'Плечи', 'met': 4.5, 'aliases': ['Махи гантелями в стороны']},
+    {'name': 'Отведение плеча в блочном тренажере "reverse fly"', 'muscle_group': 'Плечи', 'met': 4.0, 'aliases': ['Reverse fly']},
+    {'name': 'Ягодичный мост в рычажном тренажере', 'muscle_group': 'Ноги', 'met': 5.5, 'aliases': ['Ягодичный мост']},
+    {'name': 'Разгибание бедра стоя в кроссовере / рычажном тренажере', 'muscle_group': 'Ноги', 'met': 5.0, 'aliases': []},
+    {'name': 'Болгарские выпады со свободным весом / в смите', 'muscle_group': 'Ноги', 'met': 6.0, 'aliases': ['Болгарские выпады']},
+    {'name': 'Отведение бедра сидя в сдвоенном блочном тренажере (большая ягодичная)', 'muscle_group': 'Ноги', 'met': 4.5, 'aliases': []},
+    {'name': 'Отведение с наклоном вперед бедра сидя в сдвоенном блочном тренажере (малая и средняя ягодичные)', 'muscle_group': 'Ноги', 'met': 4.5, 'aliases': []},
+    {'name': 'Приседание в Смите', 'muscle_group': 'Ноги', 'met': 6.5, 'aliases': ['Приседания в Смите']},
+    {'name': 'Вертикальная тяга сидя', 'muscle_group': 'Спина', 'met': 6.0, 'aliases': ['Тяга верхнего блока']},
+    {'name': 'Горизонтальная тяга троссовая в блочном тренажере', 'muscle_group': 'Спина', 'met': 6.0, 'aliases': ['Горизонтальная тяга']},
+    {'name': 'Экстензия на наклонной скамье', 'muscle_group': 'Спина', 'met': 5.5, 'aliases': ['Гиперэкстензия']},
+    {'name': 'Ходьба на дорожке с наклоном 13-14', 'muscle_group': 'Кардио', 'met': 8.0, 'aliases': ['Ходьба на дорожке']}
+]
+
+# Ключевые слова для названий вне каталога (группы проверяются по порядку)
+MUSCLE_GROUP_KEYWORDS = [
+    ('Грудь', ['грудь', 'жим', 'сведение', 'разведение']),
+    ('Руки', ['бицепс', 'трицепс', 'руки', 'сгибание', 'разгибание']),
+    ('Плечи', ['плеч', 'махи', 'отведение']),
+    ('Спина', ['спина', 'тяга', 'экстензия']),
+    ('Ноги', ['ноги', 'присед', 'выпад', 'ягодиц', 'бедр']),
+    ('Кардио', ['кардио', 'ходьба', 'бег', 'дорожка'])
+]
+
+class ExerciseCatalog(db.Model):
+    """Каталог стандартных упражнений (пользовательские накладываются из CustomExercise)"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False, unique=True)
+    muscle_group = db.Column(db.String(50), nullable=False)
+    met_value = db.Column(db.Float, default=5.0, nullable=False)
+    description = db.Column(db.Text)
+    aliases_data = db.Column(db.Text)  # JSON-список альтернативных названий
+    position = db.Column(db.Integer, default=0, nullable=False)  # Порядок отображения
+    
+    def get_aliases(self):
+        try:
+            return json.loads(self.aliases_data) if self.aliases_data else []
+        except json.JSONDecodeError:
+            return []
+    
+    def set_aliases(self, aliases):
+        self.aliases_data = json.dumps(aliases, ensure_ascii=False)
 
 class CustomExercise(db.Model):
     """Модель пользовательских упражнений"""
@@ -320,6 +587,10 @@ class CustomExercise(db.Model):
     description = db.Column(db.Text)  # Описание упражнения
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_custom_exercise_user_group', 'user_id', 'muscle_group', 'name'),
+    )
 
 class BodyWeight(db.Model):
     """Модель для отслеживания веса и процента жира"""
@@ -332,6 +603,19 @@ class BodyWeight(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     user = db.relationship('User', backref='body_weights')
+    
+    __table_args__ = (
+        db.Index('ix_body_weight_user_date', 'user_id', 'date'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'date': self.date.isoformat(),
+            'weight': self.weight,
+            'body_fat_percentage': self.body_fat_percentage,
+            'notes': self.notes
+        }
 
 class BodyMeasurement(db.Model):
     """Модель для измерений тела"""
@@ -352,18 +636,66 @@ class BodyMeasurement(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     user = db.relationship('User', backref='body_measurements')
+    
+    __table_args__ = (
+        db.Index('ix_body_measurement_user_date', 'user_id', 'date'),
+    )
+    
+    MEASUREMENT_FIELDS = ('neck', 'shoulders', 'forearms', 'biceps', 'chest', 'waist', 'abdomen', 'hips', 'thigh', 'calves')
+    
+    def to_dict(self):
+        data = {'id': self.id, 'date': self.date.isoformat(), 'notes': self.notes}
+        data.update({field: getattr(self, field) for field in self.MEASUREMENT_FIELDS})
+        return data
 
 class ProgressPhoto(db.Model):
     """Модель для фотографий прогресса"""
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     date = db.Column(db.Date, nullable=False, default=date.today)
-    photo_path = db.Column(db.String(500), nullable=False)  # Путь к файлу
+    photo_path = db.Column(db.String(500), nullable=False)  # Путь к файлу (полноразмерный вариант)
     photo_type = db.Column(db.String(50))  # front, side, back
     notes = db.Column(db.Text)  # Заметки
+    status = db.Column(db.String(20), nullable=False, default='ready')  # processing, ready, failed
+    source_hash = db.Column(db.String(64), index=True)  # SHA-256 загруженного файла (поиск повторных загрузок)
+    thumbnails_data = db.Column(db.Text)  # JSON {размер: путь} миниатюр
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     user = db.relationship('User', backref='progress_photos')
+    
+    __table_args__ = (
+        db.Index('ix_progress_photo_user_date', 'user_id', 'date'),
+    )
+    
+    def get_thumbnails(self):
+        try:
+            data = json.loads(self.thumbnails_data) if self.thumbnails_data else {}
+        except json.JSONDecodeError:
+            return {}
+        return {int(size): path for size, path in data.items()}
+    
+    def set_thumbnails(self, data):
+        self.thumbnails_data = json.dumps({str(size): path for size, path in data.items()})
+    
+    def thumbnail_path(self, size):
+        """Наименьшая миниатюра не меньше size (или полноразмерный вариант)"""
+        for thumbnail_size, path in sorted(self.get_thumbnails().items()):
+            if thumbnail_size >= size:
+                return path
+        return self.photo_path
+    
+    def to_dict(self):
+        ready = self.status == 'ready'
+        return {
+            'id': self.id,
+            'date': self.date.isoformat(),
+            'photo_type': self.photo_type,
+            'notes': self.notes,
+            'status': self.status,
+            'url': photo_url(self.photo_path) if ready else None,
+            'thumbnail_url': photo_url(self.thumbnail_path(640)) if ready else None,
+            'thumbnail_2x_url': photo_url(self.thumbnail_path(1280)) if ready else None
+        }
 
 class DoubleProgression(db.Model):
     """Модель двойной прогрессии"""
@@ -380,6 +712,10 @@ class DoubleProgression(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_double_progression_user_type', 'user_id', 'exercise_type'),
+    )
+    
     def get_training_instructions(self):
         """Возвращает инструкции для текущей тренировки"""
         return {
@@ -441,6 +777,17 @@ class DoubleProgression(db.Model):
             return True, "reps_increased"
         return False, "no_progression"
 
+class SyncOperation(db.Model):
+    """Примененная операция офлайн-очереди (client_id генерирует клиент, повтор не создает дубликат)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    client_id = db.Column(db.String(36), nullable=False)
+    operation_type = db.Column(db.String(50), nullable=False)
+    object_id = db.Column(db.Integer)  # Созданная запись (без внешнего ключа: ее могут удалить)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('user_id', 'client_id'),)
+
 # Классы для расчета калорий
 class TrainingCalculator:
     M_IN_KM = 1000
@@ -484,7 +831,7 @@ class CardioTrainingCalculator(TrainingCalculator):
 # Login Manager
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return db.session.get(User, int(user_id))
 
 # Контекстные процессоры
 @app.context_processor
@@ -497,174 +844,1484 @@ def inject_user_data():
         return {'current_user_data': current_user}
     return {'current_user_data': None}
 
+# Каталог упражнений и классификатор групп мышц
+class ExerciseClassifier:
+    """Группа мышц по названию упражнения
+    
+    Название (или синоним) из каталога определяется поиском в словаре; для остальных
+    используются заранее скомпилированные выражения MUSCLE_GROUP_KEYWORDS.
+    Результаты запоминаются, поэтому повторная классификация - один поиск в словаре.
+    """
+    
+    MEMO_LIMIT = 10000
+    
+    def __init__(self, entries):
+        self.exact = {}
+        for entry in entries:
+            for name in [entry['name']] + entry['aliases']:
+                self.exact[name.casefold()] = entry['muscle_group']
+        self.patterns = [
+            (group, re.compile('|'.join(re.escape(word) for word in words)))
+            for group, words in MUSCLE_GROUP_KEYWORDS
+        ]
+        self.memo = {}
+    
+    def classify(self, exercise_name):
+        key = (exercise_name or '').casefold()
+        group = self.memo.get(key)
+        if group is None:
+            group = self.exact.get(key) or self.match_keywords(key)
+            if len(self.memo) >= self.MEMO_LIMIT:
+                self.memo.clear()
+            self.memo[key] = group
+        return group
+    
+    def match_keywords(self, key):
+        for group, pattern in self.patterns:
+            if pattern.search(key):
+                return group
+        return 'Другое'
+
+_exercise_catalog = {}
+_exercise_catalog_lock = threading.Lock()
+
+def load_exercise_catalog():
+    """Записи каталога и классификатор; читаются из базы один раз на процесс
+    
+    Пока таблица не заполнена (миграции не применены), используется STANDARD_EXERCISES.
+    """
+    if not _exercise_catalog:
+        with _exercise_catalog_lock:
+            if not _exercise_catalog:
+                entries = [{
+                    'name': row.name,
+                    'muscle_group': row.muscle_group,
+                    'met': row.met_value,
+                    'description': row.description or '',
+                    'aliases': row.get_aliases()
+                } for row in ExerciseCatalog.query.order_by(ExerciseCatalog.position, ExerciseCatalog.id)]
+                if not entries:
+                    entries = [dict(entry, description='') for entry in STANDARD_EXERCISES]
+                _exercise_catalog['entries'] = entries
+                _exercise_catalog['by_name'] = {entry['name']: entry for entry in entries}
+                _exercise_catalog['classifier'] = ExerciseClassifier(entries)
+    return _exercise_catalog
+
+def reset_exercise_catalog():
+    """Сбрасывает кэш каталога (после изменения таблицы)"""
+    with _exercise_catalog_lock:
+        _exercise_catalog.clear()
+
+def seed_exercise_catalog():
+    """Добавляет в каталог недостающие стандартные упражнения (существующие записи не меняются)"""
+    existing = {name for (name,) in db.session.query(ExerciseCatalog.name)}
+    for position, entry in enumerate(STANDARD_EXERCISES):
+        if entry['name'] in existing:
+            continue
+        row = ExerciseCatalog(
+            name=entry['name'],
+            muscle_group=entry['muscle_group'],
+            met_value=entry['met'],
+            description='',
+            position=position
+        )
+        row.set_aliases(entry['aliases'])
+        db.session.add(row)
+    db.session.flush()
+    reset_exercise_catalog()
+
+def standard_exercises_by_group():
+    """Стандартные упражнения каталога по группам мышц: {группа: [запись, ...]}"""
+    groups = {}
+    for entry in load_exercise_catalog()['entries']:
+        groups.setdefault(entry['muscle_group'], []).append(entry)
+    return groups
+
+def catalog_exercise(name):
+    """Запись каталога по точному названию или None"""
+    return load_exercise_catalog()['by_name'].get(name)
+
+@app.route('/exercise-catalog.js')
+def exercise_catalog_script():
+    """Каталог стандартных упражнений для static/exercises-data.js (выпадающие списки и MET)"""
+    catalog = {
+        group: [{'name': entry['name'], 'met': entry['met']} for entry in entries]
+        for group, entries in standard_exercises_by_group().items()
+    }
+    body = f'window.EXERCISE_CATALOG = {json.dumps(catalog, ensure_ascii=False)};\n'
+    response = app.response_class(body, mimetype='application/javascript')
+    response.set_etag(hashlib.sha1(body.encode('utf-8')).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response.make_conditional(request)
+
 # Вспомогательные функции
-def get_progress_data(user_id):
-    """Получение данных для графика прогресса"""
-    progress_data = {}
+def exercise_set_stats_query(user_id=None):
+    """Агрегаты подходов по каждому упражнению тренировок пользователя (GROUP BY в SQL)
+    
+    Валидными считаются подходы с весом и повторениями больше 0.
+    Без user_id запрос не ограничен пользователем (для пересчета по списку тренировок).
+    """
+    valid = db.and_(WorkoutSet.weight > 0, WorkoutSet.reps > 0)
+    query = db.session.query(
+        WorkoutExercise.id.label('exercise_id'),
+        WorkoutExercise.exercise_type.label('exercise_type'),
+        WorkoutSession.id.label('session_id'),
+        WorkoutSession.user_id.label('user_id'),
+        WorkoutSession.date.label('date'),
+        db.func.count(WorkoutSet.id).label('total_sets'),
+        db.func.count(db.case((valid, WorkoutSet.id))).label('sets_count'),
+        db.func.max(db.case((WorkoutSet.weight > 0, WorkoutSet.weight))).label('top_weight'),
+        db.func.max(db.case((valid, WorkoutSet.weight))).label('max_weight'),
+        db.func.min(db.case((valid, WorkoutSet.reps))).label('min_reps'),
+        db.func.max(db.case((valid, WorkoutSet.reps))).label('max_reps'),
+        db.func.avg(db.case((valid, WorkoutSet.reps))).label('avg_reps'),
+        db.func.avg(db.case((WorkoutSet.weight > 0, WorkoutSet.weight))).label('avg_weight'),
+        db.func.coalesce(db.func.sum(db.case((valid, WorkoutSet.weight * WorkoutSet.reps))), 0.0).label('volume')
+    ).join(
+        WorkoutSession, WorkoutExercise.session_id == WorkoutSession.id
+    ).outerjoin(
+        WorkoutSet, WorkoutSet.exercise_id == WorkoutExercise.id
+    ).group_by(
+        WorkoutExercise.id, WorkoutExercise.exercise_type, WorkoutSession.id, WorkoutSession.user_id, WorkoutSession.date
+    )
     
-    user_sessions = WorkoutSession.query.filter_by(user_id=user_id).order_by(WorkoutSession.date).all()
-    for session in user_sessions:
-        for exercise in session.exercises:
-            if exercise.exercise_type not in progress_data:
-                progress_data[exercise.exercise_type] = {
-                    'dates': [], 
-                    'weights': [],
-                    'sets_data': []
-                }
-            
-            sets_data = exercise.get_sets_data()
-            if sets_data:
-                valid_weights = []
-                for set_data in sets_data:
-                    w = safe_float(set_data.get('weight'), 0)
-                    if w > 0:
-                        valid_weights.append(w)
-                
-                if valid_weights:
-                    max_weight = max(valid_weights)
-                    progress_data[exercise.exercise_type]['dates'].append(session.date.isoformat())
-                    progress_data[exercise.exercise_type]['weights'].append(max_weight)
-                    # Сохраняем данные по подходам для расчета метрик
-                    progress_data[exercise.exercise_type]['sets_data'].append(sets_data)
+    if user_id is not None:
+        query = query.filter(WorkoutSession.user_id == user_id)
+    return query
+
+def latest_exercise_stats_subquery(user_id, exercise_types):
+    """Подзапрос: агрегаты выполнений упражнений с номером по давности (position = 1 - последнее)"""
+    return exercise_set_stats_query(user_id).filter(
+        WorkoutExercise.exercise_type.in_(exercise_types)
+    ).add_columns(
+        db.func.row_number().over(
+            partition_by=WorkoutExercise.exercise_type,
+            order_by=(WorkoutSession.date.desc(), WorkoutExercise.id.desc())
+        ).label('position')
+    ).subquery()
+
+def latest_exercise_stats(user_id, exercise_types):
+    """Агрегаты последнего выполнения каждого упражнения (один оконный запрос)"""
+    if not exercise_types:
+        return {}
+    
+    ranked = latest_exercise_stats_subquery(user_id, exercise_types)
+    rows = db.session.query(ranked).filter(ranked.c.position == 1).all()
+    return {row.exercise_type: row for row in rows}
+
+def update_goals_progress(user_id, goals):
+    """Обновляет прогресс набора целей без отдельного запроса на каждую цель"""
+    stats = latest_exercise_stats(user_id, {goal.exercise_type for goal in goals})
+    for goal in goals:
+        goal.apply_progress(stats.get(goal.exercise_type))
+
+def recompute_goals_progress(user_id, exercise_types=None):
+    """Пересчитывает прогресс целей одним UPDATE ... FROM по оконному запросу
+    
+    exercise_types ограничивает пересчет целями по упражнениям только что записанной тренировки.
+    Цели без валидных подходов по упражнению не изменяются (как в FitnessGoal.apply_progress).
+    Возвращает число обновленных целей.
+    """
+    if exercise_types is None:
+        exercise_types = db.session.query(FitnessGoal.exercise_type).filter(
+            FitnessGoal.user_id == user_id
+        ).distinct().scalar_subquery()
+    elif not exercise_types:
+        return 0
+    
+    ranked = latest_exercise_stats_subquery(user_id, exercise_types)
+    completed = db.and_(
+        ranked.c.max_weight >= FitnessGoal.target_weight,
+        ranked.c.max_reps >= FitnessGoal.target_reps,
+        ranked.c.sets_count >= FitnessGoal.target_sets
+    )
     
-    return progress_data
+    result = db.session.execute(
+        db.update(FitnessGoal).where(
+            FitnessGoal.user_id == user_id,
+            FitnessGoal.exercise_type == ranked.c.exercise_type,
+            ranked.c.position == 1,
+            ranked.c.sets_count > 0
+        ).values(
+            current_weight=ranked.c.max_weight,
+            current_reps=ranked.c.max_reps,
+            current_sets=ranked.c.sets_count,
+            is_completed=db.case((completed, True), else_=False)
+        ).execution_options(synchronize_session=False)
+    )
+    return result.rowcount
 
-def validate_exercise_data(form_data):
-    """Валидация данных упражнений с подробным отчетом"""
-    errors = []
-    valid_exercises_count = 0
+def downsample_points(points, max_points):
+    """Равномерно прореживает ряд до max_points точек, сохраняя первую и последнюю"""
+    if not max_points or len(points) <= max_points:
+        return points
+    if max_points == 1:
+        return points[-1:]
+    step = (len(points) - 1) / (max_points - 1)
+    return [points[round(i * step)] for i in range(max_points)]
+
+def get_progress_data(user_id, max_points=None):
+    """Получение данных для графика прогресса из материализованного ряда ProgressPoint"""
+    points_by_exercise = {}
+    
+    points = db.session.query(
+        ProgressPoint.exercise_type,
+        ProgressPoint.date,
+        ProgressPoint.max_weight,
+        ProgressPoint.avg_weight,
+        ProgressPoint.avg_reps,
+        ProgressPoint.volume
+    ).filter(
+        ProgressPoint.user_id == user_id
+    ).order_by(ProgressPoint.date, ProgressPoint.session_id, ProgressPoint.exercise_id).all()
+    
+    for point in points:
+        points_by_exercise.setdefault(point.exercise_type, []).append(point)
     
-    # Получаем все индексы упражнений
-    exercise_indices = set()
-    for key in form_data.keys():
-        if key.startswith('exercise_type_'):
-            try:
-                index = int(key.split('_')[2])
-                exercise_indices.add(index)
-            except:
-                pass
+    progress_data = {}
+    for exercise_type, exercise_points in points_by_exercise.items():
+        exercise_points = downsample_points(exercise_points, max_points)
+        progress_data[exercise_type] = {
+            'dates': [p.date.isoformat() for p in exercise_points],
+            'weights': [p.max_weight for p in exercise_points],
+            'avg_weights': [round(p.avg_weight or 0, 2) for p in exercise_points],
+            'reps': [round(p.avg_reps or 0, 2) for p in exercise_points],
+            'volumes': [p.volume or 0 for p in exercise_points]
+        }
     
-    print(f"DEBUG: Найдено упражнений: {len(exercise_indices)}, индексы: {sorted(exercise_indices)}")
+    return progress_data
+
+def record_progress_points(session_ids):
+    """Добавляет точки ряда прогресса для упражнений указанных тренировок"""
+    rows = exercise_set_stats_query().filter(WorkoutSession.id.in_(session_ids)).all()
     
-    for exercise_count in sorted(exercise_indices):
-        exercise_type = form_data.get(f'exercise_type_{exercise_count}', '').strip()
-        
-        print(f"DEBUG: Упражнение {exercise_count}: '{exercise_type}'")
-        
-        if not exercise_type:
-            print(f"DEBUG: Упражнение {exercise_count} пропущено (пустое)")
+    for row in rows:
+        if not row.top_weight:
             continue
+        db.session.add(ProgressPoint(
+            user_id=row.user_id,
+            session_id=row.session_id,
+            exercise_id=row.exercise_id,
+            exercise_type=row.exercise_type,
+            date=row.date,
+            max_weight=row.top_weight,
+            avg_weight=safe_float(row.avg_weight, 0.0),
+            avg_reps=safe_float(row.avg_reps, 0.0),
+            volume=safe_float(row.volume, 0.0)
+        ))
+
+def backfill_progress_points(batch_size=500):
+    """Строит ряды прогресса для тренировок, записанных до появления ProgressPoint"""
+    processed = 0
+    last_id = 0
+    
+    while True:
+        session_ids = [row.id for row in db.session.query(WorkoutSession.id).outerjoin(
+            ProgressPoint, ProgressPoint.session_id == WorkoutSession.id
+        ).filter(
+            ProgressPoint.id.is_(None),
+            WorkoutSession.id > last_id
+        ).order_by(WorkoutSession.id).limit(batch_size).all()]
         
-        valid_exercises_count += 1
-        has_valid_sets = False
+        if not session_ids:
+            break
         
-        # Получаем все индексы подходов для этого упражнения
-        set_indices = set()
-        for key in form_data.keys():
-            if key.startswith(f'weight_{exercise_count}_'):
-                try:
-                    set_idx = int(key.split('_')[2])
-                    set_indices.add(set_idx)
-                except:
-                    pass
+        record_progress_points(session_ids)
+        processed += len(session_ids)
+        last_id = session_ids[-1]
+        db.session.commit()
+    
+    return processed
+
+def backfill_workout_sets(batch_size=500):
+    """Переносит подходы из JSON WorkoutExercise.sets_data в таблицу workout_set"""
+    migrated = 0
+    last_id = 0
+    
+    while True:
+        pending = WorkoutExercise.query.outerjoin(
+            WorkoutSet, WorkoutSet.exercise_id == WorkoutExercise.id
+        ).filter(
+            WorkoutSet.id.is_(None),
+            WorkoutExercise.id > last_id
+        ).order_by(WorkoutExercise.id).limit(batch_size).all()
         
-        print(f"DEBUG: Упражнение {exercise_count} ({exercise_type}): найдено подходов: {len(set_indices)}, индексы: {sorted(set_indices)}")
+        if not pending:
+            break
         
-        for set_count in sorted(set_indices):
-            weight_key = f'weight_{exercise_count}_{set_count}'
-            reps_key = f'reps_{exercise_count}_{set_count}'
-            
-            weight = form_data.get(weight_key, '').strip()
-            reps = form_data.get(reps_key, '').strip()
-            
-            print(f"DEBUG: Подход {set_count}: вес={weight}, повторения={reps}")
-            
-            if weight and reps:
-                try:
-                    weight_val = float(weight)
-                    reps_val = int(reps)
-                    if weight_val > 0 and reps_val > 0:
-                        has_valid_sets = True
-                        print(f"DEBUG: Подход {set_count} валиден: {weight_val}кг x {reps_val}повт")
-                    else:
-                        error_msg = f'Вес и повторения должны быть больше 0 в подходе {set_count + 1} упражнения "{exercise_type}"'
-                        errors.append(error_msg)
-                        print(f"DEBUG: {error_msg}")
-                except ValueError as e:
-                    error_msg = f'Некорректные данные в подходе {set_count + 1} упражнения "{exercise_type}": {str(e)}'
-                    errors.append(error_msg)
-                    print(f"DEBUG: {error_msg}")
-            else:
-                print(f"DEBUG: Подход {set_count} пропущен (пустой)")
+        for exercise in pending:
+            exercise.set_sets_data(exercise.get_sets_data())
+            migrated += 1
         
-        if not has_valid_sets:
-            error_msg = f'Упражнение "{exercise_type}" не имеет валидных подходов. Проверьте, что вес и повторения заполнены.'
-            errors.append(error_msg)
-            print(f"DEBUG: {error_msg}")
+        last_id = pending[-1].id
+        db.session.commit()
     
-    if valid_exercises_count == 0:
-        errors.append('Не добавлено ни одного упражнения с заполненным названием')
-        print("DEBUG: Нет валидных упражнений")
+    return migrated
+
+def aggregate_workouts_by_date(user_id, start_date=None, end_date=None):
+    """Агрегаты тренировок по дням (два GROUP BY запроса)"""
+    filters = [WorkoutSession.user_id == user_id]
+    if start_date:
+        filters.append(WorkoutSession.date >= start_date)
+    if end_date:
+        filters.append(WorkoutSession.date <= end_date)
+    
+    by_date = {}
+    totals = db.session.query(
+        WorkoutSession.date,
+        db.func.count(WorkoutSession.id),
+        db.func.coalesce(db.func.sum(WorkoutSession.total_calories), 0.0)
+    ).filter(*filters).group_by(WorkoutSession.date).all()
+    for day, workouts, calories in totals:
+        by_date[day] = {'workouts': workouts, 'calories': calories, 'exercises': {}}
+    
+    exercise_rows = db.session.query(
+        WorkoutSession.date,
+        WorkoutExercise.exercise_type,
+        db.func.count(db.distinct(WorkoutSession.id)),
+        db.func.sum(WorkoutSet.weight * WorkoutSet.reps),
+        db.func.max(WorkoutSet.weight)
+    ).select_from(WorkoutSet).join(
+        WorkoutExercise, WorkoutSet.exercise_id == WorkoutExercise.id
+    ).join(
+        WorkoutSession, WorkoutSet.session_id == WorkoutSession.id
+    ).filter(
+        *filters,
+        WorkoutSet.weight > 0,
+        WorkoutSet.reps > 0
+    ).group_by(WorkoutSession.date, WorkoutExercise.exercise_type).all()
+    for day, exercise_type, sessions_count, volume_load, max_weight in exercise_rows:
+        by_date[day]['exercises'][exercise_type] = {
+            'sessions': sessions_count,
+            'volume_load': float(volume_load),
+            'max_weight': max_weight
+        }
     
-    print(f"DEBUG: Итого валидных упражнений: {valid_exercises_count}, ошибок: {len(errors)}")
-    return errors
+    return by_date
 
-# МАРШРУТЫ
+def merge_rollup_data(target, source):
+    """Добавляет агрегаты source к target (для недельных агрегатов из дневных)"""
+    target['workouts'] += source['workouts']
+    target['calories'] += source['calories']
+    for exercise_type, data in source['exercises'].items():
+        merged = target['exercises'].setdefault(exercise_type, {'sessions': 0, 'volume_load': 0.0, 'max_weight': 0.0})
+        merged['sessions'] += data['sessions']
+        merged['volume_load'] += data['volume_load']
+        merged['max_weight'] = max(merged['max_weight'], data['max_weight'])
+    return target
 
-# Аутентификация
-@app.route('/register', methods=['GET', 'POST'])
-def register():
-    if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+def write_rollup(user_id, period, period_start, data):
+    """Сохраняет агрегаты периода (существующие строки должны быть удалены заранее)"""
+    if not data or not data['workouts']:
+        return
+    db.session.add(WorkoutRollup(
+        user_id=user_id,
+        period=period,
+        period_start=period_start,
+        workouts_count=data['workouts'],
+        total_calories=data['calories']
+    ))
+    for exercise_type, exercise_data in data['exercises'].items():
+        db.session.add(ExerciseRollup(
+            user_id=user_id,
+            period=period,
+            period_start=period_start,
+            exercise_type=exercise_type,
+            sessions_count=exercise_data['sessions'],
+            volume_load=exercise_data['volume_load'],
+            max_weight=exercise_data['max_weight']
+        ))
+
+def refresh_rollups(user_id, day):
+    """Пересчитывает дневной и недельный агрегаты, затронутые изменением тренировки за day"""
+    invalidate_calendar_history(user_id, day)
+    week_start = day - timedelta(days=day.weekday())
+    by_date = aggregate_workouts_by_date(user_id, week_start, week_start + timedelta(days=6))
+    
+    for model in (WorkoutRollup, ExerciseRollup):
+        model.query.filter(
+            model.user_id == user_id,
+            db.or_(
+                db.and_(model.period == 'day', model.period_start == day),
+                db.and_(model.period == 'week', model.period_start == week_start)
+            )
+        ).delete(synchronize_session=False)
     
-    if request.method == 'POST':
-        username = request.form.get('username', '').strip()
-        email = request.form.get('email', '').strip()
-        password = request.form.get('password', '')
-        weight = request.form.get('weight', '70')  # НОВОЕ: получаем вес
-        
-        if not username or not email or not password:
-            flash('Все поля обязательны для заполнения', 'error')
-            return render_template('register.html')
-        
-        if len(username) < 3 or len(username) > 50:
-            flash('Имя пользователя должно быть от 3 до 50 символов', 'error')
-            return render_template('register.html')
-        
-        if '@' not in email or '.' not in email:
-            flash('Введите корректный email', 'error')
-            return render_template('register.html')
-        
-        if len(password) < 6:
-            flash('Пароль должен быть не короче 6 символов', 'error')
-            return render_template('register.html')
-        
-        if User.query.filter_by(username=username).first():
-            flash('Имя пользователя уже существует', 'error')
-            return render_template('register.html')
+    week_data = {'workouts': 0, 'calories': 0.0, 'exercises': {}}
+    for day_data in by_date.values():
+        merge_rollup_data(week_data, day_data)
+    
+    write_rollup(user_id, 'day', day, by_date.get(day))
+    write_rollup(user_id, 'week', week_start, week_data)
+
+def rebuild_rollups(user_id=None, invalidate_calendar=True):
+    """Полностью перестраивает агрегаты (для всех пользователей или одного)
+    
+    invalidate_calendar=False - для миграций: они идут до появления user.calendar_version,
+    а кэша календаря на этот момент еще нет.
+    """
+    user_ids = [user_id] if user_id else [row.id for row in db.session.query(User.id).all()]
+    
+    for uid in user_ids:
+        WorkoutRollup.query.filter_by(user_id=uid).delete(synchronize_session=False)
+        ExerciseRollup.query.filter_by(user_id=uid).delete(synchronize_session=False)
+        if invalidate_calendar:
+            invalidate_calendar_history(uid)
         
-        if User.query.filter_by(email=email).first():
-            flash('Email уже зарегистрирован', 'error')
-            return render_template('register.html')
+        weeks = {}
+        for day, day_data in aggregate_workouts_by_date(uid).items():
+            write_rollup(uid, 'day', day, day_data)
+            week_start = day - timedelta(days=day.weekday())
+            week_data = weeks.setdefault(week_start, {'workouts': 0, 'calories': 0.0, 'exercises': {}})
+            merge_rollup_data(week_data, day_data)
         
-        user = User(username=username, email=email, weight=safe_float(weight, 70.0))
-        user.set_password(password)
+        for week_start, week_data in weeks.items():
+            write_rollup(uid, 'week', week_start, week_data)
         
-        try:
-            db.session.add(user)
-            db.session.commit()
-            login_user(user)
-            flash('Регистрация успешна! Добро пожаловать!', 'success')
-            return redirect(url_for('dashboard'))
-        except Exception as e:
-            db.session.rollback()
-            flash(f'Ошибка при регистрации: {str(e)}', 'error')
+        db.session.commit()
     
-    return render_template('register.html')
+    return len(user_ids)
 
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if current_user.is_authenticated:
+def rollup_period_filter(model, start_date, end_date):
+    """Условие выборки агрегатов, покрывающих [start_date, end_date]
+    
+    Полные недели берутся из недельных агрегатов, края диапазона - из дневных.
+    """
+    weeks_start = start_date + timedelta(days=(7 - start_date.weekday()) % 7)
+    weeks_end = end_date - timedelta(days=(end_date.weekday() + 1) % 7)
+    
+    if weeks_start + timedelta(days=6) > weeks_end:
+        return db.and_(model.period == 'day', model.period_start.between(start_date, end_date))
+    
+    return db.or_(
+        db.and_(model.period == 'week', model.period_start.between(weeks_start, weeks_end - timedelta(days=6))),
+        db.and_(model.period == 'day', model.period_start.between(start_date, weeks_start - timedelta(days=1))),
+        db.and_(model.period == 'day', model.period_start.between(weeks_end + timedelta(days=1), end_date))
+    )
+
+# Календарь тренировок: дневные итоги помесячными корзинами
+def month_start(day):
+    return day.replace(day=1)
+
+def next_month_start(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def invalidate_calendar_history(user_id, day=None):
+    """Делает устаревшими закэшированные прошлые месяцы календаря (day=None - при любой дате)
+    
+    Текущий месяц не кэшируется, поэтому обычная запись сегодняшней тренировки
+    кэш прошлых месяцев не затрагивает.
+    """
+    if day is None or day < month_start(date.today()):
+        User.query.filter_by(id=user_id).update(
+            {'calendar_version': User.calendar_version + 1}, synchronize_session=False
+        )
+
+def aggregate_calendar_days(user_id, start_date, end_date):
+    """Число тренировок, калории и длительность по дням диапазона одним GROUP BY date (индекс user_id, date)"""
+    rows = db.session.query(
+        WorkoutSession.date,
+        db.func.count(WorkoutSession.id),
+        db.func.coalesce(db.func.sum(WorkoutSession.total_calories), 0.0),
+        db.func.coalesce(db.func.sum(WorkoutSession.duration_minutes), 0.0)
+    ).filter(
+        WorkoutSession.user_id == user_id,
+        WorkoutSession.date.between(start_date, end_date)
+    ).group_by(WorkoutSession.date).order_by(WorkoutSession.date).all()
+    
+    return {
+        day.isoformat(): {'workouts': workouts, 'calories': round(calories, 1), 'duration': round(duration, 1)}
+        for day, workouts, calories, duration in rows
+    }
+
+def get_calendar_days(user, start_date, end_date):
+    """Дневные итоги за [start_date, end_date] из помесячных корзин
+    
+    Прошедшие месяцы не меняются, пока не изменятся их тренировки (calendar_version),
+    и хранятся в кэше ответов без срока; текущий и будущие месяцы, а также
+    отсутствующие в кэше считаются одним запросом.
+    """
+    current_month = month_start(date.today())
+    days = {}
+    missing = []
+    
+    month = month_start(start_date)
+    while month <= end_date:
+        cached = None
+        if month < current_month:
+            cached = response_cache.get(f'calendar:{user.id}:{user.calendar_version}:{month:%Y-%m}')
+        if cached is not None:
+            days.update(json.loads(cached))
+        else:
+            missing.append(month)
+        month = next_month_start(month)
+    
+    if missing:
+        computed = aggregate_calendar_days(user.id, missing[0], next_month_start(missing[-1]) - timedelta(days=1))
+        for month in missing:
+            prefix = f'{month:%Y-%m}-'
+            bucket = {day: data for day, data in computed.items() if day.startswith(prefix)}
+            if month < current_month:
+                response_cache.set(f'calendar:{user.id}:{user.calendar_version}:{month:%Y-%m}',
+                                   json.dumps(bucket).encode('utf-8'))
+            days.update(bucket)
+    
+    start_key, end_key = start_date.isoformat(), end_date.isoformat()
+    return {day: data for day, data in sorted(days.items()) if start_key <= day <= end_key}
+
+def get_period_stats(user_id, start_date, end_date):
+    """Статистика тренировок за период по предрассчитанным агрегатам"""
+    total_workouts, total_calories = db.session.query(
+        db.func.coalesce(db.func.sum(WorkoutRollup.workouts_count), 0),
+        db.func.coalesce(db.func.sum(WorkoutRollup.total_calories), 0.0)
+    ).filter(
+        WorkoutRollup.user_id == user_id,
+        rollup_period_filter(WorkoutRollup, start_date, end_date)
+    ).one()
+    
+    exercise_rows = db.session.query(
+        ExerciseRollup.exercise_type,
+        db.func.sum(ExerciseRollup.sessions_count),
+        db.func.sum(ExerciseRollup.volume_load),
+        db.func.max(ExerciseRollup.max_weight)
+    ).filter(
+        ExerciseRollup.user_id == user_id,
+        rollup_period_filter(ExerciseRollup, start_date, end_date)
+    ).group_by(ExerciseRollup.exercise_type).all()
+    
+    exercise_stats = {}
+    total_volume = 0
+    for exercise_type, count, volume_load, max_weight in exercise_rows:
+        exercise_stats[exercise_type] = {
+            'count': int(count),
+            'total_volume': volume_load,
+            'max_weight': max_weight
+        }
+        total_volume += volume_load
+    
+    return {
+        'total_workouts': int(total_workouts),
+        'total_calories': total_calories,
+        'total_volume': total_volume,
+        'exercise_stats': exercise_stats
+    }
+
+# Построители запросов с предзагрузкой связей (без N+1 при обходе тренировок)
+def sessions_query(user_id, with_sets=True):
+    """Тренировки пользователя с упражнениями (и подходами), подгруженными selectinload"""
+    load = db.selectinload(WorkoutSession.exercises)
+    if with_sets:
+        load = load.selectinload(WorkoutExercise.sets)
+    return WorkoutSession.query.options(load).filter(WorkoutSession.user_id == user_id)
+
+def load_set_arrays(user_id, exercise_types=None, session_ids=None):
+    """Подходы пользователя в массивах NumPy (workout_analytics.SetArrays)
+    
+    exercise_types и session_ids сужают выборку (None - без ограничения).
+    Загружаются одним запросом без создания ORM-объектов и кэшируются в g
+    до конца запроса, поэтому несколько расчетов в одном view не читают их повторно.
+    """
+    key = (
+        user_id,
+        tuple(sorted(exercise_types)) if exercise_types is not None else None,
+        tuple(sorted(session_ids)) if session_ids is not None else None
+    )
+    cache = g.setdefault('set_arrays', {}) if has_request_context() else {}
+    if key in cache:
+        return cache[key]
+    
+    query = db.session.query(
+        WorkoutSet.session_id,
+        WorkoutSet.exercise_id,
+        WorkoutExercise.exercise_type,
+        WorkoutSession.date,
+        WorkoutSet.weight,
+        WorkoutSet.reps
+    ).join(
+        WorkoutExercise, WorkoutSet.exercise_id == WorkoutExercise.id
+    ).join(
+        WorkoutSession, WorkoutSet.session_id == WorkoutSession.id
+    ).filter(WorkoutSession.user_id == user_id)
+    if exercise_types is not None:
+        query = query.filter(WorkoutExercise.exercise_type.in_(list(exercise_types)))
+    if session_ids is not None:
+        query = query.filter(WorkoutSet.session_id.in_(list(session_ids)))
+    
+    rows = query.order_by(
+        WorkoutSession.date.asc(), WorkoutSession.id.asc(), WorkoutExercise.id.asc(), WorkoutSet.set_number.asc()
+    ).all()
+    cache[key] = workout_analytics.SetArrays.from_rows(rows)
+    return cache[key]
+
+def iter_session_batches(user_id, batch_size=200):
+    """Постранично выдает тренировки пользователя (новые первыми) с подгруженными подходами
+    
+    Используется keyset-пагинация по (date, id), поэтому стоимость страницы
+    не растет с глубиной выгрузки.
+    """
+    last_date, last_id = None, None
+    
+    while True:
+        query = sessions_query(user_id)
+        
+        if last_id is not None:
+            query = query.filter(db.or_(
+                WorkoutSession.date < last_date,
+                db.and_(WorkoutSession.date == last_date, WorkoutSession.id < last_id)
+            ))
+        
+        batch = query.order_by(WorkoutSession.date.desc(), WorkoutSession.id.desc()).limit(batch_size).all()
+        if not batch:
+            return
+        
+        yield batch
+        last_date, last_id = batch[-1].date, batch[-1].id
+
+def build_dashboard_data(user_id):
+    """Собирает данные дашборда фиксированным числом запросов
+    
+    Количество запросов не зависит от числа целей, групп мышц и тренировок.
+    """
+    today = date.today()
+    week_ago = today - timedelta(days=7)
+    
+    recent_sessions = sessions_query(user_id).order_by(WorkoutSession.date.desc()).limit(5).all()
+    
+    active_goals = FitnessGoal.query.filter_by(
+        user_id=user_id,
+        is_completed=False
+    ).order_by(FitnessGoal.target_date.asc()).all()
+    
+    update_goals_progress(user_id, active_goals)
+    
+    # Количество и средняя продолжительность тренировок за неделю одним запросом
+    week_workouts_count, total_duration = db.session.query(
+        db.func.count(WorkoutSession.id),
+        db.func.coalesce(db.func.sum(WorkoutSession.duration_minutes), 0.0)
+    ).filter(
+        WorkoutSession.user_id == user_id,
+        WorkoutSession.date >= week_ago
+    ).one()
+    avg_duration = total_duration / week_workouts_count if week_workouts_count else 0
+    
+    progress_data = get_progress_data(user_id, app.config['PROGRESS_MAX_POINTS'])
+    
+    week_calories = db.session.query(db.func.sum(CalorieTracking.calories_burned)).filter(
+        CalorieTracking.user_id == user_id,
+        CalorieTracking.date >= week_ago
+    ).scalar() or 0
+    
+    # Подсчет тренировок по группам мышц за неделю
+    muscle_group_exercises = {
+        'Грудь': ['Жим лежа', 'Сведение рук в кроссовере на грудь'],
+        'Руки': ['Разгибания на трицепс с канатной рукоятью в кроссовере', 'Сгибания на бицепс в рычажном тренажере'],
+        'Плечи': ['Махи на плечи со свободным весом', 'Отведение плеча в блочном тренажере "reverse fly"'],
+        'Ягодицы': ['Ягодичный мост в рычажном тренажере', 'Разгибание бедра стоя в кроссовере / рычажном тренажере', 'Отведение бедра сидя в сдвоенном блочном тренажере (большая ягодичная)', 'Отведение с наклоном вперед бедра сидя в сдвоенном блочном тренажере (малая и средняя ягодичные)'],
+        'Ноги': ['Болгарские выпады со свободным весом / в смите', 'Приседание в Смите'],
+        'Спина': ['Вертикальная тяга сидя', 'Горизонтальная тяга троссовая в блочном тренажере', 'Экстензия на наклонной скамье']
+    }
+    
+    muscle_group = db.case(
+        *[(WorkoutExercise.exercise_type.in_(exercises), group) for group, exercises in muscle_group_exercises.items()]
+    ).label('muscle_group')
+    all_group_exercises = [ex for exercises in muscle_group_exercises.values() for ex in exercises]
+    
+    muscle_group_data = {group: 0 for group in muscle_group_exercises}
+    muscle_group_rows = db.session.query(
+        muscle_group,
+        db.func.count(db.distinct(WorkoutSession.id))
+    ).join(
+        WorkoutSession, WorkoutExercise.session_id == WorkoutSession.id
+    ).filter(
+        WorkoutSession.user_id == user_id,
+        WorkoutSession.date >= week_ago,
+        WorkoutExercise.exercise_type.in_(all_group_exercises)
+    ).group_by(muscle_group).all()
+    for group, count in muscle_group_rows:
+        muscle_group_data[group] = count
+    
+    active_progressions = ProgressionPlan.query.filter_by(
+        user_id=user_id,
+        is_active=True
+    ).all()
+    
+    workout_streak = WorkoutStreak.query.filter_by(
+        user_id=user_id,
+        streak_type='workout'
+    ).first()
+    
+    streak_days = workout_streak.current_streak if workout_streak else 0
+    longest_streak = workout_streak.longest_streak if workout_streak else 0
+    
+    active_double_progressions = DoubleProgression.query.filter_by(
+        user_id=user_id,
+        is_active=True
+    ).all()
+    
+    return {
+        'recent_sessions': recent_sessions,
+        'active_goals': active_goals,
+        'week_workouts_count': week_workouts_count,
+        'progress_data': json.dumps(progress_data),
+        'week_calories': round(week_calories, 1),
+        'active_progressions': active_progressions,
+        'streak_days': streak_days,
+        'longest_streak': longest_streak,
+        'active_double_progressions': active_double_progressions,
+        'avg_duration': avg_duration,
+        'muscle_group_data': muscle_group_data
+    }
+
+# Снимок признаков для ИИ помощника
+RecentSession = namedtuple('RecentSession', ['id', 'date'])
+
+def refresh_feature_snapshot(user_id, snapshot=None):
+    """Пересчитывает снимок признаков пользователя по его последним тренировкам
+    
+    Объем работы ограничен 30 последними тренировками и не зависит от длины истории.
+    В features_data хранятся:
+    recent_sessions - [id, дата] 30 последних тренировок (новые первыми);
+    muscle_groups_used, exercises_used - счетчики по 7 последним тренировкам;
+    exercise_progress - {упражнение: [[дата, макс. вес], ...]} по 7 последним (новые первыми);
+    progression - {упражнение: [[дата, макс. вес, ср. повторения], ...]} по 20 последним (по возрастанию даты).
+    """
+    # Общее число тренировок приходит оконной функцией в том же запросе
+    recent = db.session.query(
+        WorkoutSession.id,
+        WorkoutSession.date,
+        db.func.count().over().label('total_workouts')
+    ).filter(
+        WorkoutSession.user_id == user_id
+    ).order_by(WorkoutSession.date.desc(), WorkoutSession.id.desc()).limit(30).all()
+    total_workouts = recent[0].total_workouts if recent else 0
+    
+    features = {
+        'recent_sessions': [[row.id, row.date.isoformat()] for row in recent],
+        'muscle_groups_used': {},
+        'exercises_used': {},
+        'exercise_progress': {},
+        'progression': {}
+    }
+    
+    if recent:
+        week_position = {row.id: pos for pos, row in enumerate(recent[:7])}
+        exercises = db.session.query(WorkoutExercise.session_id, WorkoutExercise.exercise_type).filter(
+            WorkoutExercise.session_id.in_(list(week_position))
+        ).order_by(WorkoutExercise.id).all()
+        custom_groups = dict(db.session.query(CustomExercise.name, CustomExercise.muscle_group).filter(
+            CustomExercise.user_id == user_id
+        ))
+        for exercise in sorted(exercises, key=lambda row: week_position[row.session_id]):
+            muscle_group = determine_muscle_group(exercise.exercise_type, custom_groups)
+            features['muscle_groups_used'][muscle_group] = features['muscle_groups_used'].get(muscle_group, 0) + 1
+            features['exercises_used'][exercise.exercise_type] = features['exercises_used'].get(exercise.exercise_type, 0) + 1
+        
+        # Прогресс по упражнениям: подходы 20 последних тренировок одним запросом
+        arrays = load_set_arrays(user_id, session_ids=[row.id for row in recent[:20]])
+        instances = workout_analytics.exercise_instances(arrays)
+        for code, day, max_weight, avg_reps in zip(instances['exercise_code'], instances['day'],
+                                                   instances['max_weight'], instances['avg_reps']):
+            features['progression'].setdefault(arrays.exercise_names[code], []).append(
+                [date.fromordinal(int(day)).isoformat(), float(max_weight), float(avg_reps)]
+            )
+        
+        week_instances = [idx for idx, session_id in enumerate(instances['session_id']) if int(session_id) in week_position]
+        for idx in sorted(week_instances, key=lambda i: week_position[int(instances['session_id'][i])]):
+            features['exercise_progress'].setdefault(arrays.exercise_names[instances['exercise_code'][idx]], []).append(
+                [date.fromordinal(int(instances['day'][idx])).isoformat(), float(instances['max_weight'][idx])]
+            )
+    
+    if snapshot is None:
+        snapshot = db.session.get(UserFeatureSnapshot, user_id)
+    if snapshot is None:
+        snapshot = UserFeatureSnapshot(user_id=user_id)
+        db.session.add(snapshot)
+    snapshot.total_workouts = total_workouts
+    snapshot.set_features(features)
+    return snapshot
+
+def get_feature_snapshot(user_id):
+    """Снимок признаков одним запросом; если его еще нет (старые пользователи), он строится и сохраняется"""
+    snapshot = db.session.get(UserFeatureSnapshot, user_id)
+    if snapshot is None:
+        from sqlalchemy.exc import IntegrityError
+        snapshot = refresh_feature_snapshot(user_id, UserFeatureSnapshot(user_id=user_id))
+        db.session.add(snapshot)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Снимок параллельно создал обработчик пересчета
+            db.session.rollback()
+            snapshot = db.session.get(UserFeatureSnapshot, user_id)
+    return snapshot
+
+def snapshot_recent_sessions(features):
+    """Последние тренировки из снимка (id и дата) в порядке от новых к старым"""
+    return [RecentSession(session_id, date.fromisoformat(day)) for session_id, day in features.get('recent_sessions', [])]
+
+# Очередь пересчета производных данных
+def enqueue_derivation(user_id, session_id, activity_date=None):
+    """Ставит пересчет производных данных тренировки в очередь (в транзакции запроса)
+    
+    activity_date - день, когда тренировка записана (для офлайн-очереди - день записи на устройстве).
+    """
+    job = DerivationJob(user_id=user_id, session_id=session_id, activity_date=activity_date or date.today())
+    db.session.add(job)
+    return job
+
+def derive_workout_session(job):
+    """Калории, учет калорий и объема, ряд прогресса, агрегаты, цепочка и цели по тренировке
+    
+    Повторный запуск дает тот же результат: записи тренировки удаляются и создаются заново.
+    """
+    session = db.session.get(WorkoutSession, job.session_id)
+    if session is None:
+        return  # Тренировку удалили до обработки задачи
+    
+    user = db.session.get(User, job.user_id)
+    user_weight = safe_float(user.weight if user else None, 70.0)
+    try:
+        session.total_calories = session.calculate_calories(user_weight, "strength")
+    except Exception as e:
+        logger.warning('Пересчет %s: ⚠ Ошибка расчета калорий: %s', session.id, e)
+        session.total_calories = 200.0
+    
+    for model, column in ((CalorieTracking, CalorieTracking.workout_session_id),
+                          (VolumeLoadTracking, VolumeLoadTracking.session_id),
+                          (ProgressPoint, ProgressPoint.session_id)):
+        model.query.filter(column == session.id).delete(synchronize_session=False)
+    
+    db.session.add(CalorieTracking(
+        user_id=session.user_id,
+        workout_session_id=session.id,
+        date=session.date,
+        calories_burned=session.total_calories,
+        workout_duration=session.duration_minutes
+    ))
+    
+    for exercise_type, data in session.calculate_volume_load().items():
+        if data and data.get('volume_load'):
+            db.session.add(VolumeLoadTracking(
+                user_id=session.user_id,
+                exercise_type=exercise_type,
+                session_id=session.id,
+                date=session.date,
+                volume_load=safe_float(data.get('volume_load'), 0),
+                sets_count=safe_int(data.get('sets_count'), 0),
+                reps_count=safe_int(data.get('reps_count'), 0),
+                max_weight=safe_float(data.get('max_weight'), 0)
+            ))
+    
+    record_progress_points([session.id])
+    refresh_rollups(session.user_id, session.date)
+    
+    streak = WorkoutStreak.query.filter_by(user_id=session.user_id, streak_type='workout').first()
+    if not streak:
+        streak = WorkoutStreak(user_id=session.user_id, streak_type='workout')
+        db.session.add(streak)
+    streak.update_streak(job.activity_date)
+    
+    # Только цели по упражнениям этой тренировки
+    recompute_goals_progress(session.user_id, {exercise.exercise_type for exercise in session.exercises})
+    refresh_feature_snapshot(session.user_id)
+    bump_data_version(session.user_id)
+
+DERIVATION_HANDLERS = {
+    'workout_session': derive_workout_session
+}
+
+def claim_derivation_job():
+    """Забирает следующую задачу из очереди
+    
+    Задачи одного пользователя выполняются по одной: пользователь, у которого уже идет
+    пересчет, пропускается, иначе воркеры гонялись бы на цепочке, уникальных ключах
+    агрегатов и снимке признаков. Условный UPDATE не дает взять занятую задачу или
+    вторую задачу пользователя; в PostgreSQL проверки сериализует блокировка строки пользователя.
+    """
+    running = db.aliased(DerivationJob)
+    while True:
+        busy_users = db.session.query(running.user_id).filter(running.status == 'running')
+        job = DerivationJob.query.filter(
+            DerivationJob.status == 'pending',
+            DerivationJob.user_id.notin_(busy_users)
+        ).order_by(DerivationJob.id).first()
+        if job is None:
+            db.session.rollback()
+            return None
+        
+        db.session.query(User.id).filter(User.id == job.user_id).with_for_update().first()
+        claimed = DerivationJob.query.filter(
+            DerivationJob.id == job.id,
+            DerivationJob.status == 'pending',
+            ~db.exists().where(running.user_id == job.user_id, running.status == 'running')
+        ).update({
+            'status': 'running',
+            'attempts': DerivationJob.attempts + 1,
+            'updated_at': datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        
+        if claimed:
+            db.session.refresh(job)
+            return job
+
+def run_derivation_job(job):
+    """Выполняет задачу; успешные удаляются, упавшие возвращаются в очередь до исчерпания попыток"""
+    try:
+        DERIVATION_HANDLERS[job.job_type](job)
+        db.session.delete(job)
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(DerivationJob, job.id)
+        if job is not None:
+            job.error = str(e)
+            job.status = 'failed' if job.attempts >= app.config['DERIVATION_MAX_ATTEMPTS'] else 'pending'
+            db.session.commit()
+        logger.error('Пересчет: ✗ Ошибка задачи %s: %s', job.id if job else '?', e)
+        return False
+
+def run_pending_derivations(limit=None):
+    """Обрабатывает задачи очереди в текущем потоке, возвращает число обработанных"""
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_derivation_job()
+        if job is None:
+            break
+        run_derivation_job(job)
+        processed += 1
+    return processed
+
+def requeue_stale_derivations(max_age_minutes=10):
+    """Возвращает в очередь задачи, зависшие в работе после падения процесса"""
+    DerivationJob.query.filter(
+        DerivationJob.status == 'running',
+        DerivationJob.updated_at < datetime.utcnow() - timedelta(minutes=max_age_minutes)
+    ).update({'status': 'pending'}, synchronize_session=False)
+    db.session.commit()
+
+def pending_derivations_count(user_id):
+    """Число еще не выполненных пересчетов пользователя"""
+    return DerivationJob.query.filter(
+        DerivationJob.user_id == user_id,
+        DerivationJob.status.in_(['pending', 'running'])
+    ).count()
+
+class DerivationWorkerPool:
+    """Пул фоновых потоков, разбирающих очередь DerivationJob"""
+    
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.threads = []
+    
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            try:
+                with self.app.app_context():
+                    requeue_stale_derivations()
+            except Exception as e:
+                # Например, база еще не создана: воркеры все равно запускаются и опрашивают очередь
+                logger.warning('Пересчет: ⚠ Не удалось вернуть зависшие задачи: %s', e)
+            for idx in range(self.app.config['DERIVATION_WORKERS']):
+                thread = threading.Thread(target=self.run, name=f'derivation-worker-{idx}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+    
+    def notify(self):
+        self.wakeup.set()
+    
+    def run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    processed = run_pending_derivations(limit=50)
+            except Exception as e:
+                logger.error('Пересчет: ✗ Ошибка воркера: %s', e)
+                processed = 0
+            
+            if not processed:
+                self.wakeup.wait(self.app.config['DERIVATION_POLL_SECONDS'])
+                self.wakeup.clear()
+                # Зависшая задача блокирует очередь пользователя, поэтому проверяется при каждом простое
+                try:
+                    with self.app.app_context():
+                        requeue_stale_derivations()
+                except Exception as e:
+                    logger.error('Пересчет: ✗ Ошибка возврата зависших задач: %s', e)
+
+derivation_pool = DerivationWorkerPool(app)
+
+def notify_derivation_workers():
+    """Вызывается после коммита: будит пул или, если пул выключен, выполняет очередь сразу"""
+    if app.config['DERIVATION_WORKERS'] > 0:
+        derivation_pool.start()
+        derivation_pool.notify()
+    else:
+        run_pending_derivations()
+
+# Инструментирование запросов: время, число и время SQL-запросов, бюджеты представлений
+class SQLBudgetExceeded(Exception):
+    """Представление выполнило больше SQL-запросов, чем разрешено его бюджетом"""
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_sql_statement(conn, cursor, statement, parameters, context, executemany):
+    # Считаются только запросы текущего HTTP-запроса (фоновые воркеры не учитываются)
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        if context is not None:
+            context.instrumentation_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def time_sql_statement(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'instrumentation_started', None)
+    if started is not None and has_request_context():
+        g.sql_time = g.get('sql_time', 0.0) + time.perf_counter() - started
+
+class RequestMetrics:
+    """Метрики запросов процесса в формате Prometheus (у каждого воркера gunicorn свои)"""
+    
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}  # (endpoint, method, status) -> количество
+        self.durations = {}  # endpoint -> [счетчики корзин, сумма, количество]
+        self.sql = {}  # endpoint -> [запросов, секунд]
+    
+    def observe(self, endpoint, method, status, duration, sql_statements, sql_time):
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            
+            histogram = self.durations.setdefault(endpoint, [[0] * len(self.BUCKETS), 0.0, 0])
+            for idx, bound in enumerate(self.BUCKETS):
+                if duration <= bound:
+                    histogram[0][idx] += 1
+            histogram[1] += duration
+            histogram[2] += 1
+            
+            sql = self.sql.setdefault(endpoint, [0, 0.0])
+            sql[0] += sql_statements
+            sql[1] += sql_time
+    
+    def render(self):
+        lines = [
+            '# HELP fitness_http_requests_total HTTP-запросы по маршруту, методу и статусу',
+            '# TYPE fitness_http_requests_total counter'
+        ]
+        with self.lock:
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'fitness_http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            
+            lines.append('# HELP fitness_http_request_duration_seconds Время обработки запроса')
+            lines.append('# TYPE fitness_http_request_duration_seconds histogram')
+            for endpoint, (buckets, total, count) in sorted(self.durations.items()):
+                for bound, bucket_count in zip(self.BUCKETS, buckets):
+                    lines.append(f'fitness_http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {bucket_count}')
+                lines.append(f'fitness_http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {count}')
+                lines.append(f'fitness_http_request_duration_seconds_sum{{endpoint="{endpoint}"}} {total:.6f}')
+                lines.append(f'fitness_http_request_duration_seconds_count{{endpoint="{endpoint}"}} {count}')
+            
+            lines.append('# HELP fitness_sql_statements_total SQL-запросы, выполненные при обработке маршрута')
+            lines.append('# TYPE fitness_sql_statements_total counter')
+            for endpoint, (statements, _) in sorted(self.sql.items()):
+                lines.append(f'fitness_sql_statements_total{{endpoint="{endpoint}"}} {statements}')
+            
+            lines.append('# HELP fitness_sql_duration_seconds_total Время SQL-запросов маршрута')
+            lines.append('# TYPE fitness_sql_duration_seconds_total counter')
+            for endpoint, (_, seconds) in sorted(self.sql.items()):
+                lines.append(f'fitness_sql_duration_seconds_total{{endpoint="{endpoint}"}} {seconds:.6f}')
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+def observe_request(endpoint, method, status, started, stats):
+    """Записывает метрики завершенного запроса; возвращает (длительность, запросов SQL, время SQL)"""
+    duration = time.perf_counter() - started
+    sql_statements = stats.get('sql_statements', 0)
+    sql_time = stats.get('sql_time', 0.0)
+    
+    request_metrics.observe(endpoint, method, status, duration, sql_statements, sql_time)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('request endpoint=%s method=%s status=%s duration_ms=%.1f sql_statements=%s sql_ms=%.1f',
+                     endpoint, method, status, duration * 1000, sql_statements, sql_time * 1000)
+    return duration, sql_statements, sql_time
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    
+    endpoint = request.endpoint or 'unknown'
+    stats = g._get_current_object()
+    
+    if response.is_streamed:
+        # Тело потокового ответа (выгрузка, SSE, файл) формируется после after_request:
+        # метрики снимаются при закрытии ответа, а Server-Timing не отправляется -
+        # заголовки уходят раньше, чем становятся известны итоговые значения
+        method, status = request.method, response.status_code
+        response.call_on_close(lambda: observe_request(endpoint, method, status, started, stats))
+        return response
+    
+    duration, sql_statements, sql_time = observe_request(endpoint, request.method, response.status_code, started, stats)
+    response.headers['Server-Timing'] = (
+        f'app;dur={duration * 1000:.1f}, '
+        f'db;dur={sql_time * 1000:.1f};desc="{sql_statements} queries"'
+    )
+    return response
+
+def sql_budget(max_statements):
+    """Ограничивает число SQL-запросов представления, включая загрузку пользователя и шаблон
+    
+    Превышение пишется в лог, а в тестах (или при SQL_BUDGET_STRICT) вызывает SQLBudgetExceeded.
+    Тело потокового ответа (SSE) формируется уже после возврата из представления,
+    поэтому для него бюджет проверяется при закрытии ответа.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            response = view(*args, **kwargs)
+            stats = g._get_current_object()
+            endpoint = request.endpoint
+            
+            def check():
+                used = stats.get('sql_statements', 0)
+                if used > max_statements:
+                    message = f'{endpoint}: {used} SQL-запросов при бюджете {max_statements}'
+                    if app.config['SQL_BUDGET_STRICT'] or app.testing:
+                        raise SQLBudgetExceeded(message)
+                    logger.warning('%s', message)
+            
+            if isinstance(response, app.response_class) and response.is_streamed:
+                response.call_on_close(check)
+            else:
+                check()
+            return response
+        wrapper.sql_budget = max_statements
+        return wrapper
+    return decorator
+
+# Кэш ответов API
+def bump_data_version(user_id):
+    """Увеличивает версию данных пользователя: закэшированные ответы и ETag становятся устаревшими
+    
+    Вызывается в транзакции каждой записи данных пользователя, до коммита.
+    """
+    User.query.filter_by(id=user_id).update(
+        {'data_version': User.data_version + 1}, synchronize_session=False
+    )
+
+class LRUResponseCache:
+    """Кэш ответов в памяти процесса с ограничением числа записей"""
+    
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class RedisResponseCache:
+    """Кэш ответов в Redis (общий для всех процессов gunicorn)"""
+    
+    def __init__(self, url, ttl=3600):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+    
+    def get(self, key):
+        try:
+            return self.client.get(key)
+        except Exception as e:
+            logger.warning('Кэш: ⚠ Redis недоступен: %s', e)
+            return None
+    
+    def set(self, key, value):
+        try:
+            self.client.set(key, value, ex=self.ttl)
+        except Exception as e:
+            logger.warning('Кэш: ⚠ Redis недоступен: %s', e)
+
+def create_response_cache():
+    if app.config['RESPONSE_CACHE_BACKEND'] == 'redis':
+        try:
+            return RedisResponseCache(app.config['RESPONSE_CACHE_REDIS_URL'], app.config['RESPONSE_CACHE_TTL'])
+        except ImportError:
+            logger.warning('Кэш: ⚠ Пакет redis не установлен, используется LRU в памяти')
+    return LRUResponseCache(app.config['RESPONSE_CACHE_MAX_ENTRIES'])
+
+response_cache = create_response_cache()
+
+def cached_json_response(view):
+    """Кэширует JSON-ответ по пользователю, версии его данных, адресу и дате; отдает ETag и 304
+    
+    Ключ включает data_version, поэтому запись данных делает старые записи недостижимыми -
+    они вытесняются LRU или истекают в Redis.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version = f'{current_user.id}:{current_user.data_version}:{date.today().isoformat()}:{request.full_path}'
+        digest = hashlib.sha1(version.encode('utf-8')).hexdigest()
+        
+        if digest in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(digest)
+            return response
+        
+        key = f'response:{current_user.id}:{digest}'
+        body = response_cache.get(key)
+        if body is None:
+            response = view(*args, **kwargs)
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            response_cache.set(key, body)
+        
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(digest)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
+
+def validate_exercise_data(form_data):
+    """Валидация данных упражнений с подробным отчетом"""
+    errors = []
+    valid_exercises_count = 0
+    
+    # Получаем все индексы упражнений
+    exercise_indices = set()
+    for key in form_data.keys():
+        if key.startswith('exercise_type_'):
+            try:
+                index = int(key.split('_')[2])
+                exercise_indices.add(index)
+            except:
+                pass
+    
+    logger.debug('Найдено упражнений: %s, индексы: %s', len(exercise_indices), exercise_indices)
+    
+    for exercise_count in sorted(exercise_indices):
+        exercise_type = form_data.get(f'exercise_type_{exercise_count}', '').strip()
+        
+        logger.debug("Упражнение %s: '%s'", exercise_count, exercise_type)
+        
+        if not exercise_type:
+            logger.debug('Упражнение %s пропущено (пустое)', exercise_count)
+            continue
+        
+        valid_exercises_count += 1
+        has_valid_sets = False
+        
+        # Получаем все индексы подходов для этого упражнения
+        set_indices = set()
+        for key in form_data.keys():
+            if key.startswith(f'weight_{exercise_count}_'):
+                try:
+                    set_idx = int(key.split('_')[2])
+                    set_indices.add(set_idx)
+                except:
+                    pass
+        
+        logger.debug('Упражнение %s (%s): найдено подходов: %s, индексы: %s', exercise_count, exercise_type, len(set_indices), set_indices)
+        
+        for set_count in sorted(set_indices):
+            weight_key = f'weight_{exercise_count}_{set_count}'
+            reps_key = f'reps_{exercise_count}_{set_count}'
+            
+            weight = form_data.get(weight_key, '').strip()
+            reps = form_data.get(reps_key, '').strip()
+            
+            logger.debug('Подход %s: вес=%s, повторения=%s', set_count, weight, reps)
+            
+            if weight and reps:
+                try:
+                    weight_val = float(weight)
+                    reps_val = int(reps)
+                    if weight_val > 0 and reps_val > 0:
+                        has_valid_sets = True
+                        logger.debug('Подход %s валиден: %sкг x %sповт', set_count, weight_val, reps_val)
+                    else:
+                        error_msg = f'Вес и повторения должны быть больше 0 в подходе {set_count + 1} упражнения "{exercise_type}"'
+                        errors.append(error_msg)
+                        logger.debug('%s', error_msg)
+                except ValueError as e:
+                    error_msg = f'Некорректные данные в подходе {set_count + 1} упражнения "{exercise_type}": {str(e)}'
+                    errors.append(error_msg)
+                    logger.debug('%s', error_msg)
+            else:
+                logger.debug('Подход %s пропущен (пустой)', set_count)
+        
+        if not has_valid_sets:
+            error_msg = f'Упражнение "{exercise_type}" не имеет валидных подходов. Проверьте, что вес и повторения заполнены.'
+            errors.append(error_msg)
+            logger.debug('%s', error_msg)
+    
+    if valid_exercises_count == 0:
+        errors.append('Не добавлено ни одного упражнения с заполненным названием')
+        logger.debug('Нет валидных упражнений')
+    
+    logger.debug('Итого валидных упражнений: %s, ошибок: %s', valid_exercises_count, len(errors))
+    return errors
+
+def add_session_exercises(session, form):
+    """Добавляет к тренировке упражнения с подходами из полей формы exercise_type_N, weight_N_M, reps_N_M
+    
+    Возвращает число добавленных упражнений (без валидных подходов упражнение пропускается).
+    """
+    exercise_indices = set()
+    for key in form.keys():
+        if key.startswith('exercise_type_'):
+            try:
+                parts = key.split('_')
+                if len(parts) >= 3:
+                    index = int(parts[2])
+                    exercise_indices.add(index)
+            except (ValueError, IndexError):
+                continue
+    
+    logger.debug('ШАГ 4: Найдено индексов упражнений: %s', exercise_indices)
+    
+    exercises_added = 0
+    exercise_order = 0
+    
+    for exercise_count in sorted(exercise_indices):
+        exercise_type = form.get(f'exercise_type_{exercise_count}', '').strip()
+        
+        if not exercise_type:
+            logger.debug('ШАГ 4.%s: Пропущено (пустое)', exercise_count)
+            continue
+        
+        logger.debug("ШАГ 4.%s: Обработка '%s'", exercise_count, exercise_type)
+        
+        sets_data = []
+        set_indices = set()
+        
+        for key in form.keys():
+            if key.startswith(f'weight_{exercise_count}_'):
+                try:
+                    parts = key.split('_')
+                    if len(parts) >= 3:
+                        set_idx = int(parts[2])
+                        set_indices.add(set_idx)
+                except (ValueError, IndexError):
+                    continue
+        
+        logger.debug('ШАГ 4.%s: Найдено подходов: %s', exercise_count, set_indices)
+        
+        for set_count in sorted(set_indices):
+            weight = form.get(f'weight_{exercise_count}_{set_count}', '').strip()
+            reps = form.get(f'reps_{exercise_count}_{set_count}', '').strip()
+            
+            if weight and reps:
+                try:
+                    w = float(weight)
+                    r = int(reps)
+                    if w > 0 and r > 0:
+                        sets_data.append({
+                            'set_number': len(sets_data) + 1,
+                            'weight': w,
+                            'reps': r
+                        })
+                        logger.debug('ШАГ 4.%s.%s: ✓ %sкг x %sповт', exercise_count, set_count, w, r)
+                except ValueError as e:
+                    logger.debug('ШАГ 4.%s.%s: Ошибка конвертации: %s', exercise_count, set_count, e)
+                    continue
+        
+        if sets_data:
+            exercise = WorkoutExercise(
+                session_id=session.id,
+                exercise_type=exercise_type,
+                order=exercise_order
+            )
+            exercise.set_sets_data(sets_data)
+            db.session.add(exercise)
+            exercises_added += 1
+            exercise_order += 1
+            logger.debug('ШАГ 4.%s: ✓ Упражнение добавлено (%s подходов)', exercise_count, len(sets_data))
+        else:
+            logger.debug('ШАГ 4.%s: ✗ Нет валидных подходов', exercise_count)
+    
+    return exercises_added
+
+# МАРШРУТЫ
+
+# Аутентификация
+@app.route('/register', methods=['GET', 'POST'])
+def register():
+    if current_user.is_authenticated:
+        return redirect(url_for('dashboard'))
+    
+    if request.method == 'POST':
+        username = request.form.get('username', '').strip()
+        email = request.form.get('email', '').strip()
+        password = request.form.get('password', '')
+        weight = request.form.get('weight', '70')  # НОВОЕ: получаем вес
+        
+        if not username or not email or not password:
+            flash('Все поля обязательны для заполнения', 'error')
+            return render_template('register.html')
+        
+        if len(username) < 3 or len(username) > 50:
+            flash('Имя пользователя должно быть от 3 до 50 символов', 'error')
+            return render_template('register.html')
+        
+        if '@' not in email or '.' not in email:
+            flash('Введите корректный email', 'error')
+            return render_template('register.html')
+        
+        if len(password) < 6:
+            flash('Пароль должен быть не короче 6 символов', 'error')
+            return render_template('register.html')
+        
+        if User.query.filter_by(username=username).first():
+            flash('Имя пользователя уже существует', 'error')
+            return render_template('register.html')
+        
+        if User.query.filter_by(email=email).first():
+            flash('Email уже зарегистрирован', 'error')
+            return render_template('register.html')
+        
+        user = User(username=username, email=email, weight=safe_float(weight, 70.0))
+        user.set_password(password)
+        
+        try:
+            db.session.add(user)
+            db.session.commit()
+            login_user(user)
+            flash('Регистрация успешна! Добро пожаловать!', 'success')
+            return redirect(url_for('dashboard'))
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Ошибка при регистрации: {str(e)}', 'error')
+    
+    return render_template('register.html')
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    if current_user.is_authenticated:
         return redirect(url_for('dashboard'))
     
     if request.method == 'POST':
@@ -766,95 +2423,21 @@ def dashboard():
 
 @app.route('/dashboard')
 @login_required
+@sql_budget(20)
 def dashboard():
-    today = date.today()
-    week_ago = today - timedelta(days=7)
-    
-    recent_sessions = WorkoutSession.query.filter_by(
-        user_id=current_user.id
-    ).order_by(WorkoutSession.date.desc()).limit(5).all()
-    
-    active_goals = FitnessGoal.query.filter_by(
-        user_id=current_user.id,
-        is_completed=False
-    ).order_by(FitnessGoal.target_date.asc()).all()
-    
-    for goal in active_goals:
-        goal.update_progress()
-    
-    week_workouts_count = WorkoutSession.query.filter(
-        WorkoutSession.user_id == current_user.id,
-        WorkoutSession.date >= week_ago
-    ).count()
-    
-    progress_data = get_progress_data(current_user.id)
-    
-    week_calories = db.session.query(db.func.sum(CalorieTracking.calories_burned)).filter(
-        CalorieTracking.user_id == current_user.id,
-        CalorieTracking.date >= week_ago
-    ).scalar() or 0
-    
-    # Расчет средней продолжительности тренировки за неделю
-    week_sessions = WorkoutSession.query.filter(
-        WorkoutSession.user_id == current_user.id,
-        WorkoutSession.date >= week_ago
-    ).all()
-    
-    total_duration = sum(session.duration_minutes or 0 for session in week_sessions)
-    avg_duration = total_duration / len(week_sessions) if week_sessions else 0
-    
-    # Подсчет тренировок по группам мышц за неделю
-    muscle_group_exercises = {
-        'Грудь': ['Жим лежа', 'Сведение рук в кроссовере на грудь'],
-        'Руки': ['Разгибания на трицепс с канатной рукоятью в кроссовере', 'Сгибания на бицепс в рычажном тренажере'],
-        'Плечи': ['Махи на плечи со свободным весом', 'Отведение плеча в блочном тренажере "reverse fly"'],
-        'Ягодицы': ['Ягодичный мост в рычажном тренажере', 'Разгибание бедра стоя в кроссовере / рычажном тренажере', 'Отведение бедра сидя в сдвоенном блочном тренажере (большая ягодичная)', 'Отведение с наклоном вперед бедра сидя в сдвоенном блочном тренажере (малая и средняя ягодичные)'],
-        'Ноги': ['Болгарские выпады со свободным весом / в смите', 'Приседание в Смите'],
-        'Спина': ['Вертикальная тяга сидя', 'Горизонтальная тяга троссовая в блочном тренажере', 'Экстензия на наклонной скамье']
-    }
-    
-    muscle_group_data = {}
-    for muscle_group, exercises in muscle_group_exercises.items():
-        count = WorkoutSession.query.join(WorkoutExercise).filter(
-            WorkoutSession.user_id == current_user.id,
-            WorkoutSession.date >= week_ago,
-            WorkoutExercise.exercise_type.in_(exercises)
-        ).distinct(WorkoutSession.id).count()
-        muscle_group_data[muscle_group] = count
-    
-    active_progressions = ProgressionPlan.query.filter_by(
-        user_id=current_user.id,
-        is_active=True
-    ).all()
-    
-    workout_streak = WorkoutStreak.query.filter_by(
-        user_id=current_user.id,
-        streak_type='workout'
-    ).first()
-    
-    streak_days = workout_streak.current_streak if workout_streak else 0
-    longest_streak = workout_streak.longest_streak if workout_streak else 0
-    
-    active_double_progressions = DoubleProgression.query.filter_by(
-        user_id=current_user.id,
-        is_active=True
-    ).all()
-    
     return render_template('dashboard.html',
-                         recent_sessions=recent_sessions,
-                         active_goals=active_goals,
-                         week_workouts_count=week_workouts_count,
-                         progress_data=json.dumps(progress_data),
-                         week_calories=round(week_calories, 1),
-                         active_progressions=active_progressions,
-                         streak_days=streak_days,
-                         longest_streak=longest_streak,
-                         active_double_progressions=active_double_progressions,
-                         avg_duration=avg_duration,
-                         muscle_group_data=muscle_group_data)
+                         pending_derivations=pending_derivations_count(current_user.id),
+                         **build_dashboard_data(current_user.id))
 
 
 
+@app.route('/api/derivations/status')
+@login_required
+def derivations_status():
+    """Состояние фонового пересчета показателей пользователя"""
+    failed = DerivationJob.query.filter_by(user_id=current_user.id, status='failed').count()
+    return jsonify({'pending': pending_derivations_count(current_user.id), 'failed': failed})
+
 # Добавление тренировки (с полным логированием)
 @app.route('/add-workout-session', methods=['GET', 'POST'])
 @login_required
@@ -863,233 +2446,95 @@ def add_workout_session():
     custom_exercises = CustomExercise.query.filter_by(user_id=current_user.id).order_by(CustomExercise.muscle_group, CustomExercise.name).all()
     
     if request.method == 'POST':
-        print("=" * 60)
-        print("НАЧАЛО ОБРАБОТКИ ФОРМЫ ADD-WORKOUT-SESSION")
-        print("=" * 60)
+        logger.debug('НАЧАЛО ОБРАБОТКИ ФОРМЫ ADD-WORKOUT-SESSION')
         
         try:
             # Валидация
-            print("ШАГ 1: Валидация данных...")
+            logger.debug('ШАГ 1: Валидация данных...')
             errors = validate_exercise_data(request.form)
-            print(f"ШАГ 1: Результат валидации - ошибок: {len(errors)}")
+            logger.debug('ШАГ 1: Результат валидации - ошибок: %s', len(errors))
             
             if errors:
-                print("ШАГ 1: ЕСТЬ ОШИБКИ! Возвращаем форму")
+                logger.debug('ШАГ 1: ЕСТЬ ОШИБКИ! Возвращаем форму')
                 for error in errors:
-                    flash(error, 'error')
-                return render_template('add_workout_session.html')
-            
-            print("ШАГ 1: ✓ Валидация пройдена")
-            
-            # Создание сессии
-            print("ШАГ 2: Создание WorkoutSession...")
-            workout_date = request.form.get('date', date.today().isoformat())
-            workout_name = request.form.get('workout_name', '').strip()
-            
-            if not workout_name:
-                workout_name = f"Тренировка {datetime.strptime(workout_date, '%Y-%m-%d').strftime('%d.%m.%Y')}"
-            
-            print(f"ШАГ 2: Дата={workout_date}, Название={workout_name}")
-            
-            session = WorkoutSession(
-                user_id=current_user.id,
-                date=datetime.strptime(workout_date, '%Y-%m-%d').date(),
-                name=workout_name
-            )
-            db.session.add(session)
-            db.session.flush()
-            print(f"ШАГ 2: ✓ Session создан с ID={session.id}")
-            
-            # Duration
-            print("ШАГ 3: Установка продолжительности...")
-            duration = request.form.get('duration_minutes', '60')
-            session.duration_minutes = safe_float(duration, 60.0)
-            print(f"ШАГ 3: ✓ Duration={session.duration_minutes}")
-            
-            # Обработка упражнений
-            print("ШАГ 4: Обработка упражнений...")
-            exercise_indices = set()
-            for key in request.form.keys():
-                if key.startswith('exercise_type_'):
-                    try:
-                        parts = key.split('_')
-                        if len(parts) >= 3:
-                            index = int(parts[2])
-                            exercise_indices.add(index)
-                    except (ValueError, IndexError):
-                        continue
-            
-            print(f"ШАГ 4: Найдено индексов упражнений: {sorted(exercise_indices)}")
-            
-            exercises_added = 0
-            exercise_order = 0
-            
-            for exercise_count in sorted(exercise_indices):
-                exercise_type = request.form.get(f'exercise_type_{exercise_count}', '').strip()
-                
-                if not exercise_type:
-                    print(f"ШАГ 4.{exercise_count}: Пропущено (пустое)")
-                    continue
-                
-                print(f"ШАГ 4.{exercise_count}: Обработка '{exercise_type}'")
-                
-                sets_data = []
-                set_indices = set()
-                
-                for key in request.form.keys():
-                    if key.startswith(f'weight_{exercise_count}_'):
-                        try:
-                            parts = key.split('_')
-                            if len(parts) >= 3:
-                                set_idx = int(parts[2])
-                                set_indices.add(set_idx)
-                        except (ValueError, IndexError):
-                            continue
-                
-                print(f"ШАГ 4.{exercise_count}: Найдено подходов: {sorted(set_indices)}")
-                
-                for set_count in sorted(set_indices):
-                    weight = request.form.get(f'weight_{exercise_count}_{set_count}', '').strip()
-                    reps = request.form.get(f'reps_{exercise_count}_{set_count}', '').strip()
-                    
-                    if weight and reps:
-                        try:
-                            w = float(weight)
-                            r = int(reps)
-                            if w > 0 and r > 0:
-                                sets_data.append({
-                                    'set_number': len(sets_data) + 1,
-                                    'weight': w,
-                                    'reps': r
-                                })
-                                print(f"ШАГ 4.{exercise_count}.{set_count}: ✓ {w}кг x {r}повт")
-                        except ValueError as e:
-                            print(f"ШАГ 4.{exercise_count}.{set_count}: Ошибка конвертации: {e}")
-                            continue
-                
-                if sets_data:
-                    exercise = WorkoutExercise(
-                        session_id=session.id,
-                        exercise_type=exercise_type,
-                        order=exercise_order
-                    )
-                    exercise.set_sets_data(sets_data)
-                    db.session.add(exercise)
-                    exercises_added += 1
-                    exercise_order += 1
-                    print(f"ШАГ 4.{exercise_count}: ✓ Упражнение добавлено ({len(sets_data)} подходов)")
-                else:
-                    print(f"ШАГ 4.{exercise_count}: ✗ Нет валидных подходов")
+                    flash(error, 'error')
+                return render_template('add_workout_session.html')
             
-            print(f"ШАГ 4: ✓ Итого упражнений добавлено: {exercises_added}")
+            logger.debug('ШАГ 1: ✓ Валидация пройдена')
             
-            if exercises_added == 0:
-                db.session.rollback()
-                print("ШАГ 4: ✗ НЕТ УПРАЖНЕНИЙ! Откат")
-                flash('Не добавлено ни одного упражнения с подходами', 'error')
-                return render_template('add_workout_session.html')
+            # Создание сессии
+            logger.debug('ШАГ 2: Создание WorkoutSession...')
+            workout_date = request.form.get('date', date.today().isoformat())
+            workout_name = request.form.get('workout_name', '').strip()
             
-            # Расчет калорий
-            print("ШАГ 5: Расчет калорий...")
-            user_weight = safe_float(current_user.weight, 70.0)
-            print(f"ШАГ 5: Вес пользователя: {user_weight}кг")
+            if not workout_name:
+                workout_name = f"Тренировка {datetime.strptime(workout_date, '%Y-%m-%d').strftime('%d.%m.%Y')}"
             
-            try:
-                session.total_calories = session.calculate_calories(user_weight, "strength")
-                print(f"ШАГ 5: ✓ Калории рассчитаны: {session.total_calories}")
-            except Exception as e:
-                print(f"ШАГ 5: ✗ Ошибка расчета калорий: {e}")
-                session.total_calories = 200.0
+            logger.debug('ШАГ 2: Дата=%s, Название=%s', workout_date, workout_name)
             
-            # Запись калорий
-            print("ШАГ 6: Создание CalorieTracking...")
-            calorie_tracking = CalorieTracking(
+            session = WorkoutSession(
                 user_id=current_user.id,
-                workout_session_id=session.id,
-                date=session.date,
-                calories_burned=session.total_calories,
-                workout_duration=session.duration_minutes
+                date=datetime.strptime(workout_date, '%Y-%m-%d').date(),
+                name=workout_name
             )
-            db.session.add(calorie_tracking)
-            print("ШАГ 6: ✓ CalorieTracking добавлен")
+            db.session.add(session)
+            db.session.flush()
+            logger.debug('ШАГ 2: ✓ Session создан с ID=%s', session.id)
             
-            # Volume Load
-            print("ШАГ 7: Расчет Volume Load...")
-            try:
-                volume_data = session.calculate_volume_load()
-                for exercise_type, data in volume_data.items():
-                    if data and data.get('volume_load'):
-                        volume_load = VolumeLoadTracking(
-                            user_id=current_user.id,
-                            exercise_type=exercise_type,
-                            session_id=session.id,
-                            date=session.date,
-                            volume_load=safe_float(data.get('volume_load'), 0),
-                            sets_count=safe_int(data.get('sets_count'), 0),
-                            reps_count=safe_int(data.get('reps_count'), 0),
-                            max_weight=safe_float(data.get('max_weight'), 0)
-                        )
-                        db.session.add(volume_load)
-                        print(f"ШАГ 7: ✓ Volume Load для '{exercise_type}' добавлен")
-            except Exception as e:
-                print(f"ШАГ 7: ⚠ Ошибка Volume Load: {e}")
+            # Duration
+            logger.debug('ШАГ 3: Установка продолжительности...')
+            duration = request.form.get('duration_minutes', '60')
+            session.duration_minutes = safe_float(duration, 60.0)
+            logger.debug('ШАГ 3: ✓ Duration=%s', session.duration_minutes)
             
-            # Streak
-            print("ШАГ 8: Обновление Streak...")
+            # Обработка упражнений
+            logger.debug('ШАГ 4: Обработка упражнений...')
+            exercises_added = add_session_exercises(session, request.form)
+            logger.debug('ШАГ 4: ✓ Итого упражнений добавлено: %s', exercises_added)
+            
+            if exercises_added == 0:
+                db.session.rollback()
+                logger.debug('ШАГ 4: ✗ НЕТ УПРАЖНЕНИЙ! Откат')
+                flash('Не добавлено ни одного упражнения с подходами', 'error')
+                return render_template('add_workout_session.html')
+            
+            # Производные данные (калории, объем, прогресс, агрегаты, цепочка, цели)
+            # пересчитываются воркерами очереди после коммита
+            logger.debug('ШАГ 5: Постановка пересчета в очередь...')
+            enqueue_derivation(current_user.id, session.id)
             streak = WorkoutStreak.query.filter_by(
                 user_id=current_user.id,
                 streak_type='workout'
             ).first()
-            
-            if not streak:
-                streak = WorkoutStreak(user_id=current_user.id, streak_type='workout')
-                db.session.add(streak)
-                print("ШАГ 8: Создан новый Streak")
-            
-            streak.update_streak()
-            print(f"ШАГ 8: ✓ Streak обновлен: {streak.current_streak} дней")
-            
-            # Обновление целей
-            print("ШАГ 9: Обновление прогресса целей...")
-            goals_updated = 0
-            for goal in FitnessGoal.query.filter_by(user_id=current_user.id).all():
-                try:
-                    goal.update_progress()
-                    goals_updated += 1
-                except Exception as e:
-                    print(f"ШАГ 9: ⚠ Ошибка обновления цели {goal.id}: {e}")
-            print(f"ШАГ 9: ✓ Обновлено целей: {goals_updated}")
+            current_streak = streak.projected_streak() if streak else 1
             
             # COMMIT
-            print("ШАГ 10: COMMIT...")
+            logger.debug('ШАГ 6: COMMIT...')
+            bump_data_version(current_user.id)
             db.session.commit()
-            print("ШАГ 10: ✓✓✓ COMMIT УСПЕШЕН ✓✓✓")
+            logger.debug('ШАГ 6: ✓✓✓ COMMIT УСПЕШЕН ✓✓✓')
+            notify_derivation_workers()
             
             # Flash message
-            if streak.current_streak > 1:
-                if streak.current_streak % 7 == 0:
-                    flash(f'🔥 Невероятно! Цепочка из {streak.current_streak} дней! Вы настоящий чемпион!', 'success')
-                elif streak.current_streak % 5 == 0:
-                    flash(f'💪 Отлично! Уже {streak.current_streak} дней подряд! Продолжайте в том же духе!', 'success')
+            if current_streak > 1:
+                if current_streak % 7 == 0:
+                    flash(f'🔥 Невероятно! Цепочка из {current_streak} дней! Вы настоящий чемпион!', 'success')
+                elif current_streak % 5 == 0:
+                    flash(f'💪 Отлично! Уже {current_streak} дней подряд! Продолжайте в том же духе!', 'success')
                 else:
-                    flash(f'Тренировка успешно добавлена! Цепочка: {streak.current_streak} дней 🔥', 'success')
+                    flash(f'Тренировка успешно добавлена! Цепочка: {current_streak} дней 🔥', 'success')
             else:
                 flash('Тренировка успешно добавлена!', 'success')
             
-            print("ШАГ 11: РЕДИРЕКТ на dashboard")
-            print("=" * 60)
+            logger.debug('ШАГ 7: РЕДИРЕКТ на dashboard')
             return redirect(url_for('dashboard'))
             
         except Exception as e:
             db.session.rollback()
-            print("=" * 60)
-            print(f"✗✗✗ КРИТИЧЕСКАЯ ОШИБКА: {str(e)}")
-            print("=" * 60)
-            import traceback
-            traceback.print_exc()
+            logger.exception('✗✗✗ КРИТИЧЕСКАЯ ОШИБКА: %s', e)
             flash(f'Ошибка при добавлении тренировки: {str(e)}', 'error')
     
-    print("Возврат формы (конец функции или GET запрос)")
+    logger.debug('Возврат формы (конец функции или GET запрос)')
     return render_template('add_workout_session.html', custom_exercises=custom_exercises)
 
 @app.route('/add-goal', methods=['GET', 'POST'])
@@ -1125,8 +2570,11 @@ def add_goal():
                 target_sets=target_sets,
                 target_date=target_date
             )
+            # Прогресс по уже записанным тренировкам: иначе дашборд пересчитывал бы цель при каждом показе
+            goal.update_progress()
             
             db.session.add(goal)
+            bump_data_version(current_user.id)
             db.session.commit()
             flash('Цель успешно добавлена!', 'success')
             return redirect(url_for('dashboard'))
@@ -1149,14 +2597,21 @@ def generate_workout():
             duration_minutes = safe_int(duration_str, 60)
             intensity = request.form.get('intensity', 'medium')
             
+            # Группы формы -> группа каталога и (для рук) ключевое слово в названии
+            form_groups = {
+                'chest': ('Грудь', None),
+                'triceps': ('Руки', 'трицепс'),
+                'biceps': ('Руки', 'бицепс'),
+                'legs': ('Ноги', None),
+                'shoulders': ('Плечи', None),
+                'back': ('Спина', None),
+                'forearms': ('Предплечья', None)
+            }
+            catalog_groups = standard_exercises_by_group()
             exercise_database = {
-                'chest': ['Жим лежа', 'Сведение рук в кроссовере на грудь'],
-                'triceps': ['Разгибания на трицепс с канатной рукоятью в кроссовере'],
-                'biceps': ['Сгибания на бицепс в рычажном тренажере'],
-                'legs': ['Ягодичный мост в рычажном тренажере', 'Разгибание бедра стоя в кроссовере / рычажном тренажере', 'Болгарские выпады со свободным весом / в смите', 'Отведение бедра сидя в сдвоенном блочном тренажере (большая ягодичная)', 'Отведение с наклоном вперед бедра сидя в сдвоенном блочном тренажере (малая и средняя ягодичные)', 'Приседание в Смите'],
-                'shoulders': ['Махи на плечи со свободным весом', 'Отведение плеча в блочном тренажере "reverse fly"'],
-                'back': ['Вертикальная тяга сидя', 'Горизонтальная тяга троссовая в блочном тренажере', 'Экстензия на наклонной скамье'],
-                'forearms': []
+                key: [entry['name'] for entry in catalog_groups.get(group, [])
+                      if keyword is None or keyword in entry['name'].lower()]
+                for key, (group, keyword) in form_groups.items()
             }
             
             selected_exercises = []
@@ -1215,31 +2670,17 @@ def generate_workout():
                 exercise.set_sets_data(ex_data['sets_data'])
                 db.session.add(exercise)
             
-            user_weight = safe_float(current_user.weight, 70.0)
-            session.total_calories = session.calculate_calories(user_weight, "strength")
-            
-            calorie_tracking = CalorieTracking(
-                user_id=current_user.id,
-                workout_session_id=session.id,
-                date=session.date,
-                calories_burned=session.total_calories,
-                workout_duration=session.duration_minutes
-            )
-            db.session.add(calorie_tracking)
-            
+            enqueue_derivation(current_user.id, session.id)
             streak = WorkoutStreak.query.filter_by(
                 user_id=current_user.id,
                 streak_type='workout'
             ).first()
+            current_streak = streak.projected_streak() if streak else 1
             
-            if not streak:
-                streak = WorkoutStreak(user_id=current_user.id, streak_type='workout')
-                db.session.add(streak)
-            
-            streak.update_streak()
-            
+            bump_data_version(current_user.id)
             db.session.commit()
-            flash(f'Тренировка сгенерирована и добавлена! Цепочка: {streak.current_streak} дней 🔥', 'success')
+            notify_derivation_workers()
+            flash(f'Тренировка сгенерирована и добавлена! Цепочка: {current_streak} дней 🔥', 'success')
             return redirect(url_for('dashboard'))
         
         except Exception as e:
@@ -1274,7 +2715,12 @@ def delete_workout_session(session_id):
         return redirect(url_for('dashboard'))
     
     try:
+        # Точки ряда прогресса удаляются каскадом вместе с тренировкой
         db.session.delete(session)
+        db.session.flush()
+        refresh_rollups(current_user.id, session.date)
+        refresh_feature_snapshot(current_user.id)
+        bump_data_version(current_user.id)
         db.session.commit()
         flash('Тренировка успешно удалена!', 'success')
     except Exception as e:
@@ -1293,6 +2739,7 @@ def delete_goal(goal_id):
     
     try:
         db.session.delete(goal)
+        bump_data_version(current_user.id)
         db.session.commit()
         flash('Цель успешно удалена!', 'success')
     except Exception as e:
@@ -1303,6 +2750,7 @@ def delete_goal(goal_id):
 
 @app.route('/progression-plans')
 @login_required
+@sql_budget(10)
 def progression_plans():
     plans = ProgressionPlan.query.filter_by(user_id=current_user.id).order_by(ProgressionPlan.exercise_type).all()
     plans_with_meta = []
@@ -1335,23 +2783,17 @@ def progression_plans():
         })
     
     progression_charts = {}
-    user_sessions = WorkoutSession.query.filter_by(user_id=current_user.id).order_by(WorkoutSession.date).all()
-    for session in user_sessions:
-        for exercise in session.exercises:
-            ex_type = exercise.exercise_type
-            sets_data = exercise.get_sets_data()
-            if not sets_data:
-                continue
-            
-            weights = [safe_float(s.get('weight'), 0) for s in sets_data if safe_float(s.get('weight'), 0) > 0]
-            if not weights:
-                continue
-            
-            max_w = max(weights)
-            if ex_type not in progression_charts:
-                progression_charts[ex_type] = {'dates': [], 'weights': [], 'plan_id': None}
-            progression_charts[ex_type]['dates'].append(session.date.isoformat())
-            progression_charts[ex_type]['weights'].append(max_w)
+    arrays = load_set_arrays(current_user.id, {plan['exercise_type'] for plan in plans_with_meta})
+    instances = workout_analytics.exercise_instances(arrays)
+    # Точки графика - максимальный рабочий вес каждого выполнения упражнения
+    with_weight = instances['max_weight'] > 0
+    for code, day, max_w in zip(instances['exercise_code'][with_weight], instances['day'][with_weight],
+                                instances['max_weight'][with_weight]):
+        ex_type = arrays.exercise_names[code]
+        if ex_type not in progression_charts:
+            progression_charts[ex_type] = {'dates': [], 'weights': [], 'plan_id': None}
+        progression_charts[ex_type]['dates'].append(date.fromordinal(int(day)).isoformat())
+        progression_charts[ex_type]['weights'].append(float(max_w))
     
     for plan_meta in plans_with_meta:
         ex_type = plan_meta['exercise_type']
@@ -1421,6 +2863,7 @@ def add_double_progression():
                 )
                 db.session.add(plan)
             
+            bump_data_version(current_user.id)
             db.session.commit()
             flash('План двойной прогрессии успешно сохранен!', 'success')
             return redirect(url_for('double_progression_list'))
@@ -1444,6 +2887,7 @@ def delete_double_progression(plan_id):
     
     try:
         db.session.delete(plan)
+        bump_data_version(current_user.id)
         db.session.commit()
         flash('План двойной прогрессии успешно удален!', 'success')
     except Exception as e:
@@ -1461,36 +2905,10 @@ def custom_exercises():
     # Получаем пользовательские упражнения
     custom_exercises = CustomExercise.query.filter_by(user_id=current_user.id).order_by(CustomExercise.muscle_group, CustomExercise.name).all()
     
-    # Стандартные упражнения
+    # Стандартные упражнения (из каталога)
     standard_exercises_data = {
-        'Грудь': [
-            {'name': 'Жим лежа', 'met': 6.0, 'description': ''},
-            {'name': 'Сведение рук в кроссовере на грудь', 'met': 5.0, 'description': ''}
-        ],
-        'Руки': [
-            {'name': 'Разгибания на трицепс с канатной рукоятью в кроссовере', 'met': 4.0, 'description': ''},
-            {'name': 'Сгибания на бицепс в рычажном тренажере', 'met': 4.0, 'description': ''}
-        ],
-        'Плечи': [
-            {'name': 'Махи на плечи со свободным весом', 'met': 4.5, 'description': ''},
-            {'name': 'Отведение плеча в блочном тренажере "reverse fly"', 'met': 4.0, 'description': ''}
-        ],
-        'Ноги': [
-            {'name': 'Ягодичный мост в рычажном тренажере', 'met': 5.5, 'description': ''},
-            {'name': 'Разгибание бедра стоя в кроссовере / рычажном тренажере', 'met': 5.0, 'description': ''},
-            {'name': 'Болгарские выпады со свободным весом / в смите', 'met': 6.0, 'description': ''},
-            {'name': 'Отведение бедра сидя в сдвоенном блочном тренажере (большая ягодичная)', 'met': 4.5, 'description': ''},
-            {'name': 'Отведение с наклоном вперед бедра сидя в сдвоенном блочном тренажере (малая и средняя ягодичные)', 'met': 4.5, 'description': ''},
-            {'name': 'Приседание в Смите', 'met': 6.5, 'description': ''}
-        ],
-        'Спина': [
-            {'name': 'Вертикальная тяга сидя', 'met': 6.0, 'description': ''},
-            {'name': 'Горизонтальная тяга троссовая в блочном тренажере', 'met': 6.0, 'description': ''},
-            {'name': 'Экстензия на наклонной скамье', 'met': 5.5, 'description': ''}
-        ],
-        'Кардио': [
-            {'name': 'Ходьба на дорожке с наклоном 13-14', 'met': 8.0, 'description': ''}
-        ]
+        group: [{'name': entry['name'], 'met': entry['met'], 'description': entry['description']} for entry in entries]
+        for group, entries in standard_exercises_by_group().items()
     }
     
     # Создаем словарь имен пользовательских упражнений для быстрой проверки
@@ -1587,53 +3005,17 @@ def add_custom_exercise():
         
         # Если нет пользовательской версии, создаем данные из системного
         if not exercise:
-            standard_exercises_data = {
-                'Грудь': [
-                    {'name': 'Жим лежа', 'met': 6.0},
-                    {'name': 'Сведение рук в кроссовере на грудь', 'met': 5.0}
-                ],
-                'Руки': [
-                    {'name': 'Разгибания на трицепс с канатной рукоятью в кроссовере', 'met': 4.0},
-                    {'name': 'Сгибания на бицепс в рычажном тренажере', 'met': 4.0}
-                ],
-                'Плечи': [
-                    {'name': 'Махи на плечи со свободным весом', 'met': 4.5},
-                    {'name': 'Отведение плеча в блочном тренажере "reverse fly"', 'met': 4.0}
-                ],
-                'Ноги': [
-                    {'name': 'Ягодичный мост в рычажном тренажере', 'met': 5.5},
-                    {'name': 'Разгибание бедра стоя в кроссовере / рычажном тренажере', 'met': 5.0},
-                    {'name': 'Болгарские выпады со свободным весом / в смите', 'met': 6.0},
-                    {'name': 'Отведение бедра сидя в сдвоенном блочном тренажере (большая ягодичная)', 'met': 4.5},
-                    {'name': 'Отведение с наклоном вперед бедра сидя в сдвоенном блочном тренажере (малая и средняя ягодичные)', 'met': 4.5},
-                    {'name': 'Приседание в Смите', 'met': 6.5}
-                ],
-                'Спина': [
-                    {'name': 'Вертикальная тяга сидя', 'met': 6.0},
-                    {'name': 'Горизонтальная тяга троссовая в блочном тренажере', 'met': 6.0},
-                    {'name': 'Экстензия на наклонной скамье', 'met': 5.5}
-                ],
-                'Кардио': [
-                    {'name': 'Ходьба на дорожке с наклоном 13-14', 'met': 8.0}
-                ]
-            }
-            
-            # Находим системное упражнение
-            for group, exercises in standard_exercises_data.items():
-                for ex in exercises:
-                    if ex['name'] == exercise_name:
-                        # Создаем временный объект для отображения
-                        class TempExercise:
-                            def __init__(self):
-                                self.id = None
-                                self.name = exercise_name
-                                self.met_value = ex['met']
-                                self.description = ''
-                                self.muscle_group = group
-                        exercise = TempExercise()
-                        break
-                if exercise:
-                    break
+            ex = catalog_exercise(exercise_name)
+            if ex:
+                # Создаем временный объект для отображения
+                class TempExercise:
+                    def __init__(self):
+                        self.id = None
+                        self.name = exercise_name
+                        self.met_value = ex['met']
+                        self.description = ex['description']
+                        self.muscle_group = ex['muscle_group']
+                exercise = TempExercise()
     
     if request.method == 'POST':
         try:
@@ -1665,6 +3047,7 @@ def add_custom_exercise():
                 exercise.description = description
                 exercise.updated_at = datetime.utcnow()
                 
+                bump_data_version(current_user.id)
                 db.session.commit()
                 flash('Упражнение успешно обновлено!', 'success')
             else:
@@ -1688,6 +3071,7 @@ def add_custom_exercise():
                 )
                 
                 db.session.add(new_exercise)
+                bump_data_version(current_user.id)
                 db.session.commit()
                 flash('Упражнение успешно добавлено!', 'success')
             
@@ -1710,6 +3094,7 @@ def delete_custom_exercise(exercise_id):
     
     try:
         db.session.delete(exercise)
+        bump_data_version(current_user.id)
         db.session.commit()
         flash('Упражнение успешно удалено!', 'success')
     except Exception as e:
@@ -1861,64 +3246,169 @@ def exercise_image():
 
 @app.route('/results')
 @login_required
+@sql_budget(4)
 def results():
-    """Страница результатов"""
-    # Получаем данные для календаря
-    workouts = WorkoutSession.query.filter_by(user_id=current_user.id).order_by(WorkoutSession.date.desc()).all()
-    
-    # Группируем по датам для календаря
-    workouts_by_date = {}
-    for workout in workouts:
-        date_str = workout.date.isoformat()
-        if date_str not in workouts_by_date:
-            workouts_by_date[date_str] = []
-        workouts_by_date[date_str].append({
-            'id': workout.id,
-            'name': workout.name or 'Тренировка',
-            'duration': workout.duration_minutes,
-            'calories': workout.total_calories
-        })
-    
-    # Получаем данные веса
-    body_weights = BodyWeight.query.filter_by(user_id=current_user.id).order_by(BodyWeight.date.desc()).limit(30).all()
+    """Страница результатов
     
-    # Получаем замеры
-    measurements = BodyMeasurement.query.filter_by(user_id=current_user.id).order_by(BodyMeasurement.date.desc()).limit(10).all()
+    Календарь, вес, замеры и фотографии подгружаются страницами через API ниже,
+    поэтому стоимость страницы не зависит от объема истории.
+    """
+    return render_template('results.html')
+
+def encode_cursor(row_date, row_id):
+    """Непрозрачный курсор следующей страницы по ключу (date, id)"""
+    return base64.urlsafe_b64encode(f'{row_date.isoformat()}:{row_id}'.encode('ascii')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Ключ (date, id) из курсора; ValueError, если курсор поврежден"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        day, row_id = raw.split(':')
+        return date.fromisoformat(day), int(row_id)
+    except (TypeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(f'Некорректный курсор: {e}')
+
+def keyset_page(model, user_id, *filters):
+    """Страница записей пользователя (новые первыми) по параметрам cursor и limit запроса
+    
+    Keyset-пагинация по (date, id), как в iter_session_batches: стоимость страницы
+    не зависит от ее глубины. Возвращает (записи, курсор следующей страницы или None).
+    """
+    limit = min(max(request.args.get('limit', app.config['LIST_PAGE_SIZE'], type=int), 1),
+                app.config['LIST_MAX_PAGE_SIZE'])
+    query = model.query.filter(model.user_id == user_id, *filters)
+    
+    cursor = request.args.get('cursor')
+    if cursor:
+        last_date, last_id = decode_cursor(cursor)
+        query = query.filter(db.or_(
+            model.date < last_date,
+            db.and_(model.date == last_date, model.id < last_id)
+        ))
+    
+    # Лишняя запись показывает, есть ли следующая страница, без отдельного COUNT
+    rows = query.order_by(model.date.desc(), model.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1].date, rows[limit - 1].id) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def keyset_page_response(model, *filters):
+    try:
+        rows, next_cursor = keyset_page(model, current_user.id, *filters)
+    except ValueError as e:
+        response = jsonify({'success': False, 'error': str(e)})
+        response.status_code = 400
+        return response
+    return jsonify({'items': [row.to_dict() for row in rows], 'next_cursor': next_cursor})
+
+@app.route('/api/workout-sessions')
+@login_required
+@sql_budget(4)
+@cached_json_response
+def list_workout_sessions():
+    """Тренировки пользователя постранично (?cursor=&limit=, ?date=YYYY-MM-DD - только за день)"""
+    filters = []
+    if request.args.get('date'):
+        try:
+            filters.append(WorkoutSession.date == date.fromisoformat(request.args['date']))
+        except ValueError:
+            response = jsonify({'success': False, 'error': 'Дата должна быть в формате YYYY-MM-DD'})
+            response.status_code = 400
+            return response
+    return keyset_page_response(WorkoutSession, *filters)
+
+@app.route('/api/body-weights')
+@login_required
+@sql_budget(4)
+@cached_json_response
+def list_body_weights():
+    """Записи веса постранично (?cursor=&limit=)"""
+    return keyset_page_response(BodyWeight)
+
+@app.route('/api/body-measurements')
+@login_required
+@sql_budget(4)
+@cached_json_response
+def list_body_measurements():
+    """Замеры тела постранично (?cursor=&limit=)"""
+    return keyset_page_response(BodyMeasurement)
+
+@app.route('/api/progress-photos')
+@login_required
+@sql_budget(4)
+@cached_json_response
+def list_progress_photos():
+    """Фотографии прогресса постранично (?cursor=&limit=), с адресами миниатюр"""
+    return keyset_page_response(ProgressPhoto)
+
+@app.route('/api/workout-calendar')
+@login_required
+@sql_budget(4)
+@cached_json_response
+def workout_calendar():
+    """Дневные итоги тренировок для календаря
     
-    # Получаем фотографии
-    photos = ProgressPhoto.query.filter_by(user_id=current_user.id).order_by(ProgressPhoto.date.desc()).all()
+    ?month=YYYY-MM (по умолчанию текущий) или произвольный диапазон ?start=&end= (YYYY-MM-DD).
+    """
+    try:
+        if request.args.get('start') or request.args.get('end'):
+            start_date = datetime.strptime(request.args.get('start', ''), '%Y-%m-%d').date()
+            end_date = datetime.strptime(request.args.get('end', ''), '%Y-%m-%d').date()
+        else:
+            start_date = datetime.strptime(request.args.get('month') or date.today().strftime('%Y-%m'), '%Y-%m').date()
+            end_date = next_month_start(start_date) - timedelta(days=1)
+    except ValueError:
+        response = jsonify({'success': False, 'error': 'Укажите month=YYYY-MM или start и end в формате YYYY-MM-DD'})
+        response.status_code = 400
+        return response
+    
+    if end_date < start_date or (end_date - start_date).days >= app.config['CALENDAR_MAX_DAYS']:
+        response = jsonify({'success': False, 'error': f"Диапазон должен быть от 1 до {app.config['CALENDAR_MAX_DAYS']} дней"})
+        response.status_code = 400
+        return response
     
-    return render_template('results.html', 
-                         workouts_by_date=workouts_by_date,
-                         body_weights=body_weights,
-                         measurements=measurements,
-                         photos=photos)
+    return jsonify({
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'days': get_calendar_days(current_user, start_date, end_date)
+    })
+
+def build_body_weight(user_id, data):
+    """Запись веса из JSON формы; ValueError, если данные некорректны"""
+    weight = safe_float(data.get('weight'), 0)
+    body_fat = safe_float(data.get('body_fat'), None)
+    date_str = data.get('date') or date.today().isoformat()
+    notes = (data.get('notes') or '').strip()
+    
+    if weight <= 0:
+        raise ValueError('Вес должен быть больше 0')
+    
+    return BodyWeight(
+        user_id=user_id,
+        date=datetime.strptime(date_str, '%Y-%m-%d').date(),
+        weight=weight,
+        body_fat_percentage=body_fat if body_fat else None,
+        notes=notes
+    )
+
+def build_body_measurement(user_id, data):
+    """Замеры тела из JSON формы; ValueError, если дата некорректна"""
+    date_str = data.get('date') or date.today().isoformat()
+    
+    return BodyMeasurement(
+        user_id=user_id,
+        date=datetime.strptime(date_str, '%Y-%m-%d').date(),
+        notes=(data.get('notes') or '').strip(),
+        **{field: safe_float(data.get(field), None) for field in BodyMeasurement.MEASUREMENT_FIELDS}
+    )
 
 @app.route('/api/add-body-weight', methods=['POST'])
 @login_required
 def add_body_weight():
     """Добавить запись веса"""
     try:
-        data = request.get_json()
-        weight = safe_float(data.get('weight'), 0)
-        body_fat = safe_float(data.get('body_fat'), None)
-        date_str = data.get('date', date.today().isoformat())
-        notes = data.get('notes', '').strip()
-        
-        if weight <= 0:
-            return jsonify({'success': False, 'error': 'Вес должен быть больше 0'})
-        
-        measurement_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-        
-        body_weight = BodyWeight(
-            user_id=current_user.id,
-            date=measurement_date,
-            weight=weight,
-            body_fat_percentage=body_fat if body_fat else None,
-            notes=notes
-        )
-        
+        body_weight = build_body_weight(current_user.id, request.get_json())
         db.session.add(body_weight)
+        bump_data_version(current_user.id)
         db.session.commit()
         
         return jsonify({'success': True, 'id': body_weight.id})
@@ -1931,27 +3421,9 @@ def add_body_weight():
 def add_body_measurement():
     """Добавить замеры тела"""
     try:
-        data = request.get_json()
-        date_str = data.get('date', date.today().isoformat())
-        measurement_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-        
-        measurement = BodyMeasurement(
-            user_id=current_user.id,
-            date=measurement_date,
-            neck=safe_float(data.get('neck'), None),
-            shoulders=safe_float(data.get('shoulders'), None),
-            forearms=safe_float(data.get('forearms'), None),
-            biceps=safe_float(data.get('biceps'), None),
-            chest=safe_float(data.get('chest'), None),
-            waist=safe_float(data.get('waist'), None),
-            abdomen=safe_float(data.get('abdomen'), None),
-            hips=safe_float(data.get('hips'), None),
-            thigh=safe_float(data.get('thigh'), None),
-            calves=safe_float(data.get('calves'), None),
-            notes=data.get('notes', '').strip()
-        )
-        
+        measurement = build_body_measurement(current_user.id, request.get_json())
         db.session.add(measurement)
+        bump_data_version(current_user.id)
         db.session.commit()
         
         return jsonify({'success': True, 'id': measurement.id})
@@ -1959,10 +3431,372 @@ def add_body_measurement():
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)})
 
+# Офлайн-очередь: service worker копит записи в IndexedDB и отправляет их пакетом в /api/sync
+def sync_workout_session(user_id, data, activity_date):
+    """Тренировка из полей формы add-workout-session"""
+    form = {key: str(value) for key, value in data.items() if value is not None}
+    errors = validate_exercise_data(form)
+    if errors:
+        raise ValueError('; '.join(errors))
+    
+    workout_date = datetime.strptime(form.get('date') or date.today().isoformat(), '%Y-%m-%d').date()
+    session = WorkoutSession(
+        user_id=user_id,
+        date=workout_date,
+        name=form.get('workout_name', '').strip() or f"Тренировка {workout_date.strftime('%d.%m.%Y')}",
+        duration_minutes=safe_float(form.get('duration_minutes', '60'), 60.0)
+    )
+    db.session.add(session)
+    db.session.flush()
+    add_session_exercises(session, form)
+    enqueue_derivation(user_id, session.id, activity_date)
+    return session
+
+def sync_body_weight(user_id, data, activity_date):
+    body_weight = build_body_weight(user_id, data)
+    db.session.add(body_weight)
+    return body_weight
+
+def sync_body_measurement(user_id, data, activity_date):
+    measurement = build_body_measurement(user_id, data)
+    db.session.add(measurement)
+    return measurement
+
+SYNC_HANDLERS = {
+    'workout_session': sync_workout_session,
+    'body_weight': sync_body_weight,
+    'body_measurement': sync_body_measurement
+}
+
+def parse_client_id(value):
+    """Канонический UUID операции или None"""
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
+
+@app.route('/api/sync', methods=['POST'])
+@login_required
+def sync_operations():
+    """Применяет пакет операций офлайн-очереди в одной транзакции
+    
+    Тело: {"operations": [{"id": UUID, "type": ..., "data": {...}, "queued_at": "YYYY-MM-DD",
+    "user_id": id пользователя, записавшего операцию}]}.
+    Повтор операции с уже примененным id возвращает duplicate и ничего не создает,
+    поэтому клиент может безопасно повторять пакет после обрыва связи. Некорректные
+    операции и операции другого пользователя (общее устройство) возвращаются как
+    rejected (повтор их не исправит), остальные применяются.
+    """
+    payload = request.get_json(silent=True) or {}
+    operations = payload.get('operations')
+    if not isinstance(operations, list) or not operations:
+        response = jsonify({'success': False, 'error': 'Нет операций для синхронизации'})
+        response.status_code = 400
+        return response
+    if len(operations) > app.config['SYNC_MAX_OPERATIONS']:
+        response = jsonify({'success': False, 'error': f"Не больше {app.config['SYNC_MAX_OPERATIONS']} операций за запрос"})
+        response.status_code = 400
+        return response
+    
+    client_ids = [parse_client_id(op.get('id')) if isinstance(op, dict) else None for op in operations]
+    applied = {row.client_id: row for row in SyncOperation.query.filter(
+        SyncOperation.user_id == current_user.id,
+        SyncOperation.client_id.in_([client_id for client_id in client_ids if client_id])
+    ).all()}
+    
+    from sqlalchemy.exc import IntegrityError
+    results = []
+    created = []
+    try:
+        for op, client_id in zip(operations, client_ids):
+            if client_id is None:
+                results.append({'id': op.get('id') if isinstance(op, dict) else None, 'status': 'rejected',
+                                'error': 'Некорректный id операции'})
+                continue
+            if op.get('user_id') != current_user.id:
+                results.append({'id': client_id, 'status': 'rejected', 'error': 'Операция записана другим пользователем'})
+                continue
+            if client_id in applied:
+                results.append({'id': client_id, 'status': 'duplicate'})
+                continue
+            
+            handler = SYNC_HANDLERS.get(op.get('type'))
+            data = op.get('data')
+            if handler is None or not isinstance(data, dict):
+                results.append({'id': client_id, 'status': 'rejected', 'error': 'Неизвестный тип операции'})
+                continue
+            
+            try:
+                activity_date = datetime.strptime(op.get('queued_at') or '', '%Y-%m-%d').date()
+            except ValueError:
+                activity_date = None
+            
+            try:
+                obj = handler(current_user.id, data, activity_date)
+            except ValueError as e:
+                results.append({'id': client_id, 'status': 'rejected', 'error': str(e)})
+                continue
+            
+            record = SyncOperation(user_id=current_user.id, client_id=client_id, operation_type=op['type'])
+            db.session.add(record)
+            applied[client_id] = record
+            created.append((record, obj))
+            results.append({'id': client_id, 'status': 'created'})
+        
+        if created:
+            db.session.flush()
+            for record, obj in created:
+                record.object_id = obj.id
+            bump_data_version(current_user.id)
+        # id записей читаются до коммита: после него объекты сессии устаревают
+        for result in results:
+            if result['status'] in ('created', 'duplicate'):
+                result['object_id'] = applied[result['id']].object_id
+        db.session.commit()
+    except IntegrityError:
+        # Тот же пакет параллельно применяет другой запрос: повтор вернет duplicate
+        db.session.rollback()
+        response = jsonify({'success': False, 'error': 'Операции уже применяются, повторите запрос'})
+        response.status_code = 409
+        return response
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('Синхронизация: ✗ Ошибка применения пакета: %s', e)
+        response = jsonify({'success': False, 'error': f'Ошибка синхронизации: {str(e)}'})
+        response.status_code = 500
+        return response
+    
+    if any(isinstance(obj, WorkoutSession) for _, obj in created):
+        notify_derivation_workers()
+    
+    return jsonify({'success': True, 'results': results})
+
+# Хранилище фотографий: файлы адресуются хэшем содержимого (photo_storage)
+def create_photo_storage():
+    if app.config['PHOTO_STORAGE_BACKEND'] == 's3':
+        try:
+            return photo_storage.S3PhotoStorage(
+                app.config['PHOTO_S3_BUCKET'],
+                endpoint_url=app.config['PHOTO_S3_ENDPOINT_URL'],
+                access_key=app.config['PHOTO_S3_ACCESS_KEY'],
+                secret_key=app.config['PHOTO_S3_SECRET_KEY'],
+                region=app.config['PHOTO_S3_REGION']
+            )
+        except ImportError:
+            logger.warning('Фото: ⚠ Пакет boto3 не установлен, используется локальное хранилище')
+    return photo_storage.FilesystemPhotoStorage(app.config['PHOTO_STORAGE_ROOT'])
+
+photo_store = create_photo_storage()
+
+def photo_url(key):
+    """Адрес файла фотографии для шаблонов
+    
+    Старые записи (до хранилища) лежат в static/uploads; для остальных - PHOTO_PUBLIC_URL
+    (nginx, CDN или публичный бакет отдают файл без Flask) или маршрут photo_file.
+    """
+    if not key:
+        return ''
+    if key.startswith('uploads/'):
+        return url_for('static', filename=key)
+    if app.config['PHOTO_PUBLIC_URL']:
+        return f"{app.config['PHOTO_PUBLIC_URL'].rstrip('/')}/{key}"
+    return url_for('photo_file', key=key)
+
+@app.context_processor
+def inject_photo_url():
+    return {'photo_url': photo_url}
+
+def user_owns_photo_key(user_id, key):
+    """Ссылается ли какая-либо фотография пользователя на объект хранилища (оригинал или миниатюру)"""
+    return db.session.query(
+        ProgressPhoto.query.filter(
+            ProgressPhoto.user_id == user_id,
+            db.or_(ProgressPhoto.photo_path == key, ProgressPhoto.thumbnails_data.contains(f'"{key}"'))
+        ).exists()
+    ).scalar()
+
+@app.route('/photos/<path:key>')
+@login_required
+def photo_file(key):
+    """Файл фотографии из хранилища
+    
+    Объекты адресуются хэшем содержимого и общие для одинаковых файлов, поэтому файл
+    отдается только пользователю, у которого есть фотография с этим ключом. Содержимое
+    по ключу не меняется - ответ кэшируется навсегда, но только в браузере. Сам файл
+    по возможности отдает веб-сервер (PHOTO_SENDFILE: x-accel для nginx, x-sendfile
+    для Apache/lighttpd).
+    """
+    if not photo_storage.is_content_key(key) or not user_owns_photo_key(current_user.id, key):
+        abort(404)
+    
+    if isinstance(photo_store, photo_storage.S3PhotoStorage):
+        # Подписанная ссылка живет ограниченное время, поэтому переадресация кэшируется недолго
+        response = redirect(photo_store.presigned_url(key))
+        response.cache_control.private = True
+        response.cache_control.max_age = photo_store.url_expires // 2
+        return response
+    
+    if not photo_store.exists(key):
+        abort(404)
+    
+    if app.config['PHOTO_SENDFILE'] == 'x-accel':
+        response = app.response_class(mimetype=photo_storage.content_type(key))
+        response.headers['X-Accel-Redirect'] = f"{app.config['PHOTO_ACCEL_PREFIX'].rstrip('/')}/{key}"
+    else:
+        # При USE_X_SENDFILE Flask сам отдает заголовок X-Sendfile вместо тела
+        response = send_file(os.path.abspath(photo_store.path(key)), mimetype=photo_storage.content_type(key),
+                             conditional=True, etag=False)
+    response.headers['Cache-Control'] = photo_storage.PRIVATE_CACHE_CONTROL
+    return response
+
+# Обработка фотографий прогресса: загрузка пишется на диск, перекодирование и миниатюры - в пуле процессов
+def save_upload_stream(file, path, max_bytes, chunk_size=64 * 1024):
+    """Копирует загруженный файл на диск кусками, считая SHA-256
+    
+    Возвращает хэш содержимого или None, если превышен лимит (файл при этом удаляется).
+    """
+    written = 0
+    digest = hashlib.sha256()
+    with open(path, 'wb') as target:
+        while True:
+            chunk = file.stream.read(chunk_size)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > max_bytes:
+                break
+            digest.update(chunk)
+            target.write(chunk)
+    
+    if written > max_bytes:
+        os.remove(path)
+        return None
+    return digest.hexdigest()
+
+def photo_work_path(photo_id):
+    """Временный файл загрузки, ожидающей обработки"""
+    return os.path.join(app.config['PHOTO_WORK_FOLDER'], f'{photo_id}.upload')
+
+def photo_processing_args(photo, source_path):
+    """Аргументы photo_pipeline.process_photo: варианты пишутся во временный каталог"""
+    return (
+        source_path,
+        app.config['PHOTO_WORK_FOLDER'],
+        f'photo-{photo.id}',
+        app.config['PHOTO_THUMBNAIL_SIZES'],
+        app.config['PHOTO_MAX_SIZE'],
+        app.config['PHOTO_QUALITY']
+    )
+
+def store_photo_file(path, extension=photo_pipeline.EXTENSION):
+    """Переносит файл в хранилище под ключом по хэшу содержимого; возвращает ключ"""
+    key = photo_storage.content_key(photo_storage.file_digest(path), extension)
+    photo_store.put_file(path, key)
+    return key
+
+def finish_photo_processing(photo_id, result, source_path=None):
+    """Переносит варианты в хранилище и сохраняет их ключи
+    
+    result=None у новой загрузки (processing) - статус failed и удаление временного файла.
+    Старая фотография из static/uploads (process-photos --backfill) при неудаче не меняется:
+    ее файл - единственный оригинал пользователя.
+    """
+    photo = db.session.get(ProgressPhoto, photo_id)
+    if photo is None:
+        return
+    
+    work_folder = app.config['PHOTO_WORK_FOLDER']
+    if result is None and photo.status != 'processing':
+        logger.warning('Фото %s: ⚠ Не удалось обработать %s, файл оставлен как есть', photo_id, photo.photo_path)
+        db.session.commit()
+        return
+    if result is None:
+        # Загрузка не читается как изображение: временный исходник не нужен, запись остается со статусом failed
+        if source_path and os.path.exists(source_path):
+            os.remove(source_path)
+        photo.status = 'failed'
+    else:
+        photo.photo_path = store_photo_file(os.path.join(work_folder, result['original']))
+        photo.set_thumbnails({
+            size: store_photo_file(os.path.join(work_folder, name))
+            for size, name in result['thumbnails'].items()
+        })
+        photo.status = 'ready'
+    bump_data_version(photo.user_id)
+    db.session.commit()
+
+def process_photo_now(photo_id, args):
+    """Обрабатывает фотографию в текущем процессе (PHOTO_WORKERS=0 и CLI)"""
+    try:
+        result = photo_pipeline.process_photo(*args)
+    except Exception as e:
+        logger.error('Фото %s: ✗ Ошибка обработки: %s', photo_id, e)
+        result = None
+    finish_photo_processing(photo_id, result, args[0])
+
+class PhotoProcessingPool:
+    """Пул процессов для перекодирования фотографий, чтобы тяжелая работа не занимала воркеры запросов"""
+    
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.lock = threading.Lock()
+        self.executor = None
+    
+    def submit(self, photo_id, args):
+        with self.lock:
+            if self.executor is None:
+                # spawn: дочерние процессы не наследуют потоки и соединения с БД родителя
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.app.config['PHOTO_WORKERS'],
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+        future = self.executor.submit(photo_pipeline.process_photo, *args)
+        future.add_done_callback(lambda done: self.finish(photo_id, args[0], done))
+    
+    def finish(self, photo_id, source_path, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.error('Фото %s: ✗ Ошибка обработки: %s', photo_id, e)
+            result = None
+        try:
+            with self.app.app_context():
+                finish_photo_processing(photo_id, result, source_path)
+        except Exception as e:
+            logger.error('Фото %s: ✗ Не удалось сохранить результат: %s', photo_id, e)
+
+photo_pool = PhotoProcessingPool(app)
+
+class FitnessRequest(Request):
+    """Запрос с лимитом тела для загрузки фотографии
+    
+    Werkzeug проверяет лимит и по Content-Length, и во время чтения, поэтому
+    загрузка без Content-Length (chunked) обрывается, не успев целиком лечь во
+    временный файл. Остальные маршруты (импорт тренировок) не ограничены.
+    """
+    
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'upload_photo':
+            return app.config['PHOTO_MAX_BYTES'] + app.config['PHOTO_FORM_OVERHEAD']
+        return super().max_content_length
+
+app.request_class = FitnessRequest
+
 @app.route('/api/upload-photo', methods=['POST'])
 @login_required
 def upload_photo():
-    """Загрузить фотографию прогресса"""
+    """Загрузить фотографию прогресса
+    
+    Файл пишется на диск потоково, а перекодирование в WebP без EXIF и миниатюры
+    строятся в пуле процессов; до готовности фотография имеет статус processing.
+    Повторная загрузка того же файла тем же пользователем использует уже обработанные варианты.
+    """
+    max_bytes = app.config['PHOTO_MAX_BYTES']
+    if request.content_length and request.content_length > max_bytes:
+        return jsonify({'success': False, 'error': f'Файл больше {max_bytes // (1024 * 1024)} МБ'}), 413
+    
+    source_path = None
     try:
         if 'photo' not in request.files:
             return jsonify({'success': False, 'error': 'Файл не найден'})
@@ -1971,35 +3805,63 @@ def upload_photo():
         if file.filename == '':
             return jsonify({'success': False, 'error': 'Файл не выбран'})
         
-        # Создаем директорию для фотографий пользователя
-        import os
-        upload_folder = os.path.join('static', 'uploads', 'photos', str(current_user.id))
-        os.makedirs(upload_folder, exist_ok=True)
-        
-        # Генерируем уникальное имя файла
-        from werkzeug.utils import secure_filename
-        filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{filename}"
-        filepath = os.path.join(upload_folder, filename)
-        
-        file.save(filepath)
+        os.makedirs(app.config['PHOTO_WORK_FOLDER'], exist_ok=True)
+        source_path = os.path.join(app.config['PHOTO_WORK_FOLDER'], f'{uuid.uuid4().hex}.upload')
+        source_hash = save_upload_stream(file, source_path, max_bytes)
+        if source_hash is None:
+            source_path = None
+            return jsonify({'success': False, 'error': f'Файл больше {max_bytes // (1024 * 1024)} МБ'}), 413
         
-        # Сохраняем в БД
         photo = ProgressPhoto(
             user_id=current_user.id,
             date=date.today(),
-            photo_path=f"uploads/photos/{current_user.id}/{filename}",
+            photo_path='',
             photo_type=request.form.get('photo_type', 'front'),
-            notes=request.form.get('notes', '').strip()
+            notes=request.form.get('notes', '').strip(),
+            source_hash=source_hash,
+            status='processing'
         )
         
+        duplicate = ProgressPhoto.query.filter_by(user_id=current_user.id, source_hash=source_hash, status='ready').first()
+        if duplicate is not None:
+            # Пользователь уже загружал этот файл: ссылаемся на существующие объекты хранилища
+            os.remove(source_path)
+            photo.photo_path = duplicate.photo_path
+            photo.thumbnails_data = duplicate.thumbnails_data
+            photo.status = 'ready'
+        elif not photo_pipeline.available():
+            # Без Pillow файл хранится как есть
+            extension = re.sub(r'[^a-z0-9]', '', os.path.splitext(file.filename)[1].lower())[:5] or 'bin'
+            photo.photo_path = store_photo_file(source_path, extension)
+            photo.status = 'ready'
+        
+        # Сохраняем в БД
         db.session.add(photo)
+        if photo.status == 'processing':
+            db.session.flush()
+            os.replace(source_path, photo_work_path(photo.id))
+            source_path = photo_work_path(photo.id)
+        bump_data_version(current_user.id)
         db.session.commit()
         
-        return jsonify({'success': True, 'id': photo.id, 'path': photo.photo_path})
+        if photo.status == 'processing':
+            args = photo_processing_args(photo, source_path)
+            if app.config['PHOTO_WORKERS'] > 0:
+                photo_pool.submit(photo.id, args)
+            else:
+                process_photo_now(photo.id, args)
+        
+        return jsonify({'success': True, 'id': photo.id, 'path': photo.photo_path, 'status': photo.status})
+    except RequestEntityTooLarge:
+        # Тело без Content-Length превысило лимит FitnessRequest во время чтения
+        db.session.rollback()
+        if source_path and os.path.exists(source_path):
+            os.remove(source_path)
+        return jsonify({'success': False, 'error': f'Файл больше {max_bytes // (1024 * 1024)} МБ'}), 413
     except Exception as e:
         db.session.rollback()
+        if source_path and os.path.exists(source_path):
+            os.remove(source_path)
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/add-progression-plan', methods=['GET', 'POST'])
@@ -2037,6 +3899,7 @@ def add_progression_plan():
                 )
                 db.session.add(plan)
             
+            bump_data_version(current_user.id)
             db.session.commit()
             flash('План прогрессии успешно сохранен!', 'success')
             return redirect(url_for('progression_plans'))
@@ -2059,6 +3922,7 @@ def delete_progression_plan(plan_id):
     
     try:
         db.session.delete(plan)
+        bump_data_version(current_user.id)
         db.session.commit()
         flash('План прогрессии успешно удален!', 'success')
     except Exception as e:
@@ -2140,6 +4004,7 @@ def add_workout_template():
             template.set_exercises_data(exercises_data)
             
             db.session.add(template)
+            bump_data_version(current_user.id)
             db.session.commit()
             flash('Шаблон успешно создан!', 'success')
             return redirect(url_for('workout_templates'))
@@ -2203,38 +4068,18 @@ def use_workout_template(template_id):
             flash('Не удалось создать тренировку из шаблона. Шаблон не содержит валидных упражнений.', 'error')
             return redirect(url_for('workout_templates'))
         
-        # Рассчитываем калории
-        user_weight = safe_float(current_user.weight, 70.0)
-        session.total_calories = session.calculate_calories(user_weight, "strength")
-        
-        # Создаем запись о калориях
-        calorie_tracking = CalorieTracking(
-            user_id=current_user.id,
-            workout_session_id=session.id,
-            date=session.date,
-            calories_burned=session.total_calories,
-            workout_duration=session.duration_minutes
-        )
-        db.session.add(calorie_tracking)
-        
-        # Обновляем streaks
+        # Калории, прогресс, агрегаты, цепочка и цели пересчитываются очередью
+        enqueue_derivation(current_user.id, session.id)
         streak = WorkoutStreak.query.filter_by(
             user_id=current_user.id,
             streak_type='workout'
         ).first()
+        current_streak = streak.projected_streak() if streak else 1
         
-        if not streak:
-            streak = WorkoutStreak(user_id=current_user.id, streak_type='workout')
-            db.session.add(streak)
-        
-        streak.update_streak()
-        
-        # Обновляем прогресс целей
-        for goal in FitnessGoal.query.filter_by(user_id=current_user.id).all():
-            goal.update_progress()
-        
+        bump_data_version(current_user.id)
         db.session.commit()
-        flash(f'Тренировка создана из шаблона! Цепочка: {streak.current_streak} дней 🔥', 'success')
+        notify_derivation_workers()
+        flash(f'Тренировка создана из шаблона! Цепочка: {current_streak} дней 🔥', 'success')
         return redirect(url_for('dashboard'))
         
     except Exception as e:
@@ -2252,6 +4097,7 @@ def delete_workout_template(template_id):
     
     try:
         db.session.delete(template)
+        bump_data_version(current_user.id)
         db.session.commit()
         flash('Шаблон успешно удален!', 'success')
     except Exception as e:
@@ -2262,6 +4108,7 @@ def delete_workout_template(template_id):
 
 @app.route('/volume-load-stats')
 @login_required
+@sql_budget(6)
 def volume_load_stats():
     thirty_days_ago = date.today() - timedelta(days=30)
     volume_loads = VolumeLoadTracking.query.filter(
@@ -2299,47 +4146,673 @@ def volume_load_stats():
             'volumes': stats['volumes']
         }
     
-    return render_template('volume_load.html', 
-                         exercise_stats=exercise_stats, 
-                         exercise_stats_json=json.dumps(exercise_stats_json))
+    return render_template('volume_load.html', 
+                         exercise_stats=exercise_stats, 
+                         exercise_stats_json=json.dumps(exercise_stats_json),
+                         pending_derivations=pending_derivations_count(current_user.id))
+
+# ===== ЭКСПОРТ ДАННЫХ =====
+
+class ExportStreamBuffer:
+    """Файлоподобный приемник: накапливает записанные байты до очередной отдачи клиенту"""
+    
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+    
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self.position
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_model_batches(model, user_id, batch_size=200):
+    """Постранично выдает записи модели пользователя (keyset-пагинация по id)"""
+    last_id = 0
+    while True:
+        batch = model.query.filter(
+            model.user_id == user_id,
+            model.id > last_id
+        ).order_by(model.id).limit(batch_size).all()
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+
+def iter_export_tables(user_id, batch_size=200):
+    """Выдает (таблица, список строк) страницами по всем экспортируемым данным пользователя
+    
+    Страницы одной таблицы идут подряд, чтобы каждую таблицу можно было писать
+    в архив одним потоком.
+    """
+    for batch in iter_model_batches(WorkoutSession, user_id, batch_size):
+        yield 'workouts', [{
+            'session_id': session.id,
+            'date': session.date,
+            'name': session.name,
+            'duration_minutes': session.duration_minutes,
+            'total_calories': session.total_calories
+        } for session in batch]
+    
+    for batch in iter_session_batches(user_id, batch_size):
+        sets = []
+        for session in batch:
+            for exercise in session.exercises:
+                for workout_set in exercise.sets:
+                    sets.append({
+                        'session_id': session.id,
+                        'date': session.date,
+                        'exercise_type': exercise.exercise_type,
+                        'exercise_order': exercise.order,
+                        'set_number': workout_set.set_number,
+                        'weight': workout_set.weight,
+                        'reps': workout_set.reps
+                    })
+        yield 'sets', sets
+    
+    for batch in iter_model_batches(BodyWeight, user_id, batch_size):
+        yield 'body_weights', [{
+            'date': bw.date,
+            'weight': bw.weight,
+            'body_fat_percentage': bw.body_fat_percentage,
+            'notes': bw.notes
+        } for bw in batch]
+    
+    measurement_fields = ['neck', 'shoulders', 'forearms', 'biceps', 'chest', 'waist', 'abdomen', 'hips', 'thigh', 'calves']
+    for batch in iter_model_batches(BodyMeasurement, user_id, batch_size):
+        rows = []
+        for measurement in batch:
+            row = {'date': measurement.date}
+            for field in measurement_fields:
+                row[field] = getattr(measurement, field)
+            row['notes'] = measurement.notes
+            rows.append(row)
+        yield 'body_measurements', rows
+    
+    for batch in iter_model_batches(VolumeLoadTracking, user_id, batch_size):
+        yield 'volume_loads', [{
+            'session_id': vol.session_id,
+            'date': vol.date,
+            'exercise_type': vol.exercise_type,
+            'volume_load': vol.volume_load,
+            'sets_count': vol.sets_count,
+            'reps_count': vol.reps_count,
+            'max_weight': vol.max_weight
+        } for vol in batch]
+
+def export_arrow_schemas(pa):
+    """Схемы таблиц колоночного экспорта"""
+    measurement = [pa.field('date', pa.date32())]
+    measurement += [pa.field(name, pa.float64()) for name in
+                    ['neck', 'shoulders', 'forearms', 'biceps', 'chest', 'waist', 'abdomen', 'hips', 'thigh', 'calves']]
+    measurement.append(pa.field('notes', pa.string()))
+    
+    return {
+        'workouts': pa.schema([
+            pa.field('session_id', pa.int64()),
+            pa.field('date', pa.date32()),
+            pa.field('name', pa.string()),
+            pa.field('duration_minutes', pa.float64()),
+            pa.field('total_calories', pa.float64())
+        ]),
+        'sets': pa.schema([
+            pa.field('session_id', pa.int64()),
+            pa.field('date', pa.date32()),
+            pa.field('exercise_type', pa.string()),
+            pa.field('exercise_order', pa.int32()),
+            pa.field('set_number', pa.int32()),
+            pa.field('weight', pa.float64()),
+            pa.field('reps', pa.int32())
+        ]),
+        'body_weights': pa.schema([
+            pa.field('date', pa.date32()),
+            pa.field('weight', pa.float64()),
+            pa.field('body_fat_percentage', pa.float64()),
+            pa.field('notes', pa.string())
+        ]),
+        'body_measurements': pa.schema(measurement),
+        'volume_loads': pa.schema([
+            pa.field('session_id', pa.int64()),
+            pa.field('date', pa.date32()),
+            pa.field('exercise_type', pa.string()),
+            pa.field('volume_load', pa.float64()),
+            pa.field('sets_count', pa.int32()),
+            pa.field('reps_count', pa.int32()),
+            pa.field('max_weight', pa.float64())
+        ])
+    }
+
+def generate_csv_export(user_id):
+    """CSV: строка на каждый подход"""
+    import csv
+    from io import StringIO
+    
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Тип', 'Дата', 'Упражнение', 'Вес (кг)', 'Повторения', 'Подход', 'Калории', 'Продолжительность (мин)'])
+    
+    for batch in iter_session_batches(user_id, app.config['EXPORT_BATCH_SIZE']):
+        for session in batch:
+            for exercise in session.exercises:
+                for workout_set in exercise.sets:
+                    writer.writerow([
+                        'Тренировка',
+                        session.date.strftime('%Y-%m-%d'),
+                        exercise.exercise_type,
+                        workout_set.weight,
+                        workout_set.reps,
+                        workout_set.set_number,
+                        session.total_calories if session.total_calories else '',
+                        session.duration_minutes if session.duration_minutes else ''
+                    ])
+        
+        # Отдаем накопленный фрагмент и очищаем буфер
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate(0)
+    
+    if output.tell():
+        yield output.getvalue()
+
+def generate_ndjson_export(user_id):
+    """NDJSON (gzip): строка на запись, поле table указывает таблицу"""
+    import zlib
+    
+    compressor = zlib.compressobj(wbits=31)  # Формат gzip
+    for table, rows in iter_export_tables(user_id, app.config['EXPORT_BATCH_SIZE']):
+        lines = []
+        for row in rows:
+            record = {'table': table}
+            for key, value in row.items():
+                record[key] = value.isoformat() if isinstance(value, date) else value
+            lines.append(json.dumps(record, ensure_ascii=False))
+        if lines:
+            chunk = compressor.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+            if chunk:
+                yield chunk
+    yield compressor.flush()
+
+def generate_columnar_export(user_id, export_format):
+    """ZIP-архив с таблицей на файл: Arrow IPC (сжатие zstd) или Parquet"""
+    import zipfile
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    schemas = export_arrow_schemas(pa)
+    extension = 'parquet' if export_format == 'parquet' else 'arrow'
+    sink = ExportStreamBuffer()
+    
+    def open_table(archive, table):
+        member = archive.open(f'{table}.{extension}', 'w', force_zip64=True)
+        if export_format == 'parquet':
+            writer = pq.ParquetWriter(member, schemas[table], compression='zstd')
+        else:
+            writer = pa.ipc.new_stream(member, schemas[table],
+                                       options=pa.ipc.IpcWriteOptions(compression='zstd'))
+        return member, writer
+    
+    def close_table(member, writer):
+        writer.close()
+        member.close()
+    
+    # В ZIP можно писать только один файл за раз: таблица закрывается до открытия следующей
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        written = set()
+        current = None
+        for table, rows in iter_export_tables(user_id, app.config['EXPORT_BATCH_SIZE']):
+            if table not in written:
+                # Таблицы идут подряд, поэтому предыдущую можно закрыть
+                if current:
+                    close_table(*current)
+                current = open_table(archive, table)
+                written.add(table)
+            
+            if rows:
+                current[1].write_batch(pa.RecordBatch.from_pylist(rows, schema=schemas[table]))
+            
+            data = sink.drain()
+            if data:
+                yield data
+        
+        if current:
+            close_table(*current)
+        
+        # Пустые таблицы тоже попадают в архив, чтобы набор файлов был постоянным
+        for table in schemas:
+            if table not in written:
+                close_table(*open_table(archive, table))
+    
+    yield sink.drain()
+
+# Без sql_budget: число запросов растет с объемом выгрузки (страница на EXPORT_BATCH_SIZE тренировок)
+@app.route('/export-data')
+@login_required
+def export_data():
+    export_format = request.args.get('format', 'csv').lower()
+    export_types = {
+        'csv': ('text/csv', 'csv'),
+        'ndjson': ('application/gzip', 'ndjson.gz'),
+        'arrow': ('application/zip', 'arrow.zip'),
+        'parquet': ('application/zip', 'parquet.zip')
+    }
+    
+    if export_format not in export_types:
+        flash(f'Неподдерживаемый формат экспорта: {export_format}', 'error')
+        return redirect(url_for('dashboard'))
+    
+    if export_format in ('arrow', 'parquet'):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            flash('Экспорт в Arrow/Parquet недоступен: не установлен pyarrow', 'error')
+            return redirect(url_for('dashboard'))
+        generator = generate_columnar_export(current_user.id, export_format)
+    elif export_format == 'ndjson':
+        generator = generate_ndjson_export(current_user.id)
+    else:
+        generator = generate_csv_export(current_user.id)
+    
+    mimetype, extension = export_types[export_format]
+    filename = f'fitness_data_{current_user.username}_{date.today().strftime("%Y%m%d")}.{extension}'
+    return Response(
+        stream_with_context(generator),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+# ===== ИМПОРТ ДАННЫХ =====
+
+def detect_import_format(data, filename=None, requested=None):
+    """Определяет формат импорта: явный параметр, расширение файла или содержимое"""
+    if requested:
+        return requested.lower()
+    if filename:
+        name = filename.lower()
+        if name.endswith('.csv'):
+            return 'csv'
+        if name.endswith('.ndjson') or name.endswith('.ndjson.gz') or name.endswith('.jsonl'):
+            return 'ndjson'
+    if data[:2] == b'\x1f\x8b' or data.lstrip()[:1] == b'{':
+        return 'ndjson'
+    return 'csv'
+
+def read_import_sessions(data, import_format):
+    """Разбирает выгрузку export_data (CSV или NDJSON) в список тренировок с сырыми подходами"""
+    import csv
+    import gzip
+    from io import StringIO
+    
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    text = data.decode('utf-8-sig')
+    sessions = []
+    
+    if import_format == 'csv':
+        reader = csv.reader(StringIO(text))
+        next(reader, None)  # Заголовок
+        current_key = None
+        for line_number, row in enumerate(reader, start=2):
+            if not row or row[0] != 'Тренировка':
+                continue
+            row = row + [''] * (8 - len(row))
+            # В CSV нет идентификатора тренировки: подряд идущие строки с одинаковыми
+            # датой, калориями и продолжительностью относятся к одной тренировке
+            key = (row[1], row[6], row[7])
+            if key != current_key:
+                sessions.append({
+                    'line': line_number,
+                    'date': row[1],
+                    'name': None,
+                    'duration_minutes': row[7],
+                    'total_calories': row[6],
+                    'sets': []
+                })
+                current_key = key
+            sessions[-1]['sets'].append({
+                'line': line_number,
+                'exercise_type': row[2],
+                'weight': row[3],
+                'reps': row[4],
+                'set_number': row[5]
+            })
+        return sessions
+    
+    if import_format != 'ndjson':
+        raise ValueError(f'Неподдерживаемый формат импорта: {import_format}')
+    
+    sessions_by_id = {}
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ValueError(f'Строка {line_number}: некорректный JSON')
+        
+        table = record.get('table', 'sets')
+        if table not in ('workouts', 'sets'):
+            continue
+        
+        session = sessions_by_id.get(record.get('session_id'))
+        if session is None:
+            session = {
+                'line': line_number,
+                'date': record.get('date'),
+                'name': None,
+                'duration_minutes': None,
+                'total_calories': None,
+                'sets': []
+            }
+            sessions_by_id[record.get('session_id')] = session
+        
+        if table == 'workouts':
+            session['date'] = record.get('date')
+            session['name'] = record.get('name')
+            session['duration_minutes'] = record.get('duration_minutes')
+            session['total_calories'] = record.get('total_calories')
+        else:
+            session['sets'].append({
+                'line': line_number,
+                'exercise_type': record.get('exercise_type'),
+                'weight': record.get('weight'),
+                'reps': record.get('reps'),
+                'set_number': record.get('set_number')
+            })
+    
+    return list(sessions_by_id.values())
 
-@app.route('/export-data')
-@login_required
-def export_data():
-    import csv
-    from io import StringIO
+def validate_import_sessions(sessions):
+    """Пакетная валидация импорта (аналог validate_exercise_data для множества тренировок)
     
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Тип', 'Дата', 'Упражнение', 'Вес (кг)', 'Повторения', 'Подход', 'Калории', 'Продолжительность (мин)'])
+    Столбцы подходов преобразуются целиком, затем проверяются маски валидности.
+    Возвращает список ошибок; разобранные значения записываются в sessions.
+    """
+    errors = []
+    
+    # Каждая уникальная дата разбирается один раз
+    parsed_dates = {}
+    for raw_date in {str(session['date']) for session in sessions}:
+        try:
+            parsed_dates[raw_date] = datetime.strptime(raw_date, '%Y-%m-%d').date()
+        except (ValueError, TypeError):
+            parsed_dates[raw_date] = None
+    
+    all_sets = [s for session in sessions for s in session['sets']]
+    exercise_types = [str(s['exercise_type'] or '').strip() for s in all_sets]
+    weights = [safe_float(s['weight'], None) for s in all_sets]
+    reps = [safe_int(s['reps'], None) for s in all_sets]
+    
+    # Маски валидности считаются в NumPy, сообщения собираются только для ошибочных подходов
+    messages = {
+        'name': 'не указано название упражнения',
+        'data': 'некорректные данные в подходе упражнения "{}"',
+        'range': 'вес и повторения должны быть больше 0 в подходе упражнения "{}"'
+    }
+    for idx, reason in workout_analytics.invalid_import_sets(exercise_types, weights, reps):
+        errors.append(f'Строка {all_sets[idx]["line"]}: ' + messages[reason].format(exercise_types[idx]))
+    
+    for idx, s in enumerate(all_sets):
+        s['exercise_type'] = exercise_types[idx]
+        s['weight'] = weights[idx]
+        s['reps'] = reps[idx]
+        s['set_number'] = safe_int(s['set_number'], 0)
     
-    sessions = WorkoutSession.query.filter_by(user_id=current_user.id).order_by(WorkoutSession.date.desc()).all()
     for session in sessions:
-        for exercise in session.exercises:
-            sets_data = exercise.get_sets_data()
+        session['date'] = parsed_dates[str(session['date'])]
+        if session['date'] is None:
+            errors.append(f'Строка {session["line"]}: некорректная дата тренировки')
+        session['duration_minutes'] = safe_float(session['duration_minutes'], 60.0)
+        session['total_calories'] = safe_float(session['total_calories'], 0.0)
+    
+    return errors
+
+def import_workout_sessions(user, sessions, chunk_size=200):
+    """Записывает проверенные тренировки пакетными вставками, по транзакции на chunk_size тренировок"""
+    user_weight = safe_float(user.weight, 70.0)
+    sets_imported = 0
+    
+    for start in range(0, len(sessions), chunk_size):
+        chunk = sessions[start:start + chunk_size]
+        
+        session_rows = []
+        for session in chunk:
+            duration = session['duration_minutes'] if session['duration_minutes'] > 0 else 60.0
+            total_volume = sum(s['weight'] * s['reps'] for s in session['sets'])
+            calories = session['total_calories']
+            if calories <= 0:
+                calories = StrengthTrainingCalculator(duration, user_weight, total_volume).get_spent_calories()
+            session_rows.append({
+                'user_id': user.id,
+                'date': session['date'],
+                'name': session['name'] or f"Тренировка {session['date'].strftime('%d.%m.%Y')}",
+                'duration_minutes': session['duration_minutes'],
+                'total_calories': calories
+            })
+        db.session.bulk_insert_mappings(WorkoutSession, session_rows, return_defaults=True)
+        
+        exercise_rows = []
+        exercise_sets = []
+        for session, session_row in zip(chunk, session_rows):
+            exercises = {}
+            for s in session['sets']:
+                exercises.setdefault(s['exercise_type'], []).append(s)
+            for order, (exercise_type, sets) in enumerate(exercises.items()):
+                sets_data = [{
+                    'set_number': s['set_number'] or idx + 1,
+                    'weight': s['weight'],
+                    'reps': s['reps']
+                } for idx, s in enumerate(sets)]
+                exercise_rows.append({
+                    'session_id': session_row['id'],
+                    'exercise_type': exercise_type,
+                    'sets_data': json.dumps(sets_data, ensure_ascii=False),
+                    'order': order
+                })
+                exercise_sets.append(sets_data)
+        db.session.bulk_insert_mappings(WorkoutExercise, exercise_rows, return_defaults=True)
+        
+        set_rows = []
+        volume_rows = []
+        for exercise_row, sets_data in zip(exercise_rows, exercise_sets):
+            for set_data in sets_data:
+                set_rows.append(dict(set_data, session_id=exercise_row['session_id'], exercise_id=exercise_row['id']))
+        
+        session_dates = {row['id']: row['date'] for row in session_rows}
+        volume_by_exercise = {}
+        for exercise_row, sets_data in zip(exercise_rows, exercise_sets):
+            key = (exercise_row['session_id'], exercise_row['exercise_type'])
+            stats = volume_by_exercise.setdefault(key, {'volume_load': 0.0, 'sets_count': 0, 'reps_count': 0, 'max_weight': 0.0})
             for set_data in sets_data:
-                writer.writerow([
-                    'Тренировка',
-                    session.date.strftime('%Y-%m-%d'),
-                    exercise.exercise_type,
-                    set_data.get('weight', ''),
-                    set_data.get('reps', ''),
-                    set_data.get('set_number', ''),
-                    session.total_calories if session.total_calories else '',
-                    session.duration_minutes if session.duration_minutes else ''
-                ])
-    
-    output.seek(0)
-    response = Response(
-        output.getvalue(),
-        mimetype='text/csv',
-        headers={'Content-Disposition': f'attachment; filename=fitness_data_{current_user.username}_{date.today().strftime("%Y%m%d")}.csv'}
+                stats['volume_load'] += set_data['weight'] * set_data['reps']
+                stats['sets_count'] += 1
+                stats['reps_count'] += set_data['reps']
+                stats['max_weight'] = max(stats['max_weight'], set_data['weight'])
+        for (session_id, exercise_type), stats in volume_by_exercise.items():
+            volume_rows.append(dict(
+                stats,
+                user_id=user.id,
+                exercise_type=exercise_type,
+                session_id=session_id,
+                date=session_dates[session_id]
+            ))
+        
+        db.session.bulk_insert_mappings(WorkoutSet, set_rows)
+        db.session.bulk_insert_mappings(CalorieTracking, [{
+            'user_id': user.id,
+            'workout_session_id': row['id'],
+            'date': row['date'],
+            'calories_burned': row['total_calories'],
+            'workout_duration': row['duration_minutes']
+        } for row in session_rows])
+        db.session.bulk_insert_mappings(VolumeLoadTracking, volume_rows)
+        
+        record_progress_points([row['id'] for row in session_rows])
+        db.session.commit()
+        sets_imported += len(set_rows)
+    
+    return sets_imported
+
+def recalculate_streak(user_id):
+    """Пересчитывает цепочку тренировок по всем датам (для массовых операций)"""
+    dates = [row[0] for row in db.session.query(WorkoutSession.date).filter(
+        WorkoutSession.user_id == user_id
+    ).distinct().order_by(WorkoutSession.date).all()]
+    
+    streak = WorkoutStreak.query.filter_by(user_id=user_id, streak_type='workout').first()
+    if not streak:
+        streak = WorkoutStreak(user_id=user_id, streak_type='workout', current_streak=0, longest_streak=0)
+        db.session.add(streak)
+    
+    if not dates:
+        return streak
+    
+    current = longest = 1
+    for previous, following in zip(dates, dates[1:]):
+        current = current + 1 if (following - previous).days == 1 else 1
+        longest = max(longest, current)
+    
+    streak.current_streak = current
+    streak.last_activity_date = dates[-1]
+    streak.longest_streak = max(streak.longest_streak or 0, longest)
+    return streak
+
+def skip_existing_sessions(user_id, sessions):
+    """Отбрасывает тренировки, которые уже есть у пользователя (та же дата и название)
+    
+    Повторный импорт того же файла, в том числе после сбоя на середине, не создает дубликатов.
+    Возвращает (новые тренировки, предупреждения о пропущенных).
+    """
+    for session in sessions:
+        session['name'] = session['name'] or f"Тренировка {session['date'].strftime('%d.%m.%Y')}"
+    if not sessions:
+        return sessions, []
+    
+    existing = set(db.session.query(WorkoutSession.date, WorkoutSession.name).filter(
+        WorkoutSession.user_id == user_id,
+        WorkoutSession.date >= min(session['date'] for session in sessions),
+        WorkoutSession.date <= max(session['date'] for session in sessions)
+    ).all())
+    
+    new_sessions, warnings = [], []
+    for session in sessions:
+        if (session['date'], session['name']) in existing:
+            warnings.append(f'Строка {session["line"]}: тренировка "{session["name"]}" уже есть, пропущена')
+        else:
+            new_sessions.append(session)
+    return new_sessions, warnings
+
+def run_workout_import(user, data, import_format):
+    """Полный цикл импорта: разбор, валидация, пакетная запись и один пересчет производных данных"""
+    sessions = read_import_sessions(data, import_format)
+    warnings = [f'Строка {session["line"]}: тренировка не содержит подходов, пропущена'
+                for session in sessions if not session['sets']]
+    sessions = [session for session in sessions if session['sets']]
+    errors = validate_import_sessions(sessions)
+    if not sessions and not errors and not warnings:
+        errors.append('Файл не содержит тренировок')
+    if errors:
+        return {'success': False, 'errors': errors[:100], 'errors_count': len(errors)}
+    
+    sessions, duplicates = skip_existing_sessions(user.id, sessions)
+    warnings.extend(duplicates)
+    
+    try:
+        sets_imported = import_workout_sessions(user, sessions, app.config['IMPORT_CHUNK_SIZE'])
+    finally:
+        # Пакеты коммитятся по отдельности: после сбоя производные данные пересчитываются
+        # по уже записанным тренировкам, а повторный импорт пропустит их как дубликаты
+        db.session.rollback()
+        rebuild_rollups(user.id)
+        recalculate_streak(user.id)
+        recompute_goals_progress(user.id)
+        refresh_feature_snapshot(user.id)
+        bump_data_version(user.id)
+        db.session.commit()
+    
+    return {
+        'success': True,
+        'sessions_imported': len(sessions),
+        'sets_imported': sets_imported,
+        'sessions_skipped': len(warnings),
+        'warnings': warnings[:100]
+    }
+
+@app.route('/api/import-workouts', methods=['POST'])
+@login_required
+def import_workouts():
+    """Массовый импорт тренировок в формате export_data (CSV или NDJSON)
+    
+    В CSV нет идентификатора тренировки: подряд идущие строки с одинаковыми датой,
+    калориями и продолжительностью считаются одной тренировкой, поэтому две соседние
+    тренировки одного дня с равными калориями и продолжительностью сольются в одну.
+    NDJSON хранит session_id и такого ограничения не имеет.
+    """
+    upload = request.files.get('file')
+    data = upload.read() if upload else request.get_data()
+    if not data:
+        return jsonify({'success': False, 'error': 'Файл не найден'})
+    
+    import_format = detect_import_format(
+        data,
+        upload.filename if upload else None,
+        request.args.get('format') or request.form.get('format')
     )
-    return response
+    
+    try:
+        return jsonify(run_workout_import(current_user, data, import_format))
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'Ошибка при импорте: {str(e)}'})
+
+@app.cli.command('import-workouts')
+@click.argument('username')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'import_format', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='Формат файла (по умолчанию определяется автоматически)')
+def import_workouts_command(username, path, import_format):
+    """Импортирует тренировки пользователя из выгрузки CSV/NDJSON
+    
+    В CSV тренировки разделяются по смене даты, калорий или продолжительности:
+    соседние тренировки одного дня с одинаковыми калориями и продолжительностью
+    сливаются в одну. Чтобы сохранить разбиение, импортируйте NDJSON.
+    """
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f'Пользователь {username} не найден')
+    
+    with open(path, 'rb') as f:
+        data = f.read()
+    
+    result = run_workout_import(user, data, detect_import_format(data, path, import_format))
+    if not result['success']:
+        for error in result['errors']:
+            click.echo(error, err=True)
+        raise click.ClickException(f"Импорт отменен, ошибок: {result['errors_count']}")
+    
+    for warning in result['warnings']:
+        click.echo(warning, err=True)
+    click.echo(f"Импортировано тренировок: {result['sessions_imported']}, подходов: {result['sets_imported']}, "
+               f"пропущено: {result['sessions_skipped']}")
 
 
 @app.route('/analytics')
 @login_required
+@sql_budget(15)
 def analytics():
     """Объединенная страница аналитики и советов"""
     # Получаем данные для статистики по периодам
@@ -2352,45 +4825,10 @@ def analytics():
     
     period_stats = {}
     for period_name, start_date in periods.items():
-        sessions = WorkoutSession.query.filter(
-            WorkoutSession.user_id == current_user.id,
-            WorkoutSession.date >= start_date,
-            WorkoutSession.date <= today
-        ).all()
-        
-        exercise_stats = {}
-        total_volume = 0
-        total_calories = 0
-        
-        for session in sessions:
-            total_calories += session.total_calories or 0
-            volume_data = session.calculate_volume_load()
-            
-            for exercise_type, data in volume_data.items():
-                if exercise_type not in exercise_stats:
-                    exercise_stats[exercise_type] = {
-                        'count': 0,
-                        'total_volume': 0,
-                        'max_weight': 0
-                    }
-                
-                exercise_stats[exercise_type]['count'] += 1
-                exercise_stats[exercise_type]['total_volume'] += data.get('volume_load', 0)
-                exercise_stats[exercise_type]['max_weight'] = max(
-                    exercise_stats[exercise_type]['max_weight'],
-                    data.get('max_weight', 0)
-                )
-                total_volume += data.get('volume_load', 0)
-        
-        period_stats[period_name] = {
-            'total_workouts': len(sessions),
-            'total_calories': total_calories,
-            'total_volume': total_volume,
-            'exercise_stats': exercise_stats
-        }
+        period_stats[period_name] = get_period_stats(current_user.id, start_date, today)
     
     # Получаем данные для графиков прогресса
-    progress_data = get_progress_data(current_user.id)
+    progress_data = get_progress_data(current_user.id, app.config['PROGRESS_MAX_POINTS'])
     
     # Активные цели для расчетов
     active_goals = FitnessGoal.query.filter_by(
@@ -2408,78 +4846,137 @@ def analytics():
                          period_stats=period_stats,
                          progress_data=json.dumps(progress_data),
                          active_goals=active_goals,
-                         double_progressions=double_progressions)
+                         double_progressions=double_progressions,
+                         pending_derivations=pending_derivations_count(current_user.id))
 
 
 @app.route('/manifest.json')
 def manifest():
     return send_from_directory('static', 'manifest.json')
 
+@app.route('/sw.js')
+def service_worker():
+    """Service worker из корня сайта: только так его область охватывает страницы и /api"""
+    response = send_from_directory('static', 'sw.js', max_age=0)
+    response.cache_control.no_cache = True
+    return response
+
+def exercise_e1rm_series(user_id, exercise_type, limit):
+    """Лучший e1RM (по Эпли) за каждый тренировочный день упражнения: последние limit дней по возрастанию даты"""
+    e1rm = db.case(
+        (WorkoutSet.reps <= 1, WorkoutSet.weight),
+        else_=WorkoutSet.weight * (1 + WorkoutSet.reps / 30.0)
+    )
+    rows = db.session.query(
+        WorkoutSession.date,
+        db.func.max(e1rm)
+    ).join(
+        WorkoutExercise, WorkoutSet.exercise_id == WorkoutExercise.id
+    ).join(
+        WorkoutSession, WorkoutSet.session_id == WorkoutSession.id
+    ).filter(
+        WorkoutSession.user_id == user_id,
+        WorkoutExercise.exercise_type == exercise_type,
+        WorkoutSet.weight > 0,
+        WorkoutSet.reps > 0
+    ).group_by(WorkoutSession.date).order_by(WorkoutSession.date.desc()).limit(limit).all()
+    return rows[::-1]
+
+def progression_fit(user_id, exercise_type):
+    """Прямая Тейла-Сена по ряду e1RM упражнения
+    
+    Параметры кэшируются в response_cache; ключ включает число и максимальный id
+    подходов упражнения, поэтому пересчет происходит только при появлении (или удалении) подходов.
+    slope/slope_low/slope_high - кг e1RM в день, e1rm - значение прямой в последний день ряда.
+    """
+    sets_count, last_set_id = db.session.query(
+        db.func.count(WorkoutSet.id),
+        db.func.max(WorkoutSet.id)
+    ).join(
+        WorkoutExercise, WorkoutSet.exercise_id == WorkoutExercise.id
+    ).join(
+        WorkoutSession, WorkoutSet.session_id == WorkoutSession.id
+    ).filter(
+        WorkoutSession.user_id == user_id,
+        WorkoutExercise.exercise_type == exercise_type
+    ).one()
+    
+    window = app.config['FORECAST_WINDOW_POINTS']
+    key = f'forecast:{user_id}:{exercise_type}:{window}:{sets_count}:{last_set_id}'
+    cached = response_cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+    
+    series = exercise_e1rm_series(user_id, exercise_type, window)
+    fit = {'points': len(series), 'slope': 0.0, 'slope_low': 0.0, 'slope_high': 0.0, 'e1rm': 0.0}
+    if series:
+        last_day = series[-1][0].toordinal()
+        # Ось x - дни относительно последней тренировки, тогда свободный член равен e1RM на этот день
+        days = [row[0].toordinal() - last_day for row in series]
+        values = [safe_float(row[1], 0.0) for row in series]
+        slope, intercept, slope_low, slope_high = workout_analytics.theil_sen(days, values)
+        fit.update(slope=slope, slope_low=slope_low, slope_high=slope_high, e1rm=intercept)
+    
+    response_cache.set(key, json.dumps(fit))
+    return fit
+
 @app.route('/api/calculate-progression', methods=['POST'])
 @login_required
+@sql_budget(5)
 def calculate_progression():
-    """Расчет времени достижения цели"""
-    data = request.get_json()
+    """Расчет времени достижения цели по робастному тренду e1RM"""
+    data = request.get_json(silent=True) or {}
     
     exercise_type = data.get('exercise_type')
-    current_weight = float(data.get('current_weight', 0))
-    target_weight = float(data.get('target_weight', 0))
-    frequency = int(data.get('frequency', 2))
-    
-    # Находим историю прогресса по этому упражнению
-    exercises = WorkoutExercise.query.join(WorkoutSession).filter(
-        WorkoutSession.user_id == current_user.id,
-        WorkoutExercise.exercise_type == exercise_type
-    ).order_by(WorkoutSession.date.asc()).all()
-    
-    # Анализируем скорость прогресса
-    weight_increases = []
-    dates = []
-    
-    for exercise in exercises:
-        session = exercise.session
-        sets_data = exercise.get_sets_data()
-        if sets_data:
-            max_weight = max([s.get('weight', 0) for s in sets_data])
-            weight_increases.append(max_weight)
-            dates.append(session.date)
-    
-    # Рассчитываем среднюю скорость прогресса
+    try:
+        current_weight = float(data.get('current_weight', 0))
+        target_weight = float(data.get('target_weight', 0))
+        frequency = int(data.get('frequency', 2))
+    except (TypeError, ValueError):
+        response = jsonify({'success': False, 'error': 'Некорректные параметры расчета'})
+        response.status_code = 400
+        return response
+    if frequency < 1 or current_weight < 0:
+        response = jsonify({'success': False, 'error': 'Частота тренировок должна быть не меньше 1, вес - не отрицательным'})
+        response.status_code = 400
+        return response
+    
+    fit = progression_fit(current_user.id, exercise_type)
+    
+    # Скорость прогресса: кг рабочего веса в неделю
     avg_increase_per_week = 2.5  # кг в неделю по умолчанию
-    
-    if len(weight_increases) > 1:
-        total_increase = weight_increases[-1] - weight_increases[0]
-        if total_increase > 0 and len(dates) > 1:
-            weeks = (dates[-1] - dates[0]).days / 7
-            if weeks > 0:
-                avg_increase_per_week = total_increase / weeks
-    
-    # Расчет времени до цели
-    weight_diff = target_weight - current_weight
-    if weight_diff <= 0:
-        estimated_weeks = 0
-    else:
-        estimated_weeks = weight_diff / (avg_increase_per_week * (frequency / 2))
-    
+    band_rates = None
+    method = 'default'
+    
+    if fit['points'] >= app.config['FORECAST_MIN_POINTS'] and fit['slope'] > 0 and fit['e1rm'] > 0:
+        # Относительный прирост e1RM переносится на рабочий вес
+        scale = 7 * (current_weight / fit['e1rm'] if current_weight > 0 else 1.0)
+        avg_increase_per_week = fit['slope'] * scale
+        band_rates = (fit['slope_high'] * scale, fit['slope_low'] * scale)
+        method = 'theil_sen'
+    
+    # Расчет времени до цели (в закрытой форме)
+    weekly_increase = avg_increase_per_week * (frequency / 2)
+    estimated_weeks = workout_analytics.weeks_to_target(current_weight, target_weight, weekly_increase)
+    if estimated_weeks is None:
+        response = jsonify({'success': False, 'error': 'Нет прироста веса: срок достижения цели не определен'})
+        response.status_code = 400
+        return response
     estimated_weeks = max(1, estimated_weeks)
     estimated_months = estimated_weeks / 4.33
     
-    # Генерация данных для графика прогрессии
-    progression_data = []
-    current = current_weight
-    week_count = 0
-    
-    while current < target_weight and week_count < 52:  # макс 1 год
-        progression_data.append({
-            'week': week_count + 1,
-            'weight': round(current, 1)
-        })
-        current += avg_increase_per_week * (frequency / 2)
-        week_count += 1
+    confidence_band = {'weeks_low': None, 'weeks_high': None}
+    if band_rates:
+        for name, rate in zip(('weeks_low', 'weeks_high'), band_rates):
+            weeks = workout_analytics.weeks_to_target(current_weight, target_weight, rate * (frequency / 2))
+            # При неположительном наклоне границы срок не ограничен
+            confidence_band[name] = round(max(1, weeks), 1) if weeks is not None else None
     
-    # Добавляем целевую точку
+    # Данные для графика прогрессии (макс 1 год) и целевая точка
+    schedule = workout_analytics.linear_schedule(current_weight, target_weight, weekly_increase)
+    progression_data = [{'week': idx + 1, 'weight': round(float(weight), 1)} for idx, weight in enumerate(schedule)]
     progression_data.append({
-        'week': week_count + 1,
+        'week': len(schedule) + 1,
         'weight': target_weight
     })
     
@@ -2487,6 +4984,10 @@ def calculate_progression():
         'estimated_weeks': round(estimated_weeks, 1),
         'estimated_months': round(estimated_months, 1),
         'avg_increase_per_week': round(avg_increase_per_week, 2),
+        'trend_per_week': round(fit['slope'] * 7, 2),  # кг e1RM в неделю
+        'confidence_band': confidence_band,
+        'method': method,
+        'data_points': fit['points'],
         'progression_data': progression_data,
         'exercise': exercise_type
     })
@@ -2501,27 +5002,15 @@ def calculate_calories():
     duration = int(data.get('duration', 60))
     user_weight = float(data.get('user_weight', 70))
     
-    # MET значения для разных типов упражнений
-    met_values = {
-        'Жим лежа': 6.0,
-        'Сведение рук в кроссовере на грудь': 5.0,
-        'Разгибания на трицепс с канатной рукоятью в кроссовере': 4.0,
-        'Сгибания на бицепс в рычажном тренажере': 4.0,
-        'Махи на плечи со свободным весом': 4.5,
-        'Отведение плеча в блочном тренажере "reverse fly"': 4.0,
-        'Ягодичный мост в рычажном тренажере': 5.5,
-        'Разгибание бедра стоя в кроссовере / рычажном тренажере': 5.0,
-        'Болгарские выпады со свободным весом / в смите': 6.0,
-        'Отведение бедра сидя в сдвоенном блочном тренажере (большая ягодичная)': 4.5,
-        'Отведение с наклоном вперед бедра сидя в сдвоенном блочном тренажере (малая и средняя ягодичные)': 4.5,
-        'Приседание в Смите': 6.5,
-        'Вертикальная тяга сидя': 6.0,
-        'Горизонтальная тяга троссовая в блочном тренажере': 6.0,
-        'Экстензия на наклонной скамье': 5.5,
-        'Ходьба на дорожке с наклоном 13-14': 8.0
-    }
-    
-    met = met_values.get(exercise_type, 5.0)
+    # MET: пользовательская версия упражнения, затем каталог
+    custom_exercise = CustomExercise.query.filter_by(user_id=current_user.id, name=exercise_type).first()
+    catalog_entry = catalog_exercise(exercise_type)
+    if custom_exercise:
+        met = custom_exercise.met_value
+    elif catalog_entry:
+        met = catalog_entry['met']
+    else:
+        met = 5.0
     calories_burned = met * user_weight * (duration / 60)
     
     # Эквиваленты для сравнения
@@ -2545,6 +5034,8 @@ def calculate_calories():
 
 @app.route('/api/workout-stats/<period>')
 @login_required
+@sql_budget(6)
+@cached_json_response
 def workout_stats_period(period):
     """Статистика тренировок за период"""
     end_date = date.today()
@@ -2558,47 +5049,20 @@ def workout_stats_period(period):
     else:
         start_date = end_date - timedelta(days=7)
     
-    sessions = WorkoutSession.query.filter(
-        WorkoutSession.user_id == current_user.id,
-        WorkoutSession.date >= start_date,
-        WorkoutSession.date <= end_date
-    ).all()
-    
-    exercise_stats = {}
-    total_volume = 0
-    total_calories = 0
-    
-    for session in sessions:
-        total_calories += session.total_calories or 0
-        volume_data = session.calculate_volume_load()
-        
-        for exercise_type, data in volume_data.items():
-            if exercise_type not in exercise_stats:
-                exercise_stats[exercise_type] = {
-                    'count': 0,
-                    'total_volume': 0,
-                    'max_weight': 0
-                }
-            
-            exercise_stats[exercise_type]['count'] += 1
-            exercise_stats[exercise_type]['total_volume'] += data.get('volume_load', 0)
-            exercise_stats[exercise_type]['max_weight'] = max(
-                exercise_stats[exercise_type]['max_weight'],
-                data.get('max_weight', 0)
-            )
-            total_volume += data.get('volume_load', 0)
+    stats = get_period_stats(current_user.id, start_date, end_date)
     
     return jsonify({
         'period': period,
-        'total_workouts': len(sessions),
-        'total_calories': round(total_calories, 1),
-        'total_volume': round(total_volume, 1),
-        'exercise_stats': exercise_stats
+        'total_workouts': stats['total_workouts'],
+        'total_calories': round(stats['total_calories'], 1),
+        'total_volume': round(stats['total_volume'], 1),
+        'exercise_stats': stats['exercise_stats']
     })
 
 
 @app.route('/double-progression-dashboard')
 @login_required
+@sql_budget(6)
 def double_progression_dashboard():
     """Дашборд двойной прогрессии"""
     plans = DoubleProgression.query.filter_by(
@@ -2609,35 +5073,17 @@ def double_progression_dashboard():
     # Получаем инструкции для каждой тренировки
     training_instructions = [plan.get_training_instructions() for plan in plans]
     
-    # Получаем историю прогресса для графиков
+    # Получаем историю прогресса для графиков (одним запросом для всех планов)
+    histories = get_exercise_histories({plan.exercise_type for plan in plans}, current_user.id)
+    
     progression_history = {}
     for plan in plans:
-        # Находим все тренировки с этим упражнением
-        exercises = WorkoutExercise.query.join(WorkoutSession).filter(
-            WorkoutSession.user_id == current_user.id,
-            WorkoutExercise.exercise_type == plan.exercise_type
-        ).order_by(WorkoutSession.date.asc()).all()
-        
-        dates = []
-        weights = []
-        reps_list = []
-        
-        for exercise in exercises:
-            session = exercise.session
-            sets_data = exercise.get_sets_data()
-            if sets_data:
-                # Берем средние значения по подходам
-                avg_weight = sum(s.get('weight', 0) for s in sets_data) / len(sets_data)
-                avg_reps = sum(s.get('reps', 0) for s in sets_data) / len(sets_data)
-                
-                dates.append(session.date.isoformat())
-                weights.append(avg_weight)
-                reps_list.append(avg_reps)
-        
+        # Средние значения по подходам каждой тренировки с этим упражнением
+        history = histories.get(plan.exercise_type, [])
         progression_history[plan.id] = {
-            'dates': dates,
-            'weights': weights,
-            'reps': reps_list
+            'dates': [entry['date'] for entry in history],
+            'weights': [entry['avg_weight'] for entry in history],
+            'reps': [entry['avg_reps'] for entry in history]
         }
     
     return render_template('double_progression_dashboard.html',
@@ -2647,108 +5093,98 @@ def double_progression_dashboard():
 
 
 
+def weight_prediction_payload(recent_exercises):
+    """Рекомендация веса по агрегатам последних выполнений упражнения (новые первыми)"""
+    if not recent_exercises:
+        return {
+            'suggestion': None,
+            'message': 'Вы ранее не выполняли это упражнение. Начните с комфортного для вас веса.'
+        }
+    
+    # Анализируем последнюю тренировку
+    latest_exercise = recent_exercises[0]
+    
+    if not latest_exercise.total_sets:
+        return {
+            'suggestion': None,
+            'message': 'В прошлый раз не было записано подходов для этого упражнения.'
+        }
+    
+    if not latest_exercise.sets_count:
+        return {
+            'suggestion': None,
+            'message': 'Не найдено данных о весе в предыдущих подходах.'
+        }
+    
+    max_weight = latest_exercise.max_weight
+    min_reps = latest_exercise.min_reps
+    max_reps = latest_exercise.max_reps
+    avg_reps = float(latest_exercise.avg_reps)
+    
+    # Улучшенная логика предсказания
+    suggested_weight = max_weight
+    suggestion_reason = "Повторите последний результат"
+    
+    # Если все повторения были больше 10 - предлагаем увеличить вес
+    if min_reps >= 10:
+        suggested_weight = max_weight + 2.5
+        suggestion_reason = f"Отличный результат! Увеличьте вес до {suggested_weight}кг"
+    # Если средние повторения 8-10 - предлагаем небольшое увеличение
+    elif avg_reps >= 8:
+        suggested_weight = max_weight + 1.25
+        suggestion_reason = f"Хороший прогресс! Попробуйте {suggested_weight}кг"
+    # Если повторения были меньше 6 - предлагаем уменьшить вес
+    elif max_reps < 6:
+        suggested_weight = max(20.0, max_weight - 2.5)
+        suggestion_reason = f"Снизьте вес до {suggested_weight}кг для лучшей техники"
+    # Если были пропуски в повторениях - оставляем тот же вес
+    elif max_reps - min_reps > 4:
+        suggestion_reason = f"Оставайтесь на {suggested_weight}кг, сфокусируйтесь на стабильности"
+    
+    # Анализ тренда по предыдущим тренировкам
+    if len(recent_exercises) > 1:
+        improvement_count = 0
+        total_improvement = 0
+        
+        for i in range(1, min(4, len(recent_exercises))):
+            prev_max = recent_exercises[i].top_weight
+            if prev_max:
+                if max_weight > prev_max:
+                    improvement_count += 1
+                    total_improvement += (max_weight - prev_max)
+        
+        if improvement_count >= 2:
+            suggestion_reason += " (стабильный прогресс!)"
+        elif improvement_count == 0 and len(recent_exercises) >= 3:
+            suggestion_reason += " (плато -可以考虑 изменить стратегию)"
+    
+    return {
+        'suggestion': {
+            'weight': round(suggested_weight, 1),
+            'reps': 8,  # Стандартное значение для начала
+            'reason': suggestion_reason
+        },
+        'last_session': {
+            'date': latest_exercise.date.strftime('%d.%m.%Y'),
+            'max_weight': max_weight,
+            'reps_range': f"{min_reps}-{max_reps}",
+            'sets_count': latest_exercise.sets_count
+        }
+    }
+
 @app.route('/api/weight-prediction/<exercise_type>')
 @login_required
 def get_weight_prediction(exercise_type):
     """Улучшенное предсказание веса для упражнения на основе истории"""
     try:
-        # Ищем последние тренировки с этим упражнением
-        recent_exercises = WorkoutExercise.query.join(WorkoutSession).filter(
-            WorkoutSession.user_id == current_user.id,
+        # Агрегаты по последним тренировкам с этим упражнением
+        recent_exercises = exercise_set_stats_query(current_user.id).filter(
             WorkoutExercise.exercise_type == exercise_type
-        ).order_by(WorkoutSession.date.desc()).limit(5).all()
-        
-        if not recent_exercises:
-            return jsonify({
-                'suggestion': None,
-                'message': 'Вы ранее не выполняли это упражнение. Начните с комфортного для вас веса.'
-            })
-        
-        # Анализируем последнюю тренировку
-        latest_exercise = recent_exercises[0]
-        latest_sets = latest_exercise.get_sets_data()
-        
-        if not latest_sets:
-            return jsonify({
-                'suggestion': None,
-                'message': 'В прошлый раз не было записано подходов для этого упражнения.'
-            })
-        
-        # Собираем статистику по последней тренировке
-        weights = []
-        reps_list = []
-        
-        for set_data in latest_sets:
-            weight = safe_float(set_data.get('weight'), 0)
-            reps = safe_int(set_data.get('reps'), 0)
-            if weight > 0 and reps > 0:
-                weights.append(weight)
-                reps_list.append(reps)
-        
-        if not weights:
-            return jsonify({
-                'suggestion': None,
-                'message': 'Не найдено данных о весе в предыдущих подходах.'
-            })
+        ).order_by(
+            WorkoutSession.date.desc(), WorkoutExercise.id.desc()  # Порядок как в latest_exercise_stats_subquery
+        ).limit(app.config['WEIGHT_PREDICTION_HISTORY']).all()
         
-        max_weight = max(weights)
-        min_reps = min(reps_list)
-        max_reps = max(reps_list)
-        avg_reps = sum(reps_list) / len(reps_list)
-        
-        # Улучшенная логика предсказания
-        suggested_weight = max_weight
-        suggestion_reason = "Повторите последний результат"
-        
-        # Если все повторения были больше 10 - предлагаем увеличить вес
-        if min_reps >= 10:
-            suggested_weight = max_weight + 2.5
-            suggestion_reason = f"Отличный результат! Увеличьте вес до {suggested_weight}кг"
-        # Если средние повторения 8-10 - предлагаем небольшое увеличение
-        elif avg_reps >= 8:
-            suggested_weight = max_weight + 1.25
-            suggestion_reason = f"Хороший прогресс! Попробуйте {suggested_weight}кг"
-        # Если повторения были меньше 6 - предлагаем уменьшить вес
-        elif max_reps < 6:
-            suggested_weight = max(20.0, max_weight - 2.5)
-            suggestion_reason = f"Снизьте вес до {suggested_weight}кг для лучшей техники"
-        # Если были пропуски в повторениях - оставляем тот же вес
-        elif max_reps - min_reps > 4:
-            suggestion_reason = f"Оставайтесь на {suggested_weight}кг, сфокусируйтесь на стабильности"
-        
-        # Анализ тренда по предыдущим тренировкам
-        if len(recent_exercises) > 1:
-            improvement_count = 0
-            total_improvement = 0
-            
-            for i in range(1, min(4, len(recent_exercises))):
-                prev_sets = recent_exercises[i].get_sets_data()
-                if prev_sets:
-                    prev_weights = [safe_float(s.get('weight'), 0) for s in prev_sets if safe_float(s.get('weight'), 0) > 0]
-                    if prev_weights:
-                        prev_max = max(prev_weights)
-                        if max_weight > prev_max:
-                            improvement_count += 1
-                            total_improvement += (max_weight - prev_max)
-            
-            if improvement_count >= 2:
-                suggestion_reason += " (стабильный прогресс!)"
-            elif improvement_count == 0 and len(recent_exercises) >= 3:
-                suggestion_reason += " (плато -可以考虑 изменить стратегию)"
-        
-        return jsonify({
-            'suggestion': {
-                'weight': round(suggested_weight, 1),
-                'reps': 8,  # Стандартное значение для начала
-                'reason': suggestion_reason
-            },
-            'last_session': {
-                'date': latest_exercise.session.date.strftime('%d.%m.%Y'),
-                'max_weight': max_weight,
-                'reps_range': f"{min_reps}-{max_reps}",
-                'sets_count': len(weights)
-            }
-        })
+        return jsonify(weight_prediction_payload(recent_exercises))
         
     except Exception as e:
         return jsonify({
@@ -2756,9 +5192,56 @@ def get_weight_prediction(exercise_type):
             'message': f'Ошибка при расчете рекомендации: {str(e)}'
         })
 
+@app.route('/api/weight-predictions', methods=['POST'])
+@login_required
+@sql_budget(4)
+def get_weight_predictions():
+    """Предсказания веса сразу для нескольких упражнений (заполнение всей тренировки)
+    
+    Принимает {"exercise_types": [...]} или {"template_id": id}; история всех упражнений
+    берется одним оконным запросом (последние WEIGHT_PREDICTION_HISTORY выполнений каждого).
+    """
+    data = request.get_json(silent=True) or {}
+    exercise_types = data.get('exercise_types') or []
+    
+    if data.get('template_id') is not None:
+        template = WorkoutTemplate.query.filter_by(id=data.get('template_id'), user_id=current_user.id).first()
+        if not template:
+            return jsonify({'success': False, 'error': 'Шаблон не найден'}), 404
+        exercise_types = [ex_data.get('exercise_type') for ex_data in template.get_exercises_data()]
+    
+    if not isinstance(exercise_types, list):
+        return jsonify({'success': False, 'error': 'exercise_types должен быть списком'}), 400
+    exercise_types = list(dict.fromkeys(t for t in exercise_types if isinstance(t, str) and t))
+    if not exercise_types:
+        return jsonify({'success': False, 'error': 'Не указаны упражнения'}), 400
+    
+    ranked = latest_exercise_stats_subquery(current_user.id, exercise_types)
+    rows = db.session.query(ranked).filter(
+        ranked.c.position <= app.config['WEIGHT_PREDICTION_HISTORY']
+    ).order_by(ranked.c.exercise_type, ranked.c.position).all()
+    
+    recent_by_type = {}
+    for row in rows:
+        recent_by_type.setdefault(row.exercise_type, []).append(row)
+    
+    predictions = {}
+    for exercise_type in exercise_types:
+        try:
+            predictions[exercise_type] = weight_prediction_payload(recent_by_type.get(exercise_type, []))
+        except Exception as e:
+            predictions[exercise_type] = {
+                'suggestion': None,
+                'message': f'Ошибка при расчете рекомендации: {str(e)}'
+            }
+    
+    return jsonify({'success': True, 'predictions': predictions})
+
 
 @app.route('/api/double-progression-stats')
 @login_required
+@sql_budget(6)
+@cached_json_response
 def double_progression_stats():
     """API для получения статистики двойной прогрессии"""
     plans = DoubleProgression.query.filter_by(
@@ -2766,42 +5249,52 @@ def double_progression_stats():
         is_active=True
     ).all()
     
+    histories = get_exercise_histories({plan.exercise_type for plan in plans}, current_user.id)
+    
     stats = []
     for plan in plans:
         stats.append({
             'id': plan.id,
             'exercise': plan.exercise_type,
             'instructions': plan.get_training_instructions(),
-            'history': get_exercise_history(plan.exercise_type, current_user.id)
+            'history': histories.get(plan.exercise_type, [])
         })
     
     return jsonify(stats)
 
+def get_exercise_histories(exercise_types, user_id):
+    """Получает историю нескольких упражнений одним запросом"""
+    histories = {}
+    if not exercise_types:
+        return histories
+    
+    arrays = load_set_arrays(user_id, exercise_types)
+    instances = workout_analytics.exercise_instances(arrays)
+    for code, day, sets, avg_weight, avg_reps, e1rm in zip(
+            instances['exercise_code'], instances['day'], instances['sets'],
+            instances['avg_weight'], instances['avg_reps'], instances['e1rm']):
+        histories.setdefault(arrays.exercise_names[code], []).append({
+            'date': date.fromordinal(int(day)).isoformat(),
+            'sets': int(sets),
+            'avg_weight': float(avg_weight),
+            'avg_reps': float(avg_reps),
+            'e1rm': None if math.isnan(e1rm) else round(float(e1rm), 1)  # NaN - нет валидных подходов
+        })
+    
+    return histories
+
 def get_exercise_history(exercise_type, user_id):
     """Получает историю упражнения"""
-    exercises = WorkoutExercise.query.join(WorkoutSession).filter(
-        WorkoutSession.user_id == user_id,
-        WorkoutExercise.exercise_type == exercise_type
-    ).order_by(WorkoutSession.date.asc()).all()
-    
-    history = []
-    for exercise in exercises:
-        session = exercise.session
-        sets_data = exercise.get_sets_data()
-        if sets_data:
-            history.append({
-                'date': session.date.isoformat(),
-                'sets': len(sets_data),
-                'avg_weight': sum(s.get('weight', 0) for s in sets_data) / len(sets_data),
-                'avg_reps': sum(s.get('reps', 0) for s in sets_data) / len(sets_data)
-            })
-    
-    return history
+    return get_exercise_histories([exercise_type], user_id).get(exercise_type, [])
 
 @app.route('/api/progress-data')
 @login_required
+@sql_budget(4)
+@cached_json_response
 def api_progress_data():
-    return jsonify(get_progress_data(current_user.id))
+    # Меньше двух точек ряд не прореживается (первая и последняя сохраняются всегда)
+    max_points = max(2, request.args.get('max_points', app.config['PROGRESS_MAX_POINTS'], type=int))
+    return jsonify(get_progress_data(current_user.id, max_points))
 
 @app.route('/update-progress/<int:goal_id>')
 @login_required
@@ -2813,6 +5306,7 @@ def update_progress(goal_id):
     
     try:
         goal.update_progress()
+        bump_data_version(current_user.id)
         db.session.commit()
         flash('Прогресс обновлен!', 'success')
     except Exception as e:
@@ -2823,6 +5317,8 @@ def update_progress(goal_id):
 
 @app.route('/api/user-workouts')
 @login_required
+@sql_budget(4)
+@cached_json_response
 def get_user_workouts():
     """API для получения списка тренировок пользователя"""
     workouts = WorkoutSession.query.filter_by(
@@ -2845,11 +5341,13 @@ def get_user_workouts():
 
 @app.route('/ai-assistant')
 @login_required
+@sql_budget(6)
 def ai_assistant():
     """Страница ИИ помощника"""
-    # Получаем статистику для отображения
-    user_sessions = WorkoutSession.query.filter_by(user_id=current_user.id).all()
-    recent_sessions = WorkoutSession.query.filter_by(user_id=current_user.id).order_by(WorkoutSession.date.desc()).limit(7).all()
+    # Получаем статистику для отображения (из снимка признаков)
+    snapshot = get_feature_snapshot(current_user.id)
+    total_workouts = snapshot.total_workouts
+    recent_sessions = snapshot_recent_sessions(snapshot.get_features())[:7]
     
     # Вычисляем цепочку тренировок
     streak = 0
@@ -2865,55 +5363,71 @@ def ai_assistant():
                 else:
                     break
     
-    return render_template('ai_assistant.html', total_workouts=len(user_sessions), streak=streak)
+    return render_template('ai_assistant.html', total_workouts=total_workouts, streak=streak)
 
 @app.route('/api/ai-chat', methods=['POST'])
 @login_required
+@sql_budget(8)
 def ai_chat():
-    """API для ИИ чата"""
+    """API для ИИ чата
+    
+    С заголовком Accept: text/event-stream (или "stream": true в теле) ответ отдается
+    по секциям как Server-Sent Events: событие message на каждую секцию и done в конце.
+    """
     data = request.get_json()
     user_message = data.get('message', '').strip()
     history = data.get('history', [])
+    stream = bool(data.get('stream')) or request.accept_mimetypes.best == 'text/event-stream'
     
     if not user_message:
         return jsonify({'success': False, 'error': 'Пустое сообщение'})
     
-    # Получаем данные пользователя для контекста
-    user_sessions = WorkoutSession.query.filter_by(user_id=current_user.id).order_by(WorkoutSession.date.desc()).limit(10).all()
-    recent_sessions = user_sessions[:7] if len(user_sessions) > 0 else []
-    
-    # Анализируем тренировки
-    muscle_groups_used = {}
-    exercises_used = {}
-    exercise_progress = {}
-    
-    for session in recent_sessions:
-        for exercise in session.exercises:
-            muscle_group = determine_muscle_group(exercise.exercise_type)
-            muscle_groups_used[muscle_group] = muscle_groups_used.get(muscle_group, 0) + 1
-            exercises_used[exercise.exercise_type] = exercises_used.get(exercise.exercise_type, 0) + 1
-            
-            # Анализ прогресса
-            sets_data = exercise.get_sets_data()
-            if sets_data:
-                max_weight = max((safe_float(s.get('weight'), 0) for s in sets_data), default=0)
-                if exercise.exercise_type not in exercise_progress:
-                    exercise_progress[exercise.exercise_type] = []
-                exercise_progress[exercise.exercise_type].append({
-                    'date': session.date,
-                    'weight': max_weight
-                })
+    # Получаем данные пользователя для контекста (снимок признаков, один запрос)
+    features = get_feature_snapshot(current_user.id).get_features()
+    user_sessions = snapshot_recent_sessions(features)[:10]
+    recent_sessions = user_sessions[:7]
+    muscle_groups_used = features.get('muscle_groups_used', {})
+    exercises_used = features.get('exercises_used', {})
+    
+    # Прогресс: максимальный вес каждого выполнения, от новых тренировок к старым
+    exercise_progress = {
+        exercise_type: [{'date': date.fromisoformat(day), 'weight': weight} for day, weight in points]
+        for exercise_type, points in features.get('exercise_progress', {}).items()
+    }
     
     # Генерируем ответ на основе контекста
-    response = generate_ai_response(user_message, user_sessions, recent_sessions, muscle_groups_used, exercises_used, exercise_progress, history)
+    sections = generate_ai_response(user_message, user_sessions, recent_sessions, muscle_groups_used, exercises_used, exercise_progress, history)
+    
+    if stream:
+        return Response(
+            stream_with_context(stream_ai_response(sections)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
     
     return jsonify({
         'success': True,
-        'response': response
+        'response': ''.join(sections)
     })
 
+def sse_event(event, data):
+    """Одно событие Server-Sent Events с данными в JSON"""
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+def stream_ai_response(sections):
+    """Отдает секции ответа ИИ по мере их генерации"""
+    try:
+        for section in sections:
+            if section:
+                yield sse_event('message', {'text': section})
+    except Exception:
+        logger.exception('Ошибка генерации ответа ИИ')
+        yield sse_event('error', {'error': 'Не удалось сгенерировать ответ'})
+        return
+    yield sse_event('done', {'success': True})
+
 def generate_ai_response(message, user_sessions, recent_sessions, muscle_groups_used, exercises_used, exercise_progress, history):
-    """Генерирует ответ ИИ на основе контекста"""
+    """Генерирует ответ ИИ на основе контекста (по секциям)"""
     message_lower = message.lower()
     
     # Контекст о пользователе
@@ -2938,7 +5452,7 @@ def generate_ai_response(message, user_sessions, recent_sessions, muscle_groups_
 def generate_workout_plan_response(recent_sessions, muscle_groups_used, exercises_used, days_since_last):
     """Генерирует план тренировки"""
     if days_since_last is None:
-        return """Отлично, что вы начинаете! Рекомендую начать с базовой программы:
+        yield """Отлично, что вы начинаете! Рекомендую начать с базовой программы:
 
 **План первой тренировки:**
 1. Разминка (5-10 минут)
@@ -2949,28 +5463,30 @@ def generate_workout_plan_response(recent_sessions, muscle_groups_used, exercise
 6. Заминка (растяжка)
 
 Начните с легких весов для отработки техники. Тренируйтесь 3 раза в неделю с днем отдыха между тренировками."""
+        return
     
     if days_since_last == 0:
-        return """Вы уже тренировались сегодня! Рекомендую:
+        yield """Вы уже тренировались сегодня! Рекомендую:
 
 - **Отдых**: Дайте мышцам время на восстановление (минимум 24-48 часов)
 - **Легкое кардио**: 20-30 минут ходьбы или велотренажера для активного восстановления
 - **Растяжка**: 15-20 минут для улучшения гибкости и восстановления
 
 Помните: восстановление так же важно, как и тренировки!"""
+        return
     
     # Анализ недоработанных групп
     target_groups = ['Грудь', 'Спина', 'Ноги', 'Плечи', 'Руки']
     underworked = [g for g in target_groups if muscle_groups_used.get(g, 0) < 2]
     
-    response = f"""На основе анализа ваших тренировок, рекомендую:
+    yield f"""На основе анализа ваших тренировок, рекомендую:
 
 **Время восстановления**: Прошло {days_since_last} дней - {'отлично для тренировки!' if days_since_last >= 2 else 'можно тренироваться, но учитывайте усталость'}
 
 """
     
     if underworked:
-        response += f"**Недоработанные группы мышц**: {', '.join(underworked)}\nРекомендую добавить упражнения для этих групп.\n\n"
+        yield f"**Недоработанные группы мышц**: {', '.join(underworked)}\nРекомендую добавить упражнения для этих групп.\n\n"
     
     # Предлагаем упражнения
     all_exercises = get_all_available_exercises(current_user.id)
@@ -2980,26 +5496,26 @@ def generate_workout_plan_response(recent_sessions, muscle_groups_used, exercise
             suggested.extend(all_exercises[group][:2])
     
     if suggested:
-        response += f"**Рекомендуемые упражнения на сегодня:**\n"
+        section = f"**Рекомендуемые упражнения на сегодня:**\n"
         for i, ex in enumerate(suggested[:6], 1):
-            response += f"{i}. {ex}\n"
+            section += f"{i}. {ex}\n"
+        yield section
     
-    response += "\n**Структура тренировки:**\n- Разминка: 5-10 мин\n- Основные упражнения: 3-4 упражнения по 3-4 подхода\n- Заминка: 10-15 мин"
-    
-    return response
+    yield "\n**Структура тренировки:**\n- Разминка: 5-10 мин\n- Основные упражнения: 3-4 упражнения по 3-4 подхода\n- Заминка: 10-15 мин"
 
 def generate_progression_response(exercise_progress, exercises_used):
     """Советы по прогрессии"""
     if not exercise_progress:
-        return """Для прогрессии используйте принципы:
+        yield """Для прогрессии используйте принципы:
 
 1. **Линейная прогрессия**: Увеличивайте вес на 2.5-5% каждую неделю
 2. **Двойная прогрессия**: Сначала увеличивайте повторения, затем вес
 3. **Периодизация**: Чередуйте легкие, средние и тяжелые недели
 
 Начните отслеживать тренировки для получения персональных советов!"""
+        return
     
-    response = "**Анализ вашего прогресса:**\n\n"
+    yield "**Анализ вашего прогресса:**\n\n"
     
     for exercise_name, progress in list(exercise_progress.items())[:5]:
         if len(progress) >= 2:
@@ -3009,42 +5525,42 @@ def generate_progression_response(exercise_progress, exercises_used):
             change = last['weight'] - first['weight']
             
             if change > 0:
-                response += f"✅ **{exercise_name}**: Отлично! Прогресс с {first['weight']:.1f} до {last['weight']:.1f} кг\n"
+                yield f"✅ **{exercise_name}**: Отлично! Прогресс с {first['weight']:.1f} до {last['weight']:.1f} кг\n"
             elif change == 0:
-                response += f"⚠️ **{exercise_name}**: Прогресс остановился. Попробуйте:\n"
-                response += "   - Увеличить вес на 2.5-5%\n"
-                response += "   - Изменить количество подходов\n"
-                response += "   - Добавить вариации упражнения\n"
-    
-    response += "\n**Общие рекомендации:**\n"
-    response += "- Увеличивайте вес постепенно (2.5-5% за раз)\n"
-    response += "- Отслеживайте прогресс в повторениях\n"
-    response += "- Используйте периодизацию для долгосрочного прогресса"
-    
-    return response
+                section = f"⚠️ **{exercise_name}**: Прогресс остановился. Попробуйте:\n"
+                section += "   - Увеличить вес на 2.5-5%\n"
+                section += "   - Изменить количество подходов\n"
+                section += "   - Добавить вариации упражнения\n"
+                yield section
+    
+    section = "\n**Общие рекомендации:**\n"
+    section += "- Увеличивайте вес постепенно (2.5-5% за раз)\n"
+    section += "- Отслеживайте прогресс в повторениях\n"
+    section += "- Используйте периодизацию для долгосрочного прогресса"
+    yield section
 
 def generate_exercise_suggestions_response(muscle_groups_used, exercises_used):
     """Рекомендации по упражнениям"""
     all_exercises = get_all_available_exercises(current_user.id)
     target_groups = ['Грудь', 'Спина', 'Ноги', 'Плечи', 'Руки']
     
-    response = "**Рекомендации по упражнениям:**\n\n"
+    yield "**Рекомендации по упражнениям:**\n\n"
     
     # Находим недоработанные группы
     underworked = [g for g in target_groups if muscle_groups_used.get(g, 0) < 2]
     if underworked:
-        response += f"**Недоработанные группы**: {', '.join(underworked)}\n\n"
+        yield f"**Недоработанные группы**: {', '.join(underworked)}\n\n"
         for group in underworked[:3]:
             if group in all_exercises:
                 untried = [ex for ex in all_exercises[group] if ex not in exercises_used]
                 if untried:
-                    response += f"**{group}** - попробуйте:\n"
+                    section = f"**{group}** - попробуйте:\n"
                     for ex in untried[:3]:
-                        response += f"- {ex}\n"
-                    response += "\n"
+                        section += f"- {ex}\n"
+                    section += "\n"
+                    yield section
     
     # Предлагаем разнообразие
-    response += "**Для разнообразия попробуйте:**\n"
     suggestions = []
     for group in target_groups:
         if group in all_exercises:
@@ -3056,70 +5572,73 @@ def generate_exercise_suggestions_response(muscle_groups_used, exercises_used):
         if len(suggestions) >= 5:
             break
     
+    section = "**Для разнообразия попробуйте:**\n"
     for group, ex in suggestions:
-        response += f"- {ex} ({group})\n"
-    
-    return response
+        section += f"- {ex} ({group})\n"
+    yield section
 
 def generate_recovery_response(days_since_last, total_workouts):
     """Советы по восстановлению"""
-    response = "**Восстановление - ключ к прогрессу:**\n\n"
+    yield "**Восстановление - ключ к прогрессу:**\n\n"
     
     if days_since_last:
         if days_since_last < 1:
-            response += "⚠️ Вы тренировались сегодня. Обязательно отдохните!\n\n"
+            yield "⚠️ Вы тренировались сегодня. Обязательно отдохните!\n\n"
         elif days_since_last == 1:
-            response += "✅ Прошло 24 часа. Можно тренироваться, но:\n"
-            response += "- Тренируйте другие группы мышц\n"
-            response += "- Используйте легкие веса\n"
-            response += "- Слушайте свое тело\n\n"
+            section = "✅ Прошло 24 часа. Можно тренироваться, но:\n"
+            section += "- Тренируйте другие группы мышц\n"
+            section += "- Используйте легкие веса\n"
+            section += "- Слушайте свое тело\n\n"
+            yield section
         elif days_since_last >= 2:
-            response += f"✅ Отлично! Прошло {days_since_last} дней - оптимальное время для восстановления.\n\n"
-    
-    response += "**Принципы восстановления:**\n"
-    response += "1. **Сон**: 7-9 часов качественного сна\n"
-    response += "2. **Питание**: Белок (1.6-2.2 г/кг), углеводы для энергии\n"
-    response += "3. **Вода**: 30-40 мл на кг веса\n"
-    response += "4. **Активное восстановление**: Легкое кардио, растяжка\n"
-    response += "5. **Время**: 48-72 часа между тренировками одной группы\n\n"
-    
-    response += "**Признаки перетренированности:**\n"
-    response += "- Постоянная усталость\n"
-    response += "- Снижение результатов\n"
-    response += "- Нарушение сна\n"
-    response += "- Частые травмы\n"
-    
-    return response
+            yield f"✅ Отлично! Прошло {days_since_last} дней - оптимальное время для восстановления.\n\n"
+    
+    section = "**Принципы восстановления:**\n"
+    section += "1. **Сон**: 7-9 часов качественного сна\n"
+    section += "2. **Питание**: Белок (1.6-2.2 г/кг), углеводы для энергии\n"
+    section += "3. **Вода**: 30-40 мл на кг веса\n"
+    section += "4. **Активное восстановление**: Легкое кардио, растяжка\n"
+    section += "5. **Время**: 48-72 часа между тренировками одной группы\n\n"
+    yield section
+    
+    section = "**Признаки перетренированности:**\n"
+    section += "- Постоянная усталость\n"
+    section += "- Снижение результатов\n"
+    section += "- Нарушение сна\n"
+    section += "- Частые травмы\n"
+    yield section
 
 def generate_program_response(total_workouts, recent_sessions):
     """Рекомендации по программе"""
     if total_workouts < 10:
-        return """**Базовая программа для начинающих:**
-
-**3 раза в неделю (Пн, Ср, Пт):**
-
-**День 1 - Верх тела:**
+        # Программа длинная: отдаем по дням, чтобы чат показывал ее постепенно
+        yield "**Базовая программа для начинающих:**\n\n**3 раза в неделю (Пн, Ср, Пт):**\n\n"
+        yield """**День 1 - Верх тела:**
 - Жим лежа 3x8-12
 - Тяга штанги 3x8-12
 - Жим стоя 3x10-12
 - Подтягивания/Тяга верхнего блока 3x8-12
 
-**День 2 - Ноги:**
+"""
+        yield """**День 2 - Ноги:**
 - Приседания 3x8-12
 - Румынская тяга 3x8-12
 - Выпады 3x10-12
 - Ягодичный мост 3x12-15
 
-**День 3 - Верх тела:**
+"""
+        yield """**День 3 - Верх тела:**
 - Жим лежа 3x8-12
 - Тяга в наклоне 3x8-12
 - Махи на плечи 3x12-15
 - Отжимания 3x10-15
 
-**Принципы:**
+"""
+        yield """**Принципы:**
 - Прогрессия: +2.5-5 кг каждую неделю
 - Отдых: 48-72 часа между тренировками
 - Техника важнее веса!"""
+        return
     
     # Анализ частоты
     if recent_sessions:
@@ -3129,59 +5648,61 @@ def generate_program_response(total_workouts, recent_sessions):
             days_between.append(delta)
         avg_frequency = sum(days_between) / len(days_between) if days_between else 0
         
-        response = f"**Ваша текущая частота**: ~{avg_frequency:.1f} дня между тренировками\n\n"
+        section = f"**Ваша текущая частота**: ~{avg_frequency:.1f} дня между тренировками\n\n"
         
         if avg_frequency < 2:
-            response += "⚠️ Слишком частые тренировки! Рекомендую:\n"
-            response += "- Увеличить отдых до 2-3 дней\n"
-            response += "- Тренироваться 3-4 раза в неделю\n"
+            section += "⚠️ Слишком частые тренировки! Рекомендую:\n"
+            section += "- Увеличить отдых до 2-3 дней\n"
+            section += "- Тренироваться 3-4 раза в неделю\n"
         elif avg_frequency > 4:
-            response += "💡 Можно тренироваться чаще:\n"
-            response += "- Оптимально: каждые 2-3 дня\n"
-            response += "- Разделите тренировки по группам мышц\n"
+            section += "💡 Можно тренироваться чаще:\n"
+            section += "- Оптимально: каждые 2-3 дня\n"
+            section += "- Разделите тренировки по группам мышц\n"
         else:
-            response += "✅ Отличная частота тренировок!\n\n"
-    
-    response += "**Рекомендуемые сплиты:**\n"
-    response += "1. **Full Body** (3 раза/нед) - для начинающих\n"
-    response += "2. **Upper/Lower** (4 раза/нед) - средний уровень\n"
-    response += "3. **Push/Pull/Legs** (6 раз/нед) - продвинутый\n"
-    
-    return response
+            section += "✅ Отличная частота тренировок!\n\n"
+        yield section
+    
+    section = "**Рекомендуемые сплиты:**\n"
+    section += "1. **Full Body** (3 раза/нед) - для начинающих\n"
+    section += "2. **Upper/Lower** (4 раза/нед) - средний уровень\n"
+    section += "3. **Push/Pull/Legs** (6 раз/нед) - продвинутый\n"
+    yield section
 
 def generate_general_response(message, total_workouts, recent_sessions, muscle_groups_used):
     """Общий ответ"""
-    response = "Я ваш ИИ тренер! Вот что я могу помочь:\n\n"
-    response += "📅 **Планирование тренировок** - составлю план на сегодня\n"
-    response += "📈 **Прогрессия** - советы по увеличению веса и повторений\n"
-    response += "💡 **Упражнения** - рекомендации новых упражнений\n"
-    response += "⏱ **Восстановление** - советы по отдыху и восстановлению\n"
-    response += "🎯 **Программы** - помощь в составлении программы\n\n"
+    section = "Я ваш ИИ тренер! Вот что я могу помочь:\n\n"
+    section += "📅 **Планирование тренировок** - составлю план на сегодня\n"
+    section += "📈 **Прогрессия** - советы по увеличению веса и повторений\n"
+    section += "💡 **Упражнения** - рекомендации новых упражнений\n"
+    section += "⏱ **Восстановление** - советы по отдыху и восстановлению\n"
+    section += "🎯 **Программы** - помощь в составлении программы\n\n"
+    yield section
     
     if total_workouts > 0:
-        response += f"**Ваша статистика:**\n"
-        response += f"- Всего тренировок: {total_workouts}\n"
+        section = f"**Ваша статистика:**\n"
+        section += f"- Всего тренировок: {total_workouts}\n"
         if recent_sessions:
-            response += f"- Последняя тренировка: {recent_sessions[0].date.strftime('%d.%m.%Y')}\n"
-    
-    response += "\nЗадайте конкретный вопрос, и я дам персональный совет!"
+            section += f"- Последняя тренировка: {recent_sessions[0].date.strftime('%d.%m.%Y')}\n"
+        yield section
     
-    return response
+    yield "\nЗадайте конкретный вопрос, и я дам персональный совет!"
 
 @app.route('/api/ai-recommendations', methods=['POST'])
 @login_required
+@sql_budget(8)
 def ai_recommendations():
     """API для получения рекомендаций от ИИ помощника"""
     data = request.get_json()
     query_type = data.get('type', 'workout_plan')
     
-    # Получаем данные пользователя
-    user_sessions = WorkoutSession.query.filter_by(user_id=current_user.id).order_by(WorkoutSession.date.desc()).limit(30).all()
-    recent_sessions = user_sessions[:7] if len(user_sessions) > 0 else []
+    # Получаем данные пользователя (снимок признаков, один запрос)
+    features = get_feature_snapshot(current_user.id).get_features()
+    user_sessions = snapshot_recent_sessions(features)[:30]
+    recent_sessions = user_sessions[:7]
     
     # Анализируем тренировки
-    muscle_groups_used = {}
-    exercises_used = {}
+    muscle_groups_used = features.get('muscle_groups_used', {})
+    exercises_used = features.get('exercises_used', {})
     last_workout_date = None
     workout_frequency = 0
     
@@ -3193,13 +5714,6 @@ def ai_recommendations():
             days_between.append(delta)
         if days_between:
             workout_frequency = sum(days_between) / len(days_between) if days_between else 0
-        
-        for session in recent_sessions:
-            for exercise in session.exercises:
-                # Определяем группу мышц (упрощенно)
-                muscle_group = determine_muscle_group(exercise.exercise_type)
-                muscle_groups_used[muscle_group] = muscle_groups_used.get(muscle_group, 0) + 1
-                exercises_used[exercise.exercise_type] = exercises_used.get(exercise.exercise_type, 0) + 1
     
     # Получаем все доступные упражнения
     all_exercises = get_all_available_exercises(current_user.id)
@@ -3209,7 +5723,7 @@ def ai_recommendations():
     if query_type == 'workout_plan':
         recommendations = generate_workout_plan(recent_sessions, muscle_groups_used, exercises_used, last_workout_date, workout_frequency, all_exercises)
     elif query_type == 'progression':
-        recommendations = generate_progression_advice(user_sessions, exercises_used)
+        recommendations = generate_progression_advice(user_sessions, features.get('progression', {}))
     elif query_type == 'exercise_suggestions':
         recommendations = suggest_new_exercises(muscle_groups_used, exercises_used, all_exercises)
     elif query_type == 'general':
@@ -3226,24 +5740,14 @@ def ai_recommendations():
         }
     })
 
-def determine_muscle_group(exercise_name):
-    """Определяет группу мышц по названию упражнения"""
-    exercise_lower = exercise_name.lower()
-    
-    if any(word in exercise_lower for word in ['грудь', 'жим', 'сведение', 'разведение']):
-        return 'Грудь'
-    elif any(word in exercise_lower for word in ['бицепс', 'трицепс', 'руки', 'сгибание', 'разгибание']):
-        return 'Руки'
-    elif any(word in exercise_lower for word in ['плеч', 'махи', 'отведение']):
-        return 'Плечи'
-    elif any(word in exercise_lower for word in ['спина', 'тяга', 'экстензия']):
-        return 'Спина'
-    elif any(word in exercise_lower for word in ['ноги', 'присед', 'выпад', 'ягодиц', 'бедр']):
-        return 'Ноги'
-    elif any(word in exercise_lower for word in ['кардио', 'ходьба', 'бег', 'дорожка']):
-        return 'Кардио'
-    else:
-        return 'Другое'
+def determine_muscle_group(exercise_name, custom_groups=None):
+    """Определяет группу мышц по названию упражнения
+    
+    custom_groups - {название: группа} пользовательских упражнений, они важнее каталога.
+    """
+    if custom_groups and exercise_name in custom_groups:
+        return custom_groups[exercise_name]
+    return load_exercise_catalog()['classifier'].classify(exercise_name)
 
 def get_all_available_exercises(user_id=None):
     """Получает список всех доступных упражнений"""
@@ -3251,13 +5755,8 @@ def get_all_available_exercises(user_id=None):
         user_id = current_user.id
     
     standard_exercises = {
-        'Грудь': ['Жим лежа', 'Сведение рук в кроссовере на грудь'],
-        'Руки': ['Разгибания на трицепс с канатной рукоятью в кроссовере', 'Сгибания на бицепс в рычажном тренажере'],
-        'Плечи': ['Махи на плечи со свободным весом', 'Отведение плеча в блочном тренажере "reverse fly"'],
-        'Ноги': ['Ягодичный мост в рычажном тренажере', 'Разгибание бедра стоя в кроссовере / рычажном тренажере', 
-                 'Болгарские выпады со свободным весом / в смите', 'Приседание в Смите'],
-        'Спина': ['Вертикальная тяга сидя', 'Горизонтальная тяга троссовая в блочном тренажере', 'Экстензия на наклонной скамье'],
-        'Кардио': ['Ходьба на дорожке с наклоном 13-14']
+        group: [entry['name'] for entry in entries]
+        for group, entries in standard_exercises_by_group().items()
     }
     
     # Добавляем пользовательские упражнения
@@ -3265,7 +5764,8 @@ def get_all_available_exercises(user_id=None):
     for ex in custom_exercises:
         if ex.muscle_group not in standard_exercises:
             standard_exercises[ex.muscle_group] = []
-        standard_exercises[ex.muscle_group].append(ex.name)
+        if ex.name not in standard_exercises[ex.muscle_group]:
+            standard_exercises[ex.muscle_group].append(ex.name)
     
     return standard_exercises
 
@@ -3364,8 +5864,12 @@ def generate_workout_plan(recent_sessions, muscle_groups_used, exercises_used, l
     
     return recommendations
 
-def generate_progression_advice(user_sessions, exercises_used):
-    """Генерирует советы по прогрессии"""
+def generate_progression_advice(user_sessions, progression):
+    """Генерирует советы по прогрессии
+    
+    progression - ряды из снимка признаков: {упражнение: [[дата, макс. вес, ср. повторения], ...]}
+    по последним 20 тренировкам в порядке возрастания даты.
+    """
     recommendations = []
     
     if not user_sessions:
@@ -3375,30 +5879,15 @@ def generate_progression_advice(user_sessions, exercises_used):
             'message': 'Начните отслеживать тренировки, чтобы получать персональные советы по прогрессии!'
         }]
     
-    # Анализируем прогресс по упражнениям
-    exercise_progress = {}
-    for session in user_sessions[:20]:  # Последние 20 тренировок
-        for exercise in session.exercises:
-            sets_data = exercise.get_sets_data()
-            if sets_data:
-                max_weight = max((safe_float(s.get('weight'), 0) for s in sets_data), default=0)
-                avg_reps = sum((safe_int(s.get('reps'), 0) for s in sets_data)) / len(sets_data) if sets_data else 0
-                
-                if exercise.exercise_type not in exercise_progress:
-                    exercise_progress[exercise.exercise_type] = []
-                
-                exercise_progress[exercise.exercise_type].append({
-                    'date': session.date,
-                    'max_weight': max_weight,
-                    'avg_reps': avg_reps
-                })
+    exercise_progress = {
+        exercise_type: [{'date': day, 'max_weight': max_weight, 'avg_reps': avg_reps}
+                        for day, max_weight, avg_reps in points]
+        for exercise_type, points in progression.items()
+    }
     
     # Анализируем прогресс
     for exercise_name, progress_list in exercise_progress.items():
         if len(progress_list) >= 3:
-            # Сортируем по дате
-            progress_list.sort(key=lambda x: x['date'])
-            
             first = progress_list[0]
             last = progress_list[-1]
             
@@ -3528,6 +6017,90 @@ def get_workout_volume(workout_id):
     })
 
 
+@app.cli.command('rebuild-rollups')
+@click.option('--user-id', type=int, default=None, help='Перестроить агрегаты только для одного пользователя')
+def rebuild_rollups_command(user_id):
+    """Перестраивает дневные и недельные агрегаты тренировок"""
+    users_count = rebuild_rollups(user_id)
+    click.echo(f"Агрегаты перестроены для пользователей: {users_count}")
+
+@app.cli.command('run-derivations')
+@click.option('--retry-failed', is_flag=True, help='Вернуть в очередь задачи, исчерпавшие попытки')
+def run_derivations_command(retry_failed):
+    """Выполняет накопившиеся задачи пересчета в текущем процессе"""
+    requeue_stale_derivations()
+    if retry_failed:
+        DerivationJob.query.filter_by(status='failed').update(
+            {'status': 'pending', 'attempts': 0}, synchronize_session=False
+        )
+        db.session.commit()
+    processed = run_pending_derivations()
+    click.echo(f"Обработано задач пересчета: {processed}")
+
+@app.cli.command('process-photos')
+@click.option('--backfill', is_flag=True, help='Также перенести в хранилище старые фотографии из static/uploads')
+def process_photos_command(backfill):
+    """Обрабатывает фотографии, оставшиеся в статусе processing (например, после перезапуска)"""
+    if not photo_pipeline.available():
+        click.echo("Pillow не установлен, обработка фотографий недоступна")
+        return
+    
+    query = ProgressPhoto.query.filter(ProgressPhoto.status == 'processing')
+    if backfill:
+        query = ProgressPhoto.query.filter(ProgressPhoto.status != 'failed')
+    os.makedirs(app.config['PHOTO_WORK_FOLDER'], exist_ok=True)
+    
+    processed = 0
+    failed = 0
+    for photo in query.order_by(ProgressPhoto.id).all():
+        legacy_files = []
+        if photo.status == 'processing':
+            source_path = photo_work_path(photo.id)
+        elif photo_storage.is_content_key(photo.photo_path):
+            continue
+        else:
+            # Файлы, загруженные до хранилища, лежат в static/uploads
+            source_path = os.path.join('static', photo.photo_path)
+            legacy_files = [os.path.join('static', path) for path in photo.get_thumbnails().values()]
+        if not os.path.exists(source_path):
+            continue
+        
+        if not photo.source_hash:
+            photo.source_hash = photo_storage.file_digest(source_path)
+        process_photo_now(photo.id, photo_processing_args(photo, source_path))
+        if photo.status != 'ready' or not photo_storage.is_content_key(photo.photo_path):
+            failed += 1
+            continue
+        for path in legacy_files:
+            if os.path.exists(path):
+                os.remove(path)
+        processed += 1
+    click.echo(f"Обработано фотографий: {processed}")
+    if failed:
+        click.echo(f"Не удалось обработать: {failed} (старые файлы оставлены на месте)")
+
+
+def metrics_request_allowed():
+    """С METRICS_TOKEN - только с Bearer-токеном, без него - только прямые запросы с localhost
+    
+    Запрос с X-Forwarded-For пришел через прокси (в том числе локальный nginx) и отклоняется.
+    """
+    token = app.config['METRICS_TOKEN']
+    if token:
+        return request.headers.get('Authorization') == f'Bearer {token}'
+    return (request.remote_addr in ('127.0.0.1', '::1')
+            and 'X-Forwarded-For' not in request.headers
+            and 'Forwarded' not in request.headers)
+
+@app.route('/metrics')
+def metrics():
+    """Метрики запросов в текстовом формате Prometheus"""
+    if not metrics_request_allowed():
+        if app.config['METRICS_TOKEN']:
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('404.html'), 404
@@ -3538,52 +6111,249 @@ def internal_error(error):
     return render_template('500.html'), 500
 
 # КРИТИЧЕСКИ ВАЖНО: Миграция базы данных
-def migrate_database():
-    """Добавляет новый столбец weight если его нет"""
-    import sqlite3
+# ===== МИГРАЦИИ СХЕМЫ =====
+
+class SchemaMigration(db.Model):
+    """Примененная версия схемы БД"""
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+MIGRATIONS = []
+
+def migration(version, name):
+    """Регистрирует функцию миграции схемы с номером версии"""
+    def decorator(func):
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return decorator
+
+def add_missing_column(connection, table_name, column_name, column_ddl):
+    """Добавляет столбец в существующую таблицу, если его еще нет"""
+    columns = [column['name'] for column in db.inspect(connection).get_columns(table_name)]
+    if column_name not in columns:
+        table = connection.dialect.identifier_preparer.quote(table_name)
+        connection.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {column_name} {column_ddl}')
+
+@migration(1, 'Столбец user.weight')
+def migration_user_weight(connection):
+    add_missing_column(connection, 'user', 'weight', 'FLOAT DEFAULT 70.0')
+
+@migration(2, 'Перенос подходов из sets_data в workout_set')
+def migration_workout_sets(connection):
+    backfill_workout_sets()
+
+@migration(3, 'Ряды прогресса по упражнениям')
+def migration_progress_points(connection):
+    backfill_progress_points()
+
+@migration(4, 'Дневные и недельные агрегаты')
+def migration_rollups(connection):
+    rebuild_rollups(invalidate_calendar=False)
+
+@migration(5, 'Составные индексы для частых запросов')
+def migration_composite_indexes(connection):
+    index_names = {
+        'ix_workout_session_user_date',
+        'ix_workout_exercise_session_type',
+        'ix_workout_set_exercise_number',
+        'ix_workout_set_session',
+        'ix_fitness_goal_user_type',
+        'ix_calorie_tracking_user_date',
+        'ix_calorie_tracking_session',
+        'ix_volume_load_tracking_user_date',
+        'ix_volume_load_tracking_user_type_date',
+        'ix_volume_load_tracking_session',
+        'ix_progress_point_user_type_date',
+        'ix_progress_point_session',
+        'ix_body_weight_user_date',
+        'ix_body_measurement_user_date',
+        'ix_progress_photo_user_date',
+        'ix_progression_plan_user_type',
+        'ix_workout_streak_user_type',
+        'ix_double_progression_user_type',
+        'ix_workout_template_user_created',
+        'ix_custom_exercise_user_group'
+    }
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in index_names:
+                index.create(connection, checkfirst=True)
+
+@migration(6, 'Столбец user.data_version для кэша ответов')
+def migration_user_data_version(connection):
+    add_missing_column(connection, 'user', 'data_version', 'INTEGER NOT NULL DEFAULT 0')
+
+@migration(7, 'Каталог стандартных упражнений')
+def migration_exercise_catalog(connection):
+    seed_exercise_catalog()
+
+@migration(8, 'Статус и миниатюры фотографий прогресса')
+def migration_progress_photo_thumbnails(connection):
+    add_missing_column(connection, 'progress_photo', 'status', "VARCHAR(20) NOT NULL DEFAULT 'ready'")
+    add_missing_column(connection, 'progress_photo', 'thumbnails_data', 'TEXT')
+
+@migration(9, 'Хэш исходного файла фотографии прогресса')
+def migration_progress_photo_source_hash(connection):
+    add_missing_column(connection, 'progress_photo', 'source_hash', 'VARCHAR(64)')
+    for index in ProgressPhoto.__table__.indexes:
+        if index.name == 'ix_progress_photo_source_hash':
+            index.create(connection, checkfirst=True)
+
+@migration(10, 'Столбец user.calendar_version для кэша календаря')
+def migration_user_calendar_version(connection):
+    add_missing_column(connection, 'user', 'calendar_version', 'INTEGER NOT NULL DEFAULT 0')
+
+def run_migrations():
+    """Создает недостающие таблицы и применяет неприменённые миграции по порядку
+    
+    Запись в schema_migration фиксируется вместе с миграцией; переносы данных
+    коммитят пакетами сами и идемпотентны, поэтому после сбоя их можно повторить.
+    Возвращает список примененных (версия, название).
+    """
+    db.create_all()
+    applied = {row.version for row in SchemaMigration.query.all()}
+    db.session.commit()
+    
+    done = []
+    for version, name, func in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            func(db.session.connection())
+            db.session.add(SchemaMigration(version=version, name=name))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        done.append((version, name))
+    return done
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Применяет миграции схемы базы данных"""
+    done = run_migrations()
+    for version, name in done:
+        click.echo(f"Применена миграция {version}: {name}")
+    click.echo(f"Схема актуальна (версия {MIGRATIONS[-1][0]})")
+
+@app.cli.command('db-status')
+def db_status_command():
+    """Показывает примененные и ожидающие миграции"""
+    applied = {row.version: row.applied_at for row in SchemaMigration.query.all()}
+    for version, name, func in MIGRATIONS:
+        status = applied[version].strftime('%Y-%m-%d %H:%M') if version in applied else 'ожидает'
+        click.echo(f"{version:>3}  {status:<16}  {name}")
+
+HOT_ROUTES = [
+    '/dashboard',
+    '/analytics',
+    '/api/progress-data',
+    '/api/workout-stats/week',
+    '/api/workout-stats/month',
+    '/api/user-workouts',
+    '/volume-load-stats',
+    '/results',
+    '/api/workout-sessions',
+    '/api/body-weights',
+    '/api/workout-calendar',
+    '/export-data'
+]
+
+def explain_full_scans(connection, statement, parameters):
+    """Таблицы, которые план запроса читает полным сканированием (EXPLAIN)"""
+    import re
+    
+    tables = set(db.metadata.tables)
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        scans = [re.match(r'SCAN (\w+)(?: AS \w+)?$', row[-1]) for row in rows]
+        return sorted({match.group(1) for match in scans if match and match.group(1) in tables})
+    
+    # На маленьких таблицах PostgreSQL выбирает Seq Scan и при наличии индекса,
+    # поэтому последовательное чтение запрещается: оно останется только там, где индекса нет
+    with connection.begin_nested():
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters).fetchall()
+    scans = [re.search(r'Seq Scan on (\w+)', row[0]) for row in rows]
+    return sorted({match.group(1) for match in scans if match and match.group(1) in tables})
+
+@app.cli.command('check-query-plans')
+@click.option('--user-id', type=int, default=None, help='Пользователь, от имени которого открываются страницы')
+def check_query_plans_command(user_id):
+    """Открывает частые страницы и проверяет через EXPLAIN, что их запросы используют индексы"""
+    from sqlalchemy import event
+    
+    user = db.session.get(User, user_id) if user_id else User.query.order_by(User.id).first()
+    if not user:
+        raise click.ClickException('Нет пользователя для проверки')
+    
+    thread_id = threading.get_ident()
+    captured = []
+    
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        # Запросы фоновых воркеров пересчета не относятся к проверяемым страницам
+        if threading.get_ident() == thread_id and not executemany and statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+    
+    client = app.test_client()
+    with client.session_transaction() as login_session:
+        login_session['_user_id'] = str(user.id)
+        login_session['_fresh'] = True
+    
+    statements = {}
+    event.listen(db.engine, 'before_cursor_execute', capture)
     try:
-        # Проверяем существование файла БД
-        if not os.path.exists('fitness.db'):
-            print("База данных не найдена, будет создана при запуске приложения")
-            return
-        
-        conn = sqlite3.connect('fitness.db')
-        cursor = conn.cursor()
-        
-        # Проверяем существование таблицы user
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user'")
-        if not cursor.fetchone():
-            print("Таблица user не найдена, будет создана при запуске приложения")
-            conn.close()
-            return
-        
-        # Проверяем существование столбца
-        cursor.execute("PRAGMA table_info(user)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'weight' not in columns:
-            print("Добавляем столбец 'weight' в таблицу user...")
-            cursor.execute("ALTER TABLE user ADD COLUMN weight REAL DEFAULT 70.0")
-            conn.commit()
-            print("Столбец успешно добавлен!")
-        else:
-            print("Столбец 'weight' уже существует")
-        
-        conn.close()
-    except Exception as e:
-        print(f"Ошибка при миграции: {e}")
+        for route in HOT_ROUTES:
+            captured.clear()
+            response = client.get(route)
+            if response.status_code != 200:
+                click.echo(f"{route}: ответ {response.status_code}, пропущено", err=True)
+                continue
+            statements[route] = list(captured)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+    
+    problems = 0
+    with db.engine.connect() as connection:
+        for route, route_statements in statements.items():
+            seen = set()
+            for statement, parameters in route_statements:
+                if statement in seen:
+                    continue
+                seen.add(statement)
+                scans = explain_full_scans(connection, statement, parameters)
+                if scans:
+                    problems += 1
+                    click.echo(f"✗ {route}: полное сканирование {', '.join(scans)}")
+                    click.echo(f"    {' '.join(statement.split())[:200]}")
+            click.echo(f"{route}: запросов {len(route_statements)}, уникальных {len(seen)}")
+    
+    if problems:
+        raise click.ClickException(f'Запросов без индекса: {problems}')
+    click.echo('Все запросы частых страниц используют индексы')
+
+# Пул пересчета запускается один раз при загрузке приложения (в каждом воркере gunicorn).
+# CLI-команды flask (миграции, импорт) потоков не поднимают; при постановке задачи
+# notify_derivation_workers все равно запустит пул, если его еще нет
+if (app.config['DERIVATION_WORKERS'] > 0 and __name__ != '__main__'
+        and os.environ.get('FLASK_RUN_FROM_CLI') != 'true'):
+    derivation_pool.start()
 
 if __name__ == '__main__':
     with app.app_context():
         try:
-            # Создаем таблицы если их нет
-            db.create_all()
+            # Создаем таблицы и применяем миграции схемы
+            for version, name in run_migrations():
+                print(f"Применена миграция {version}: {name}")
             print("База данных инициализирована")
             
-            # Применяем миграцию для добавления weight
-            migrate_database()
-            
         except Exception as e:
             print(f"Ошибка при создании базы данных: {e}")
     
+    # При debug=True код выполняется и в процессе-наблюдателе перезагрузчика: пул нужен только в рабочем
+    if app.config['DERIVATION_WORKERS'] > 0 and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        derivation_pool.start()
+    
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,321 @@
+"""Нагрузочный бенчмарк частых маршрутов на синтетических данных
+
+Пример:
+    python benchmark.py --users 5 --years 3 --output bench.json
+    python benchmark.py --users 5 --years 3 --baseline bench.json
+
+Без --database-url используется временная SQLite; для PostgreSQL передайте
+URL отдельной (пустой) базы - скрипт заполняет ее тестовыми данными.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+EXERCISES = [
+    'Жим лежа',
+    'Приседание в Смите',
+    'Вертикальная тяга сидя',
+    'Горизонтальная тяга троссовая в блочном тренажере',
+    'Махи на плечи со свободным весом',
+    'Сгибания на бицепс в рычажном тренажере',
+    'Разгибания на трицепс с канатной рукоятью в кроссовере',
+    'Ягодичный мост в рычажном тренажере'
+]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Бенчмарк частых маршрутов на синтетических данных')
+    parser.add_argument('--database-url', help='База для заполнения (по умолчанию временная SQLite)')
+    parser.add_argument('--users', type=int, default=5, help='Число пользователей')
+    parser.add_argument('--years', type=float, default=3, help='Лет истории тренировок на пользователя')
+    parser.add_argument('--sessions-per-week', type=int, default=3, help='Тренировок в неделю')
+    parser.add_argument('--iterations', type=int, default=20, help='Запросов на маршрут')
+    parser.add_argument('--warm-cache', action='store_true', help='Не отключать кэш JSON-ответов')
+    parser.add_argument('--seed', type=int, default=42, help='Seed генератора данных')
+    parser.add_argument('--output', help='Куда сохранить результаты (JSON)')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--max-regression', type=float, default=20.0,
+                        help='Допустимый рост p95, %% (при превышении код выхода 1)')
+    return parser.parse_args()
+
+def percentile(values, q):
+    """Перцентиль по ближайшему рангу"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def build_sessions(rng, years, sessions_per_week):
+    """Тренировки одного пользователя в формате import_workout_sessions"""
+    sessions = []
+    day = date.today() - timedelta(days=int(years * 365))
+    base_weights = {exercise: rng.uniform(20, 80) for exercise in EXERCISES}
+    week = 0
+
+    while day <= date.today():
+        for offset in sorted(rng.sample(range(7), sessions_per_week)):
+            session_date = day + timedelta(days=offset)
+            if session_date > date.today():
+                break
+
+            sets = []
+            for exercise in rng.sample(EXERCISES, 5):
+                # Медленный рост рабочего веса с шумом
+                weight = round(base_weights[exercise] * (1 + week * 0.004) + rng.uniform(-2.5, 2.5), 1)
+                for set_number in range(1, 5):
+                    sets.append({
+                        'exercise_type': exercise,
+                        'set_number': set_number,
+                        'weight': max(weight, 2.5),
+                        'reps': rng.randint(6, 12)
+                    })
+
+            sessions.append({
+                'date': session_date,
+                'name': f'Тренировка {session_date.strftime("%d.%m.%Y")}',
+                'duration_minutes': float(rng.choice([45, 60, 75])),
+                'total_calories': 0.0,
+                'sets': sets
+            })
+        day += timedelta(days=7)
+        week += 1
+
+    return sessions
+
+def seed_database(m, args):
+    """Заполняет базу пользователями с историей тренировок, весом, целями и двойной прогрессией"""
+    rng = random.Random(args.seed)
+    password_hash = m.generate_password_hash('benchmark')
+    users = []
+
+    for idx in range(args.users):
+        user = m.User(
+            username=f'bench_user_{idx}',
+            email=f'bench_user_{idx}@example.com',
+            password_hash=password_hash,
+            weight=rng.uniform(60, 95)
+        )
+        m.db.session.add(user)
+        m.db.session.commit()
+
+        m.import_workout_sessions(user, build_sessions(rng, args.years, args.sessions_per_week),
+                                  m.app.config['IMPORT_CHUNK_SIZE'])
+
+        start = date.today() - timedelta(days=int(args.years * 365))
+        m.db.session.bulk_insert_mappings(m.BodyWeight, [{
+            'user_id': user.id,
+            'date': start + timedelta(days=7 * week),
+            'weight': round(user.weight + rng.uniform(-3, 3), 1),
+            'body_fat_percentage': round(rng.uniform(12, 25), 1)
+        } for week in range(int(args.years * 52))])
+
+        for exercise in rng.sample(EXERCISES, 3):
+            m.db.session.add(m.FitnessGoal(
+                user_id=user.id,
+                exercise_type=exercise,
+                target_weight=rng.choice([80, 100, 120]),
+                target_reps=8,
+                target_sets=3,
+                target_date=date.today() + timedelta(days=180)
+            ))
+        for exercise in rng.sample(EXERCISES, 2):
+            m.db.session.add(m.DoubleProgression(
+                user_id=user.id,
+                exercise_type=exercise,
+                current_weight=rng.choice([40, 50, 60])
+            ))
+        m.db.session.commit()
+
+        m.rebuild_rollups(user.id)
+        m.recalculate_streak(user.id)
+        m.recompute_goals_progress(user.id)
+        m.db.session.commit()
+        users.append(user.id)
+        print(f"✅ Пользователь {idx + 1}/{args.users} заполнен")
+
+    return users
+
+def workout_form(rng):
+    """Данные формы add-workout-session"""
+    form = {
+        'date': date.today().isoformat(),
+        'workout_name': 'Бенчмарк',
+        'duration_minutes': '60'
+    }
+    for idx, exercise in enumerate(rng.sample(EXERCISES, 4)):
+        form[f'exercise_type_{idx}'] = exercise
+        for set_idx in range(3):
+            form[f'weight_{idx}_{set_idx}'] = str(rng.choice([40, 50, 60]))
+            form[f'reps_{idx}_{set_idx}'] = str(rng.randint(6, 12))
+    return form
+
+def benchmark_routes(m, user_ids, args):
+    """Гоняет маршруты через тестовый клиент; возвращает статистику по каждому"""
+    from sqlalchemy import event
+
+    rng = random.Random(args.seed + 1)
+    routes = [
+        ('dashboard', 'GET', '/dashboard'),
+        ('analytics', 'GET', '/analytics'),
+        ('progress_data', 'GET', '/api/progress-data'),
+        ('export_csv', 'GET', '/export-data'),
+        ('weight_prediction', 'GET', f'/api/weight-prediction/{EXERCISES[0]}'),
+        ('add_workout_session', 'POST', '/add-workout-session')
+    ]
+
+    counter = {'statements': 0}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter['statements'] += 1
+
+    clients = []
+    for user_id in user_ids:
+        client = m.app.test_client()
+        with client.session_transaction() as login_session:
+            login_session['_user_id'] = str(user_id)
+            login_session['_fresh'] = True
+        clients.append(client)
+
+    results = {}
+    with m.app.app_context():
+        engine = m.db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for name, method, url in routes:
+            latencies, queries = [], []
+
+            for iteration in range(args.iterations + 1):
+                client = clients[iteration % len(clients)]
+                counter['statements'] = 0
+                started = time.perf_counter()
+                if method == 'GET':
+                    response = client.get(url)
+                else:
+                    response = client.post(url, data=workout_form(rng))
+                response.get_data()
+                elapsed = time.perf_counter() - started
+
+                if response.status_code not in (200, 302):
+                    raise RuntimeError(f'{url}: ответ {response.status_code}')
+                if iteration == 0:
+                    continue  # Прогрев
+                latencies.append(elapsed * 1000)
+                queries.append(counter['statements'])
+
+            # Пиковая память отдельным прогоном: tracemalloc замедляет выполнение
+            tracemalloc.start()
+            client = clients[0]
+            if method == 'GET':
+                client.get(url).get_data()
+            else:
+                client.post(url, data=workout_form(rng))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results[name] = {
+                'p50_ms': round(percentile(latencies, 50), 2),
+                'p95_ms': round(percentile(latencies, 95), 2),
+                'mean_ms': round(sum(latencies) / len(latencies), 2),
+                'queries_p50': percentile(queries, 50),
+                'queries_max': max(queries),
+                'peak_memory_kb': round(peak / 1024, 1)
+            }
+            print(f"⏱  {name:<22} p50 {results[name]['p50_ms']:>8.2f} мс  p95 {results[name]['p95_ms']:>8.2f} мс  "
+                  f"запросов {results[name]['queries_p50']:>4}  память {results[name]['peak_memory_kb']:>9.1f} КБ")
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    return results
+
+def compare_with_baseline(results, baseline_path, max_regression):
+    """Печатает изменения относительно прошлого прогона; возвращает True, если регрессий нет"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)['routes']
+
+    ok = True
+    print("\n📊 Сравнение с базовым прогоном (p95):")
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            print(f"   {name:<22} нет в базовом прогоне")
+            continue
+        change = (current['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100 if previous['p95_ms'] else 0.0
+        queries = current['queries_p50'] - previous['queries_p50']
+        mark = '✅'
+        if change > max_regression:
+            mark = '❌'
+            ok = False
+        print(f"   {mark} {name:<22} {previous['p95_ms']:>8.2f} → {current['p95_ms']:>8.2f} мс ({change:+.1f}%), "
+              f"запросов {queries:+d}")
+    return ok
+
+def main():
+    args = parse_args()
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='fitness-bench-'), 'bench.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    # Производные данные считаются сразу после коммита, чтобы их стоимость входила в замер
+    os.environ.setdefault('DERIVATION_WORKERS', '0')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    import app as m
+
+    if not args.warm_cache:
+        m.response_cache = m.LRUResponseCache(0)
+
+    with m.app.app_context():
+        m.run_migrations()
+        if m.User.query.filter(m.User.username.like('bench_user_%')).count():
+            print("❌ База уже содержит данные бенчмарка, используйте пустую базу")
+            sys.exit(2)
+
+        print(f"🔄 Заполнение базы: {args.users} польз., {args.years} г. истории...")
+        started = time.perf_counter()
+        user_ids = seed_database(m, args)
+        seed_seconds = time.perf_counter() - started
+        sessions_count = m.WorkoutSession.query.count()
+        sets_count = m.WorkoutSet.query.count()
+        dialect = m.db.engine.dialect.name
+    print(f"✅ Заполнено за {seed_seconds:.1f} с: тренировок {sessions_count}, подходов {sets_count}")
+
+    print("🔄 Замеры маршрутов...")
+    routes = benchmark_routes(m, user_ids, args)
+
+    results = {
+        'meta': {
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'database': dialect,
+            'python': sys.version.split()[0],
+            'users': args.users,
+            'years': args.years,
+            'sessions_per_week': args.sessions_per_week,
+            'iterations': args.iterations,
+            'warm_cache': args.warm_cache,
+            'sessions': sessions_count,
+            'sets': sets_count,
+            'seed_seconds': round(seed_seconds, 2),
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        },
+        'routes': routes
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ Результаты сохранены в {args.output}")
+
+    if args.baseline and not compare_with_baseline(routes, args.baseline, args.max_regression):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
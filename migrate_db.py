@@ -1,12 +1,14 @@
-from app import app, db
+from app import app, db, run_migrations
 import os
 
 def migrate_database():
     with app.app_context():
         try:
             print("🔄 Создание таблиц в базе данных...")
-            db.create_all()
+            done = run_migrations()
             print("✅ Таблицы созданы успешно")
+            for version, name in done:
+                print(f"✅ Миграция {version}: {name}")
             
             # Проверяем существование таблицы user
             from sqlalchemy import inspect
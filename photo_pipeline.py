@@ -0,0 +1,58 @@
+"""Обработка фотографий прогресса (Pillow)
+
+Модуль не зависит от Flask и моделей, чтобы функции можно было выполнять в
+отдельных процессах: app.upload_photo сохраняет загрузку на диск, а
+process_photo перекодирует ее и строит миниатюры.
+"""
+import os
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow не установлен: фотографии сохраняются как есть
+    Image = None
+
+FORMAT = 'WEBP'
+EXTENSION = 'webp'
+
+def available():
+    """Можно ли обрабатывать фотографии (установлен ли Pillow)"""
+    return Image is not None
+
+def variant_name(stem, size=None):
+    """Имя файла варианта: полноразмерного (size=None) или миниатюры по длинной стороне"""
+    return f'{stem}.{EXTENSION}' if size is None else f'{stem}_{size}.{EXTENSION}'
+
+def process_photo(source_path, target_dir, stem, sizes, max_size, quality):
+    """Перекодирует загрузку в WebP без EXIF и строит миниатюры
+
+    Ориентация из EXIF применяется к пикселям, затем метаданные отбрасываются
+    (в них бывают GPS-координаты). Полноразмерный вариант ограничен max_size
+    по длинной стороне. Исходный файл удаляется после успешной обработки.
+    Возвращает {'original': имя, 'thumbnails': {размер: имя}}.
+    """
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        # Новое изображение без info: EXIF, ICC и XMP не переносятся
+        clean = Image.new(image.mode, image.size)
+        clean.paste(image)
+        clean.thumbnail((max_size, max_size), Image.LANCZOS)
+
+        result = {'original': variant_name(stem), 'thumbnails': {}}
+        clean.save(os.path.join(target_dir, result['original']), FORMAT, quality=quality, method=4)
+
+        for size in sorted(sizes, reverse=True):
+            if size >= max(clean.size):
+                continue  # Миниатюра не больше оригинала: отдается полноразмерный вариант
+            thumbnail = clean.copy()
+            thumbnail.thumbnail((size, size), Image.LANCZOS)
+            name = variant_name(stem, size)
+            thumbnail.save(os.path.join(target_dir, name), FORMAT, quality=quality, method=4)
+            result['thumbnails'][size] = name
+
+    # Старые фотографии в WebP перезаписываются на месте
+    if os.path.abspath(source_path) != os.path.abspath(os.path.join(target_dir, result['original'])):
+        os.remove(source_path)
+    return result
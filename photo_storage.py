@@ -0,0 +1,100 @@
+"""Хранилища файлов фотографий прогресса
+
+Файлы адресуются хэшем содержимого (SHA-256): одинаковые файлы хранятся один раз,
+а имя никогда не меняет смысл, поэтому ответы можно кэшировать навсегда.
+Модуль не зависит от Flask: app.create_photo_storage выбирает бэкенд по конфигурации.
+"""
+import hashlib
+import os
+import re
+import shutil
+
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PRIVATE_CACHE_CONTROL = 'private, max-age=31536000, immutable'  # Ответы photo_file зависят от пользователя
+KEY_PATTERN = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]{1,5}$')
+CONTENT_TYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 содержимого файла (hex)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def content_key(digest, extension):
+    """Ключ объекта по хэшу: ab/cd/abcd....webp (два уровня каталогов, чтобы не копить файлы в одном)"""
+    return f'{digest[:2]}/{digest[2:4]}/{digest}.{extension.lower()}'
+
+def is_content_key(key):
+    return bool(KEY_PATTERN.match(key))
+
+def content_type(key):
+    return CONTENT_TYPES.get(key.rsplit('.', 1)[-1], 'application/octet-stream')
+
+class FilesystemPhotoStorage:
+    """Файлы в локальном каталоге (или в общем томе для нескольких экземпляров приложения)"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def put_file(self, source_path, key):
+        """Переносит файл в хранилище; существующий объект с тем же ключом не перезаписывается"""
+        target = self.path(key)
+        if os.path.exists(target):
+            os.remove(source_path)
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Через временное имя: читатели никогда не видят недописанный файл
+        partial = f'{target}.partial-{os.getpid()}'
+        shutil.move(source_path, partial)
+        os.replace(partial, target)
+
+class S3PhotoStorage:
+    """S3-совместимое объектное хранилище (AWS S3, MinIO)"""
+
+    def __init__(self, bucket, endpoint_url=None, access_key=None, secret_key=None, region=None,
+                 url_expires=3600):
+        import boto3
+        from botocore.config import Config
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region,
+            # MinIO и другие S3-совместимые серверы обычно не поддерживают бакеты в поддомене
+            config=Config(s3={'addressing_style': 'path'}) if endpoint_url else None
+        )
+        self.bucket = bucket
+        self.url_expires = url_expires
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put_file(self, source_path, key):
+        """Загружает файл (если объекта еще нет) и удаляет локальную копию"""
+        if not self.exists(key):
+            self.client.upload_file(source_path, self.bucket, key, ExtraArgs={
+                'ContentType': content_type(key),
+                'CacheControl': CACHE_CONTROL
+            })
+        os.remove(source_path)
+
+    def presigned_url(self, key):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=self.url_expires
+        )
@@ -2,36 +2,8 @@
  * Данные об упражнениях с группировкой по мышцам и MET значениями
  */
 
-const EXERCISES_DATA = {
-    'Грудь': [
-        { name: 'Жим лежа', met: 6.0 },
-        { name: 'Сведение рук в кроссовере на грудь', met: 5.0 }
-    ],
-    'Руки': [
-        { name: 'Разгибания на трицепс с канатной рукоятью в кроссовере', met: 4.0 },
-        { name: 'Сгибания на бицепс в рычажном тренажере', met: 4.0 }
-    ],
-    'Плечи': [
-        { name: 'Махи на плечи со свободным весом', met: 4.5 },
-        { name: 'Отведение плеча в блочном тренажере "reverse fly"', met: 4.0 }
-    ],
-    'Ноги': [
-        { name: 'Ягодичный мост в рычажном тренажере', met: 5.5 },
-        { name: 'Разгибание бедра стоя в кроссовере / рычажном тренажере', met: 5.0 },
-        { name: 'Болгарские выпады со свободным весом / в смите', met: 6.0 },
-        { name: 'Отведение бедра сидя в сдвоенном блочном тренажере (большая ягодичная)', met: 4.5 },
-        { name: 'Отведение с наклоном вперед бедра сидя в сдвоенном блочном тренажере (малая и средняя ягодичные)', met: 4.5 },
-        { name: 'Приседание в Смите', met: 6.5 }
-    ],
-    'Спина': [
-        { name: 'Вертикальная тяга сидя', met: 6.0 },
-        { name: 'Горизонтальная тяга троссовая в блочном тренажере', met: 6.0 },
-        { name: 'Экстензия на наклонной скамье', met: 5.5 }
-    ],
-    'Кардио': [
-        { name: 'Ходьба на дорожке с наклоном 13-14', met: 8.0 }
-    ]
-};
+// Каталог приходит с сервера (/exercise-catalog.js, таблица exercise_catalog)
+const EXERCISES_DATA = window.EXERCISE_CATALOG || {};
 
 // Плоский список всех упражнений для обратной совместимости
 const ALL_EXERCISES = [];
@@ -1,12 +1,32 @@
-const CACHE_NAME = 'fitness-tracker-v1.2';
+const CACHE_NAME = 'fitness-tracker-v1.5';
 const urlsToCache = [
-  '/',
   '/static/style.css',
   '/static/manifest.json',
-  '/static/icons/icon-192x192.png',
+  '/static/exercises-data.js',
+  '/exercise-catalog.js',
   '/static/icons/icon-512x512.png'
 ];
 
+// Каталог упражнений меняется вместе с БД: берется из сети, кэш - только без сети
+const networkFirstAssets = ['/exercise-catalog.js'];
+
+// Страницы с формами записи: открываются из кэша, если сети нет
+const offlinePages = ['/add-workout-session', '/results'];
+
+// Запросы, которые без сети попадают в очередь и уходят пакетом в /api/sync
+const queuedRoutes = {
+  '/add-workout-session': 'workout_session',
+  '/api/add-body-weight': 'body_weight',
+  '/api/add-body-measurement': 'body_measurement'
+};
+
+const SYNC_TAG = 'sync-queue';
+const SYNC_BATCH_SIZE = 50;
+const DB_NAME = 'fitness-sync';
+const STORE_NAME = 'operations';
+// Владелец очереди: id вошедшего пользователя, его сообщает страница при загрузке
+const META_STORE = 'meta';
+
 self.addEventListener('install', function(event) {
   event.waitUntil(
     caches.open(CACHE_NAME)
@@ -17,16 +37,32 @@ self.addEventListener('install', function(event) {
 });
 
 self.addEventListener('fetch', function(event) {
-  event.respondWith(
-    caches.match(event.request)
-      .then(function(response) {
-        if (response) {
-          return response;
-        }
-        return fetch(event.request);
-      }
-    )
-  );
+  const url = new URL(event.request.url);
+  if (url.origin !== self.location.origin) {
+    return;
+  }
+
+  if (event.request.method === 'POST' && queuedRoutes[url.pathname]) {
+    event.respondWith(fetchOrQueue(event.request, queuedRoutes[url.pathname]));
+    return;
+  }
+  if (event.request.method !== 'GET') {
+    return;
+  }
+
+  if ((event.request.mode === 'navigate' && offlinePages.includes(url.pathname)) ||
+      networkFirstAssets.includes(url.pathname)) {
+    event.respondWith(networkFirst(event.request));
+    return;
+  }
+  if (urlsToCache.includes(url.pathname)) {
+    event.respondWith(
+      caches.match(event.request)
+        .then(function(response) {
+          return response || fetch(event.request);
+        })
+    );
+  }
 });
 
 self.addEventListener('activate', function(event) {
@@ -41,4 +77,291 @@ self.addEventListener('activate', function(event) {
       );
     })
   );
-});
\ No newline at end of file
+});
+
+// Background Sync: браузер вызывает событие, когда связь восстановлена
+self.addEventListener('sync', function(event) {
+  if (event.tag === SYNC_TAG) {
+    event.waitUntil(flushQueue());
+  }
+});
+
+// Без Background Sync очередь отправляет страница (событие online и загрузка).
+// Страница передает id вошедшего пользователя и получает отклоненные сервером операции
+self.addEventListener('message', function(event) {
+  if (event.data && event.data.type === 'flush-sync-queue') {
+    event.waitUntil(
+      setQueueOwner(event.data.userId)
+        .then(flushQueue)
+        .catch(function() {})
+        .then(function() {
+          return takeRejected(event.data.userId);
+        })
+        .then(function(rejected) {
+          if (rejected.length && event.source) {
+            event.source.postMessage({ type: 'sync-rejected', operations: rejected });
+          }
+        })
+    );
+  }
+});
+
+function networkFirst(request) {
+  return fetch(request)
+    .then(function(response) {
+      if (response.ok && !response.redirected) {
+        const copy = response.clone();
+        caches.open(CACHE_NAME).then(function(cache) {
+          cache.put(request.url.split('?')[0], copy);
+        });
+      }
+      return response;
+    })
+    .catch(function() {
+      return caches.match(request, { ignoreSearch: true })
+        .then(function(response) {
+          return response || offlineNotice('Страница недоступна без сети');
+        });
+    });
+}
+
+function fetchOrQueue(request, type) {
+  const copy = request.clone();
+  return fetch(request).catch(function() {
+    return Promise.all([readRequestData(copy), getQueueOwner()])
+      .then(function(values) {
+        return enqueueOperation({
+          id: self.crypto.randomUUID(),
+          type: type,
+          data: values[0],
+          user_id: values[1],
+          queued_at: localDate(),
+          created: Date.now()
+        });
+      })
+      .then(function(operation) {
+        requestSync();
+        if (type === 'workout_session') {
+          return offlineNotice('Нет сети: тренировка сохранена на устройстве и будет отправлена при подключении');
+        }
+        return new Response(JSON.stringify({ success: true, queued: true, id: operation.id }), {
+          headers: { 'Content-Type': 'application/json' }
+        });
+      });
+  });
+}
+
+function readRequestData(request) {
+  if ((request.headers.get('Content-Type') || '').includes('application/json')) {
+    return request.json();
+  }
+  return request.formData().then(function(formData) {
+    const data = {};
+    formData.forEach(function(value, key) {
+      data[key] = value;
+    });
+    return data;
+  });
+}
+
+function localDate() {
+  const now = new Date();
+  return [now.getFullYear(), String(now.getMonth() + 1).padStart(2, '0'), String(now.getDate()).padStart(2, '0')].join('-');
+}
+
+function offlineNotice(message) {
+  const body = '<!DOCTYPE html><html lang="ru"><head><meta charset="UTF-8">' +
+    '<meta name="viewport" content="width=device-width, initial-scale=1.0">' +
+    '<link rel="stylesheet" href="/static/style.css"><title>Офлайн</title></head>' +
+    '<body><div class="container"><div class="flash-message success">' + message + '</div>' +
+    '<a href="/add-workout-session" class="btn-primary">Новая тренировка</a></div></body></html>';
+  return new Response(body, { headers: { 'Content-Type': 'text/html; charset=utf-8' } });
+}
+
+function requestSync() {
+  if (self.registration.sync) {
+    return self.registration.sync.register(SYNC_TAG).catch(function() {});
+  }
+  return Promise.resolve();
+}
+
+// IndexedDB: очередь операций с ключом id (UUID операции) и владелец очереди
+function openQueue() {
+  return new Promise(function(resolve, reject) {
+    const request = indexedDB.open(DB_NAME, 2);
+    request.onupgradeneeded = function() {
+      const db = request.result;
+      if (!db.objectStoreNames.contains(STORE_NAME)) {
+        db.createObjectStore(STORE_NAME, { keyPath: 'id' });
+      }
+      if (!db.objectStoreNames.contains(META_STORE)) {
+        db.createObjectStore(META_STORE);
+      }
+    };
+    request.onsuccess = function() {
+      resolve(request.result);
+    };
+    request.onerror = function() {
+      reject(request.error);
+    };
+  });
+}
+
+function queueTransaction(mode, callback, storeName) {
+  storeName = storeName || STORE_NAME;
+  return openQueue().then(function(db) {
+    return new Promise(function(resolve, reject) {
+      const transaction = db.transaction(storeName, mode);
+      const result = callback(transaction.objectStore(storeName));
+      transaction.oncomplete = function() {
+        db.close();
+        resolve(result instanceof IDBRequest ? result.result : result);
+      };
+      transaction.onerror = function() {
+        db.close();
+        reject(transaction.error);
+      };
+    });
+  });
+}
+
+function getQueueOwner() {
+  return queueTransaction('readonly', function(store) {
+    return store.get('user_id');
+  }, META_STORE).then(function(userId) {
+    return userId === undefined ? null : userId;
+  });
+}
+
+function setQueueOwner(userId) {
+  return queueTransaction('readwrite', function(store) {
+    store.put(userId === undefined ? null : userId, 'user_id');
+    return userId;
+  }, META_STORE);
+}
+
+function enqueueOperation(operation) {
+  return queueTransaction('readwrite', function(store) {
+    store.put(operation);
+    return operation;
+  });
+}
+
+function markRejected(items) {
+  return queueTransaction('readwrite', function(store) {
+    items.forEach(function(item) {
+      const request = store.get(item.id);
+      request.onsuccess = function() {
+        if (request.result) {
+          request.result.rejected = item.error || 'Операция отклонена сервером';
+          store.put(request.result);
+        }
+      };
+    });
+    return items;
+  });
+}
+
+// Отклоненные операции пользователя передаются странице и только после этого удаляются
+function takeRejected(userId) {
+  if (userId === undefined || userId === null) {
+    return Promise.resolve([]);
+  }
+  return queueTransaction('readonly', function(store) {
+    return store.getAll();
+  }).then(function(operations) {
+    const rejected = operations.filter(function(operation) {
+      return operation.rejected && operation.user_id === userId;
+    });
+    return removeOperations(rejected.map(function(operation) {
+      return operation.id;
+    })).then(function() {
+      return rejected.map(function(operation) {
+        return { id: operation.id, type: operation.type, queued_at: operation.queued_at, error: operation.rejected };
+      });
+    });
+  });
+}
+
+function removeOperations(ids) {
+  return queueTransaction('readwrite', function(store) {
+    ids.forEach(function(id) {
+      store.delete(id);
+    });
+    return ids;
+  });
+}
+
+let flushing = null;
+
+function flushQueue() {
+  // Один проход за раз: событие sync и сообщение страницы могут прийти одновременно
+  if (!flushing) {
+    flushing = sendPending().finally(function() {
+      flushing = null;
+    });
+  }
+  return flushing;
+}
+
+// Отправляются только операции текущего владельца очереди: записи другого пользователя
+// (общее устройство) ждут его следующего входа и не попадают в чужой аккаунт
+function sendPending() {
+  return Promise.all([
+    queueTransaction('readonly', function(store) {
+      return store.getAll();
+    }),
+    getQueueOwner()
+  ]).then(function(values) {
+    const userId = values[1];
+    if (userId === null) {
+      return;
+    }
+    const operations = values[0].filter(function(operation) {
+      return !operation.rejected && operation.user_id === userId;
+    });
+    operations.sort(function(a, b) {
+      return a.created - b.created;
+    });
+    return sendBatches(operations, userId);
+  });
+}
+
+function sendBatches(operations, userId) {
+  if (!operations.length) {
+    return Promise.resolve();
+  }
+  const batch = operations.slice(0, SYNC_BATCH_SIZE);
+  return fetch('/api/sync', {
+    method: 'POST',
+    credentials: 'same-origin',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      operations: batch.map(function(operation) {
+        return { id: operation.id, type: operation.type, data: operation.data, queued_at: operation.queued_at, user_id: operation.user_id };
+      })
+    })
+  })
+    .then(function(response) {
+      // Редирект означает, что сессия истекла: очередь ждет следующего входа
+      if (!response.ok || response.redirected) {
+        throw new Error('Синхронизация не удалась: ' + response.status);
+      }
+      return response.json();
+    })
+    .then(function(result) {
+      // Примененные и повторные операции удаляются, отклоненные ждут показа на странице
+      const rejected = result.results.filter(function(item) {
+        return item.status === 'rejected';
+      });
+      const done = result.results.filter(function(item) {
+        return item.status !== 'rejected';
+      }).map(function(item) {
+        return item.id;
+      });
+      return Promise.all([removeOperations(done), markRejected(rejected)]);
+    })
+    .then(function() {
+      return sendBatches(operations.slice(SYNC_BATCH_SIZE), userId);
+    });
+}
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""Общие фикстуры тестов: приложение на временной SQLite и вошедший пользователь"""
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import date
+
+import pytest
+
+# Окружение задается до импорта app: конфигурация читается при импорте
+TEST_DIR = tempfile.mkdtemp(prefix='fitness-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TEST_DIR, 'test.db')
+os.environ['DERIVATION_WORKERS'] = '0'
+os.environ['PHOTO_WORKERS'] = '0'
+os.environ['PHOTO_WORK_FOLDER'] = os.path.join(TEST_DIR, 'photo-work')
+os.environ['PHOTO_STORAGE_ROOT'] = os.path.join(TEST_DIR, 'photos')
+os.environ['RESPONSE_CACHE_BACKEND'] = 'lru'
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as fitness  # noqa: E402
+
+@pytest.fixture
+def app():
+    """Чистая база на каждый тест
+    
+    Контекст приложения не остается открытым: иначе запросы тестового клиента
+    разделяют g и счетчики SQL-запросов накапливаются между ними.
+    """
+    fitness.app.config['TESTING'] = True
+    fitness.response_cache = fitness.LRUResponseCache(fitness.app.config['RESPONSE_CACHE_MAX_ENTRIES'])
+    fitness.request_metrics = fitness.RequestMetrics()
+    with fitness.app.app_context():
+        fitness.db.drop_all()
+        fitness.run_migrations()
+    yield fitness.app
+    with fitness.app.app_context():
+        fitness.db.session.remove()
+
+def create_user(username='tester', weight=80.0):
+    with fitness.app.app_context():
+        user = fitness.User(username=username, email=f'{username}@example.com', weight=weight,
+                            password_hash=fitness.generate_password_hash('secret'))
+        fitness.db.session.add(user)
+        fitness.db.session.commit()
+        return user.id
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+@pytest.fixture
+def user_id(app):
+    return create_user()
+
+@pytest.fixture
+def client(app, user_id):
+    return login(app.test_client(), user_id)
+
+def workout_form(day, exercises=(('Жим лежа', 60, 10), ('Приседание в Смите', 80, 6)), name='Тренировка'):
+    """Поля формы add-workout-session: по два подхода на упражнение"""
+    form = {'date': day.isoformat(), 'workout_name': name, 'duration_minutes': '60'}
+    for idx, (exercise, weight, reps) in enumerate(exercises):
+        form[f'exercise_type_{idx}'] = exercise
+        for set_idx in range(2):
+            form[f'weight_{idx}_{set_idx}'] = str(weight + set_idx * 2.5)
+            form[f'reps_{idx}_{set_idx}'] = str(reps)
+    return form
+
+def add_workout(client, day=None, **kwargs):
+    response = client.post('/add-workout-session', data=workout_form(day or date.today(), **kwargs))
+    assert response.status_code == 302
+    return response
+
+@contextmanager
+def count_statements():
+    """Считает SQL-запросы, выполненные внутри блока: with count_statements() as counter: ... counter['n']
+    
+    Тексты запросов доступны в counter['statements'].
+    """
+    from sqlalchemy import event
+    
+    counter = {'n': 0, 'statements': []}
+    
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter['n'] += 1
+        counter['statements'].append(statement)
+    
+    with fitness.app.app_context():
+        engine = fitness.db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
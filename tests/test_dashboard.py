@@ -0,0 +1,38 @@
+from datetime import date, timedelta
+
+from conftest import add_workout, count_statements
+
+def add_goals(client, exercises):
+    for exercise in exercises:
+        response = client.post('/add-goal', data={
+            'exercise_type': exercise,
+            'target_weight': '100',
+            'target_reps': '8',
+            'target_sets': '3',
+            'target_date': (date.today() + timedelta(days=90)).isoformat()
+        })
+        assert response.status_code == 302
+
+def dashboard_statements(client):
+    with count_statements() as counter:
+        response = client.get('/dashboard')
+    assert response.status_code == 200
+    return counter['n']
+
+def test_dashboard_query_count_does_not_grow_with_goals_and_history(client):
+    add_goals(client, ['Жим лежа'])
+    add_workout(client, date.today() - timedelta(days=1))
+    baseline = dashboard_statements(client)
+    
+    add_goals(client, ['Приседание в Смите', 'Вертикальная тяга сидя', 'Махи на плечи со свободным весом'])
+    for days_ago in range(2, 30, 3):
+        add_workout(client, date.today() - timedelta(days=days_ago), exercises=(
+            ('Жим лежа', 60 + days_ago, 8),
+            ('Вертикальная тяга сидя', 50, 10),
+            ('Ягодичный мост в рычажном тренажере', 70, 12)
+        ))
+    
+    assert dashboard_statements(client) == baseline
+
+def test_dashboard_renders_for_new_user(client):
+    assert dashboard_statements(client) <= 20
@@ -0,0 +1,41 @@
+from datetime import date
+
+import app as fitness
+from conftest import add_workout, count_statements, create_user
+
+def enqueue(user_id, session_id):
+    job = fitness.enqueue_derivation(user_id, session_id)
+    fitness.db.session.commit()
+    return job.id
+
+def test_claim_skips_user_with_running_job(app, user_id):
+    other_id = create_user('other')
+    with app.app_context():
+        first = enqueue(user_id, 1)
+        enqueue(user_id, 2)
+        other = enqueue(other_id, 3)
+        
+        assert fitness.claim_derivation_job().id == first
+        # Вторая задача того же пользователя ждет, пока выполняется первая
+        assert fitness.claim_derivation_job().id == other
+        assert fitness.claim_derivation_job() is None
+
+def test_next_job_of_user_is_claimed_after_previous_finishes(app, user_id):
+    with app.app_context():
+        enqueue(user_id, 1)
+        second = enqueue(user_id, 2)
+        
+        fitness.run_derivation_job(fitness.claim_derivation_job())
+        assert fitness.claim_derivation_job().id == second
+
+def test_pending_count_is_queried_only_by_banner_views(app, client, user_id):
+    add_workout(client, date.today())
+    with app.app_context():
+        enqueue(user_id, 999)
+    
+    with count_statements() as counter:
+        assert client.get('/glossary').status_code == 200
+    assert not any('derivation_job' in statement for statement in counter['statements'])
+    
+    response = client.get('/dashboard')
+    assert 'pending-derivations' in response.get_data(as_text=True)
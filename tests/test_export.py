@@ -0,0 +1,42 @@
+import io
+import zipfile
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import add_workout
+
+pa = pytest.importorskip('pyarrow')
+
+def read_table(archive, name):
+    import pyarrow.parquet as pq
+    
+    data = archive.read(name)
+    if name.endswith('.parquet'):
+        return pq.read_table(io.BytesIO(data))
+    return pa.ipc.open_stream(data).read_all()
+
+@pytest.mark.parametrize('export_format', ['arrow', 'parquet'])
+def test_columnar_export_includes_empty_tables(client, export_format):
+    # Без записей веса и замеров: их таблицы пишутся пустыми после основного цикла
+    add_workout(client, date.today() - timedelta(days=2))
+    add_workout(client, date.today())
+    
+    response = client.get(f'/export-data?format={export_format}')
+    assert response.status_code == 200
+    
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert archive.testzip() is None
+        names = sorted(archive.namelist())
+        assert names == sorted(f'{table}.{export_format}' for table in
+                               ('workouts', 'sets', 'body_weights', 'body_measurements', 'volume_loads'))
+        assert read_table(archive, f'workouts.{export_format}').num_rows == 2
+        assert read_table(archive, f'sets.{export_format}').num_rows == 8
+        assert read_table(archive, f'body_weights.{export_format}').num_rows == 0
+        assert read_table(archive, f'body_measurements.{export_format}').num_rows == 0
+
+def test_columnar_export_for_user_without_data(client):
+    response = client.get('/export-data?format=arrow')
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert all(read_table(archive, name).num_rows == 0 for name in archive.namelist())
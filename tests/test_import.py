@@ -0,0 +1,107 @@
+import json
+from datetime import date, timedelta
+
+import pytest
+
+import app as fitness
+
+def ndjson(*records):
+    return '\n'.join(json.dumps(record, ensure_ascii=False) for record in records).encode('utf-8')
+
+def workout_records(session_id, day, name, exercise='Жим лежа'):
+    return [
+        {'table': 'workouts', 'session_id': session_id, 'date': day.isoformat(), 'name': name,
+         'duration_minutes': 60, 'total_calories': 0},
+        {'table': 'sets', 'session_id': session_id, 'date': day.isoformat(), 'exercise_type': exercise,
+         'set_number': 1, 'weight': 60, 'reps': 10},
+        {'table': 'sets', 'session_id': session_id, 'date': day.isoformat(), 'exercise_type': exercise,
+         'set_number': 2, 'weight': 62.5, 'reps': 8}
+    ]
+
+def import_data(client, data):
+    response = client.post('/api/import-workouts?format=ndjson', data=data)
+    assert response.status_code == 200
+    return response.get_json()
+
+def session_count(user_id):
+    with fitness.app.app_context():
+        return fitness.WorkoutSession.query.filter_by(user_id=user_id).count()
+
+def test_session_without_sets_is_skipped(client, user_id):
+    day = date.today() - timedelta(days=3)
+    data = ndjson(
+        *workout_records(1, day, 'A'),
+        {'table': 'workouts', 'session_id': 2, 'date': day.isoformat(), 'name': 'Пустая',
+         'duration_minutes': 30, 'total_calories': 0}
+    )
+    
+    result = import_data(client, data)
+    
+    assert result['success'] is True
+    assert result['sessions_imported'] == 1
+    assert result['sessions_skipped'] == 1
+    assert session_count(user_id) == 1
+
+def test_reimport_skips_existing_sessions(client, user_id):
+    today = date.today()
+    data = ndjson(*workout_records(1, today - timedelta(days=2), 'A'), *workout_records(2, today, 'B'))
+    
+    assert import_data(client, data)['sessions_imported'] == 2
+    result = import_data(client, data)
+    
+    assert result['sessions_imported'] == 0
+    assert result['sessions_skipped'] == 2
+    assert session_count(user_id) == 2
+
+def test_failed_chunk_keeps_derived_data_consistent(client, user_id, monkeypatch):
+    today = date.today()
+    data = ndjson(*workout_records(1, today - timedelta(days=1), 'A'), *workout_records(2, today, 'B'))
+    monkeypatch.setitem(fitness.app.config, 'IMPORT_CHUNK_SIZE', 1)
+    
+    original = fitness.record_progress_points
+    calls = []
+    
+    def fail_on_second_chunk(session_ids):
+        calls.append(session_ids)
+        if len(calls) == 2:
+            raise RuntimeError('сбой записи')
+        return original(session_ids)
+    
+    monkeypatch.setattr(fitness, 'record_progress_points', fail_on_second_chunk)
+    with fitness.app.app_context():
+        version = fitness.db.session.get(fitness.User, user_id).data_version
+    
+    result = import_data(client, data)
+    assert result['success'] is False
+    assert session_count(user_id) == 1
+    
+    with fitness.app.app_context():
+        # Пересчет выполнен по первому, уже закоммиченному пакету
+        assert fitness.db.session.get(fitness.User, user_id).data_version > version
+        assert fitness.WorkoutRollup.query.filter_by(user_id=user_id, period='day').count() == 1
+        streak = fitness.WorkoutStreak.query.filter_by(user_id=user_id, streak_type='workout').one()
+        assert streak.last_activity_date == today - timedelta(days=1)
+    
+    monkeypatch.setattr(fitness, 'record_progress_points', original)
+    result = import_data(client, data)
+    assert result['sessions_imported'] == 1
+    assert result['sessions_skipped'] == 1
+    assert session_count(user_id) == 2
+
+@pytest.mark.parametrize('record, message', [
+    ({'table': 'sets', 'session_id': 1, 'exercise_type': '', 'weight': 60, 'reps': 10},
+     'не указано название упражнения'),
+    ({'table': 'sets', 'session_id': 1, 'exercise_type': 'Жим лежа', 'weight': 'много', 'reps': 10},
+     'некорректные данные в подходе упражнения "Жим лежа"'),
+    ({'table': 'sets', 'session_id': 1, 'exercise_type': 'Жим лежа', 'weight': 0, 'reps': 10},
+     'вес и повторения должны быть больше 0 в подходе упражнения "Жим лежа"')
+])
+def test_invalid_sets_abort_import(client, user_id, record, message):
+    day = date.today()
+    data = ndjson(*workout_records(1, day, 'A'), dict(record, date=day.isoformat()))
+    
+    result = import_data(client, data)
+    
+    assert result['success'] is False
+    assert [error.split(': ', 1)[1] for error in result['errors']] == [message]
+    assert session_count(user_id) == 0
@@ -0,0 +1,37 @@
+from conftest import add_workout, fitness
+
+def test_streamed_export_recorded_on_close(client):
+    add_workout(client)
+    add_workout(client, name='Вторая')
+    fitness.request_metrics.sql.clear()
+    
+    with client.get('/export-data?format=csv') as response:
+        assert response.is_streamed
+        assert 'Server-Timing' not in response.headers
+        assert 'export_data' not in fitness.request_metrics.sql
+        response.get_data()
+    
+    statements, _ = fitness.request_metrics.sql['export_data']
+    assert statements > 1
+    assert fitness.request_metrics.requests[('export_data', 'GET', 200)] == 1
+
+def test_plain_response_has_server_timing(client):
+    response = client.get('/dashboard')
+    assert response.status_code == 200
+    assert 'queries' in response.headers['Server-Timing']
+    assert fitness.request_metrics.requests[('dashboard', 'GET', 200)] == 1
+
+def test_metrics_without_token_only_from_localhost(app):
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 200
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code == 403
+    assert client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.5'}).status_code == 403
+
+def test_metrics_with_token(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'secret')
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'},
+                          environ_base={'REMOTE_ADDR': '10.0.0.1'})
+    assert response.status_code == 200
+    assert 'fitness_http_requests_total' in response.get_data(as_text=True)
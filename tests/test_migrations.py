@@ -0,0 +1,47 @@
+import json
+from datetime import date
+
+from conftest import fitness
+
+# Столбцы, добавленные миграциями после исходной схемы (baseline)
+LATER_COLUMNS = {
+    'user': ('data_version', 'calendar_version'),
+    'progress_photo': ('status', 'thumbnails_data', 'source_hash')
+}
+
+def create_baseline_schema(connection):
+    """Таблицы текущих моделей без столбцов, которые добавляют миграции, и без истории миграций"""
+    fitness.db.metadata.create_all(connection)
+    connection.exec_driver_sql('DROP INDEX ix_progress_photo_source_hash')
+    for table, columns in LATER_COLUMNS.items():
+        for column in columns:
+            connection.exec_driver_sql(f'ALTER TABLE "{table}" DROP COLUMN {column}')
+    connection.exec_driver_sql('DELETE FROM schema_migration')
+    
+    connection.exec_driver_sql(
+        "INSERT INTO user (id, username, email, password_hash, weight) VALUES (1, 'old', 'old@example.com', 'x', 80.0)"
+    )
+    connection.exec_driver_sql(
+        "INSERT INTO workout_session (id, user_id, date, name, duration_minutes, total_calories) "
+        f"VALUES (1, 1, '{date(2024, 3, 4).isoformat()}', 'Тренировка', 60.0, 300.0)"
+    )
+    sets_data = json.dumps([{'weight': 60, 'reps': 10}, {'weight': 60, 'reps': 8}])
+    connection.exec_driver_sql(
+        'INSERT INTO workout_exercise (id, session_id, exercise_type, sets_data, "order") VALUES (?, ?, ?, ?, ?)',
+        (1, 1, 'Жим лежа', sets_data, 0)
+    )
+
+def test_upgrade_from_baseline_schema(app):
+    with app.app_context():
+        fitness.db.drop_all()
+        with fitness.db.engine.begin() as connection:
+            create_baseline_schema(connection)
+        
+        done = fitness.run_migrations()
+        assert [version for version, name in done] == [version for version, name, func in fitness.MIGRATIONS]
+        
+        user = fitness.db.session.get(fitness.User, 1)
+        assert user.calendar_version == 0
+        assert fitness.WorkoutSet.query.count() == 2
+        assert fitness.WorkoutRollup.query.filter_by(user_id=1, period='day').count() == 1
+        assert fitness.run_migrations() == []
@@ -0,0 +1,86 @@
+import io
+import os
+
+import pytest
+
+from conftest import create_user, fitness, login
+
+PHOTO = b'\x89PNG\r\n\x1a\n' + b'progress' * 64
+
+@pytest.fixture
+def without_pillow(monkeypatch):
+    # Без Pillow загрузка сохраняется как есть и сразу готова
+    monkeypatch.setattr(fitness.photo_pipeline, 'available', lambda: False)
+
+def upload(client, data=PHOTO):
+    response = client.post('/api/upload-photo', data={'photo': (io.BytesIO(data), 'front.png')},
+                           content_type='multipart/form-data')
+    payload = response.get_json()
+    assert payload['success'], payload
+    return payload
+
+def test_photo_file_served_only_to_owner(app, client, without_pillow):
+    key = upload(client)['path']
+    assert client.get(f'/photos/{key}').status_code == 200
+    
+    other = app.test_client()
+    login(other, create_user('other'))
+    assert other.get(f'/photos/{key}').status_code == 404
+    
+    anonymous = app.test_client()
+    assert anonymous.get(f'/photos/{key}').status_code == 302
+
+def test_duplicate_upload_reused_only_within_user(app, client, monkeypatch, without_pillow):
+    upload(client)
+    
+    # Файл другого пользователя не подставляется: новая загрузка уходит на обработку
+    monkeypatch.setattr(fitness.photo_pipeline, 'available', lambda: True)
+    monkeypatch.setattr(fitness, 'process_photo_now', lambda photo_id, args: None)
+    other = app.test_client()
+    login(other, create_user('other'))
+    assert upload(other)['status'] == 'processing'
+    
+    # Повторная загрузка тем же пользователем использует готовые варианты
+    assert upload(client)['status'] == 'ready'
+
+def test_backfill_keeps_undecodable_legacy_photo(app, user_id, tmp_path, monkeypatch):
+    pytest.importorskip('PIL')
+    # process-photos ищет старые файлы относительно рабочего каталога (static/uploads)
+    monkeypatch.chdir(tmp_path)
+    legacy_path = tmp_path / 'static' / 'uploads' / 'old.jpg'
+    legacy_path.parent.mkdir(parents=True)
+    legacy_path.write_bytes(b'\xff\xd8\xff\xe0 truncated jpeg')
+    
+    with app.app_context():
+        photo = fitness.ProgressPhoto(user_id=user_id, photo_path='uploads/old.jpg', status='ready')
+        fitness.db.session.add(photo)
+        fitness.db.session.commit()
+        photo_id = photo.id
+    
+    result = app.test_cli_runner().invoke(args=['process-photos', '--backfill'])
+    assert result.exit_code == 0, result.output
+    assert 'Не удалось обработать: 1' in result.output
+    
+    assert legacy_path.read_bytes() == b'\xff\xd8\xff\xe0 truncated jpeg'
+    with app.app_context():
+        photo = fitness.db.session.get(fitness.ProgressPhoto, photo_id)
+        assert photo.status == 'ready'
+        assert photo.photo_path == 'uploads/old.jpg'
+
+def test_chunked_upload_cut_off_at_limit(client, monkeypatch):
+    monkeypatch.setitem(client.application.config, 'PHOTO_MAX_BYTES', 1024)
+    monkeypatch.setitem(client.application.config, 'PHOTO_FORM_OVERHEAD', 1024)
+    boundary = 'limit'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="photo"; filename="big.png"\r\n'
+            f'Content-Type: image/png\r\n\r\n').encode() + PHOTO * 400 + f'\r\n--{boundary}--\r\n'.encode()
+    
+    stream = io.BytesIO(body)
+    # Без Content-Length (chunked): лимит проверяется во время чтения тела
+    response = client.post('/api/upload-photo', input_stream=stream,
+                           content_type=f'multipart/form-data; boundary={boundary}',
+                           environ_overrides={'wsgi.input_terminated': True, 'CONTENT_LENGTH': ''})
+    assert response.status_code == 413
+    assert response.get_json()['success'] is False
+    assert stream.tell() < len(body)  # Тело не дочитано до конца
+    with client.application.app_context():
+        assert fitness.ProgressPhoto.query.count() == 0
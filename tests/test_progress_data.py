@@ -0,0 +1,14 @@
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import add_workout
+
+@pytest.mark.parametrize('max_points', [-5, 0, 1])
+def test_progress_data_keeps_first_and_last_points(client, max_points):
+    days = [date.today() - timedelta(days=offset) for offset in (6, 4, 2, 0)]
+    for day in days:
+        add_workout(client, day)
+    
+    series = client.get(f'/api/progress-data?max_points={max_points}').get_json()['Жим лежа']
+    assert series['dates'] == [days[0].isoformat(), days[-1].isoformat()]
@@ -0,0 +1,36 @@
+from datetime import date
+
+import pytest
+
+from conftest import add_workout
+
+def calculate(client, **overrides):
+    payload = {'exercise_type': 'Жим лежа', 'current_weight': 60, 'target_weight': 80, 'frequency': 2}
+    payload.update(overrides)
+    return client.post('/api/calculate-progression', json=payload)
+
+def test_calculate_progression_estimates_weeks(client):
+    response = calculate(client)
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['estimated_weeks'] == 8.0
+    assert result['progression_data'][-1]['weight'] == 80
+
+@pytest.mark.parametrize('overrides', [{'frequency': 0}, {'frequency': -1}, {'frequency': 'часто'},
+                                       {'current_weight': -10}])
+def test_calculate_progression_rejects_invalid_input(client, overrides):
+    response = calculate(client, **overrides)
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+def test_single_and_batch_weight_predictions_agree(client):
+    # Две тренировки с упражнением в один день: последней считается записанная позже
+    day = date.today()
+    add_workout(client, day, exercises=(('Жим лежа', 62.5, 4),), name='Утро')
+    add_workout(client, day, exercises=(('Жим лежа', 97.5, 12),), name='Вечер')
+    
+    single = client.get('/api/weight-prediction/Жим лежа').get_json()
+    batch = client.post('/api/weight-predictions', json={'exercise_types': ['Жим лежа']}).get_json()
+    
+    assert single == batch['predictions']['Жим лежа']
+    assert single['suggestion']['weight'] == 102.5
@@ -0,0 +1,20 @@
+import os
+import re
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def precached_urls():
+    with open(os.path.join(ROOT, 'static', 'sw.js'), encoding='utf-8') as f:
+        source = f.read()
+    block = re.search(r'const urlsToCache = \[(.*?)\];', source, re.S).group(1)
+    return re.findall(r"'([^']+)'", block)
+
+def test_precached_urls_exist(app):
+    # cache.addAll отклоняется целиком, если хотя бы один адрес не отдается
+    client = app.test_client()
+    urls = precached_urls()
+    assert '/exercise-catalog.js' in urls
+    for url in urls:
+        response = client.get(url)
+        assert response.status_code == 200, url
+        response.close()
@@ -0,0 +1,110 @@
+from datetime import date, timedelta
+
+import pytest
+from flask import Response, stream_with_context
+
+import app as fitness
+from conftest import add_workout
+
+# (метод, адрес, JSON-тело) для каждого представления с @sql_budget
+BUDGETED_REQUESTS = {
+    'dashboard': ('GET', '/dashboard', None),
+    'progression_plans': ('GET', '/progression-plans', None),
+    'results': ('GET', '/results', None),
+    'list_workout_sessions': ('GET', '/api/workout-sessions?limit=2', None),
+    'list_body_weights': ('GET', '/api/body-weights', None),
+    'list_body_measurements': ('GET', '/api/body-measurements', None),
+    'list_progress_photos': ('GET', '/api/progress-photos', None),
+    'workout_calendar': ('GET', '/api/workout-calendar', None),
+    'volume_load_stats': ('GET', '/volume-load-stats', None),
+    'analytics': ('GET', '/analytics', None),
+    'calculate_progression': ('POST', '/api/calculate-progression',
+                              {'exercise_type': 'Жим лежа', 'current_weight': 70, 'target_weight': 100}),
+    'workout_stats_period': ('GET', '/api/workout-stats/month', None),
+    'double_progression_dashboard': ('GET', '/double-progression-dashboard', None),
+    'get_weight_predictions': ('POST', '/api/weight-predictions',
+                               {'exercise_types': ['Жим лежа', 'Приседание в Смите']}),
+    'double_progression_stats': ('GET', '/api/double-progression-stats', None),
+    'api_progress_data': ('GET', '/api/progress-data', None),
+    'get_user_workouts': ('GET', '/api/user-workouts', None),
+    'ai_assistant': ('GET', '/ai-assistant', None),
+    'ai_chat': ('POST', '/api/ai-chat', {'message': 'Как мой прогресс?'}),
+    'ai_recommendations': ('POST', '/api/ai-recommendations', {'type': 'progression'})
+}
+
+@pytest.fixture
+def seeded_client(client):
+    """Пользователь с историей тренировок, целью, планами прогрессии, весом и замерами"""
+    for days_ago in (14, 10, 7, 3, 1):
+        add_workout(client, date.today() - timedelta(days=days_ago))
+    target_date = (date.today() + timedelta(days=90)).isoformat()
+    client.post('/add-goal', data={'exercise_type': 'Жим лежа', 'target_weight': '100',
+                                   'target_reps': '8', 'target_sets': '3', 'target_date': target_date})
+    client.post('/add-progression-plan', data={'exercise_type': 'Жим лежа', 'current_weight': '60',
+                                               'target_weight': '80', 'target_date': target_date})
+    client.post('/add-double-progression', data={'exercise_type': 'Приседание в Смите', 'current_weight': '80'})
+    for days_ago in (20, 10, 1):
+        day = (date.today() - timedelta(days=days_ago)).isoformat()
+        client.post('/api/add-body-weight', json={'weight': 80 - days_ago / 10, 'date': day})
+        client.post('/api/add-body-measurement', json={'date': day, 'waist': 80, 'chest': 100})
+    return client
+
+def test_every_budgeted_view_is_covered(app):
+    budgeted = {endpoint for endpoint, view in app.view_functions.items() if hasattr(view, 'sql_budget')}
+    assert budgeted == set(BUDGETED_REQUESTS)
+
+@pytest.fixture
+def missing_templates(app, monkeypatch):
+    """Заглушки шаблонов, которых нет в репозитории (double_progression_dashboard.html)
+    
+    Заглушка наследует base.html, поэтому контекстные процессоры и их запросы учитываются.
+    """
+    from jinja2 import ChoiceLoader, DictLoader
+    
+    monkeypatch.setattr(app.jinja_env, 'loader', ChoiceLoader([
+        app.jinja_env.loader,
+        DictLoader({'double_progression_dashboard.html': '{% extends "base.html" %}'})
+    ]))
+    app.jinja_env.cache.clear()
+    yield
+    app.jinja_env.cache.clear()
+
+@pytest.mark.parametrize('endpoint', sorted(BUDGETED_REQUESTS))
+def test_view_stays_within_sql_budget(seeded_client, missing_templates, endpoint):
+    method, url, body = BUDGETED_REQUESTS[endpoint]
+    # В тестах превышение бюджета вызывает SQLBudgetExceeded; потоковые ответы проверяются при закрытии
+    with seeded_client.open(url, method=method, json=body) as response:
+        assert response.status_code == 200
+        response.get_data()
+
+def test_streamed_ai_chat_stays_within_sql_budget(seeded_client):
+    with seeded_client.post('/api/ai-chat', json={'message': 'Как мой прогресс?', 'stream': True}) as response:
+        assert response.mimetype == 'text/event-stream'
+        assert 'event: done' in response.get_data(as_text=True)
+
+def test_budget_exceeded_raises_in_tests(app, user_id):
+    @fitness.sql_budget(1)
+    def view():
+        fitness.User.query.count()
+        fitness.User.query.count()
+        return 'ok'
+    
+    with app.test_request_context('/'):
+        with pytest.raises(fitness.SQLBudgetExceeded):
+            view()
+
+def test_budget_of_streamed_response_is_checked_on_close(app, user_id):
+    @fitness.sql_budget(1)
+    def view():
+        def generate():
+            fitness.User.query.count()
+            yield 'a'
+            fitness.User.query.count()
+            yield 'b'
+        return Response(stream_with_context(generate()))
+    
+    with app.test_request_context('/'):
+        response = view()
+        assert b''.join(response.iter_encoded()) == b'ab'
+        with pytest.raises(fitness.SQLBudgetExceeded):
+            response.close()
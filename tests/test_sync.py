@@ -0,0 +1,95 @@
+import uuid
+from datetime import date
+
+from conftest import create_user, fitness, login, workout_form
+
+def operation(user_id, op_type='body_weight', data=None, **kwargs):
+    op = {
+        'id': str(uuid.uuid4()),
+        'type': op_type,
+        'data': data if data is not None else {'weight': 80.5, 'date': date.today().isoformat()},
+        'user_id': user_id
+    }
+    op.update(kwargs)
+    return op
+
+def sync(client, operations):
+    response = client.post('/api/sync', json={'operations': operations})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return {item['id']: item for item in response.get_json()['results']}
+
+def test_operation_of_other_user_rejected(app, client, user_id):
+    # Очередь, записанная другим пользователем на том же устройстве, не попадает в текущий аккаунт
+    other_id = create_user('other')
+    foreign = operation(other_id)
+    legacy = operation(user_id)
+    del legacy['user_id']
+    
+    results = sync(client, [foreign, legacy])
+    assert results[foreign['id']]['status'] == 'rejected'
+    assert results[legacy['id']]['status'] == 'rejected'
+    with app.app_context():
+        assert fitness.BodyWeight.query.count() == 0
+        assert fitness.SyncOperation.query.count() == 0
+    
+    other = app.test_client()
+    login(other, other_id)
+    assert sync(other, [operation(other_id, id=foreign['id'])])[foreign['id']]['status'] == 'created'
+
+def test_batch_reports_created_duplicate_and_rejected(app, client, user_id):
+    first = operation(user_id)
+    assert sync(client, [first])[first['id']]['status'] == 'created'
+    
+    created = operation(user_id, 'body_measurement', {'waist': 82.0, 'date': date.today().isoformat()})
+    invalid = operation(user_id, data={'weight': 0})
+    unknown = operation(user_id, 'unknown')
+    results = sync(client, [first, created, invalid, unknown])
+    
+    assert results[first['id']]['status'] == 'duplicate'
+    assert results[created['id']]['status'] == 'created'
+    assert results[invalid['id']]['status'] == 'rejected'
+    assert 'Вес' in results[invalid['id']]['error']
+    assert results[unknown['id']]['status'] == 'rejected'
+    with app.app_context():
+        assert results[created['id']]['object_id'] == fitness.BodyMeasurement.query.one().id
+        assert fitness.BodyWeight.query.count() == 1
+
+def test_repeated_batch_returns_duplicates(app, client, user_id):
+    batch = [operation(user_id), operation(user_id, data={'weight': 81.0, 'date': date.today().isoformat()})]
+    first = sync(client, batch)
+    repeated = sync(client, batch)
+    
+    for op in batch:
+        assert first[op['id']]['status'] == 'created'
+        assert repeated[op['id']]['status'] == 'duplicate'
+        assert repeated[op['id']]['object_id'] == first[op['id']]['object_id']
+    with app.app_context():
+        assert fitness.BodyWeight.query.count() == 2
+        assert fitness.SyncOperation.query.count() == 2
+
+def test_failure_mid_batch_rolls_back_whole_batch(app, client, user_id, monkeypatch):
+    def broken_handler(user_id, data, activity_date):
+        raise RuntimeError('сбой')
+    
+    monkeypatch.setitem(fitness.SYNC_HANDLERS, 'body_measurement', broken_handler)
+    batch = [operation(user_id), operation(user_id, 'body_measurement', {'waist': 82.0})]
+    response = client.post('/api/sync', json={'operations': batch})
+    
+    assert response.status_code == 500
+    assert response.get_json()['success'] is False
+    with app.app_context():
+        assert fitness.BodyWeight.query.count() == 0
+        assert fitness.SyncOperation.query.count() == 0
+
+def test_workout_derivation_uses_queued_date(app, client, user_id, monkeypatch):
+    queued = []
+    original = fitness.enqueue_derivation
+    
+    def record(user_id, session_id, activity_date=None):
+        queued.append(activity_date)
+        return original(user_id, session_id, activity_date)
+    
+    monkeypatch.setattr(fitness, 'enqueue_derivation', record)
+    op = operation(user_id, 'workout_session', workout_form(date(2026, 3, 2)), queued_at='2026-03-03')
+    assert sync(client, [op])[op['id']]['status'] == 'created'
+    assert queued == [date(2026, 3, 3)]
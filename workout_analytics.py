@@ -0,0 +1,142 @@
+"""Векторизованные расчеты по подходам пользователя (NumPy)
+
+Модуль не зависит от Flask и моделей: app.load_set_arrays загружает подходы
+одним запросом, а функции ниже работают с непрерывными массивами.
+"""
+import numpy as np
+
+class SetArrays:
+    """Подходы в непрерывных массивах, упорядоченные по (дата, тренировка, упражнение, номер подхода)
+
+    days - порядковые номера дат (date.toordinal), exercise_codes - индексы в exercise_names.
+    """
+
+    def __init__(self, session_ids, exercise_ids, exercise_codes, days, weights, reps, exercise_names):
+        self.session_ids = session_ids
+        self.exercise_ids = exercise_ids
+        self.exercise_codes = exercise_codes
+        self.days = days
+        self.weights = weights
+        self.reps = reps
+        self.exercise_names = exercise_names
+
+    @classmethod
+    def from_rows(cls, rows):
+        """rows: (session_id, exercise_id, exercise_type, date, weight, reps) в нужном порядке"""
+        rows = list(rows)
+        names = sorted({row[2] for row in rows})
+        codes = {name: idx for idx, name in enumerate(names)}
+
+        return cls(
+            np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter((codes[row[2]] for row in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter((row[3].toordinal() for row in rows), dtype=np.int64, count=len(rows)),
+            # None и NaN превращаются в 0, как в safe_float/safe_int
+            np.nan_to_num(np.array([row[4] for row in rows], dtype=np.float64)),
+            np.nan_to_num(np.array([row[5] for row in rows], dtype=np.float64)),
+            names
+        )
+
+    def __len__(self):
+        return len(self.weights)
+
+    @property
+    def valid(self):
+        """Маска валидных подходов: вес и повторения больше 0"""
+        return (self.weights > 0) & (self.reps > 0)
+
+def epley_1rm(weights, reps):
+    """Оценка разового максимума по Эпли: w * (1 + reps / 30); при одном повторении - сам вес"""
+    weights = np.asarray(weights, dtype=np.float64)
+    reps = np.asarray(reps, dtype=np.float64)
+    return np.where(reps <= 1, weights, weights * (1 + reps / 30.0))
+
+def exercise_instances(arrays):
+    """Агрегаты по каждому выполнению упражнения (подходы одного WorkoutExercise идут подряд)
+
+    Возвращает словарь массивов одинаковой длины в хронологическом порядке.
+    max_weight, avg_weight и avg_reps считаются по всем подходам (как в get_sets_data),
+    volume и e1rm - только по валидным (e1rm = NaN, если валидных подходов нет).
+    """
+    if not len(arrays):
+        empty_int = np.array([], dtype=np.int64)
+        empty = np.array([], dtype=np.float64)
+        return {
+            'exercise_id': empty_int, 'session_id': empty_int, 'exercise_code': empty_int, 'day': empty_int,
+            'sets': empty_int, 'valid_sets': empty_int, 'max_weight': empty, 'avg_weight': empty,
+            'avg_reps': empty, 'volume': empty, 'e1rm': empty
+        }
+
+    starts = np.flatnonzero(np.r_[True, arrays.exercise_ids[1:] != arrays.exercise_ids[:-1]])
+    sets = np.diff(np.r_[starts, len(arrays)])
+    valid = arrays.valid
+    e1rm = np.maximum.reduceat(np.where(valid, epley_1rm(arrays.weights, arrays.reps), -np.inf), starts)
+
+    valid_sets = np.add.reduceat(valid.astype(np.int64), starts)
+    return {
+        'exercise_id': arrays.exercise_ids[starts],
+        'session_id': arrays.session_ids[starts],
+        'exercise_code': arrays.exercise_codes[starts],
+        'day': arrays.days[starts],
+        'sets': sets,
+        'valid_sets': valid_sets,
+        'max_weight': np.maximum.reduceat(arrays.weights, starts),
+        'avg_weight': np.add.reduceat(arrays.weights, starts) / sets,
+        'avg_reps': np.add.reduceat(arrays.reps, starts) / sets,
+        'volume': np.add.reduceat(np.where(valid, arrays.weights * arrays.reps, 0.0), starts),
+        'e1rm': np.where(valid_sets > 0, e1rm, np.nan)
+    }
+
+def theil_sen(x, y, band=0.8):
+    """Робастная прямая Тейла-Сена: медиана наклонов по всем парам точек
+
+    Возвращает (slope, intercept, slope_low, slope_high), где low/high - квантили
+    попарных наклонов, покрывающие долю band (грубая доверительная полоса наклона).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if not len(y):
+        return 0.0, 0.0, 0.0, 0.0
+
+    i, j = np.triu_indices(len(x), k=1)
+    dx = x[j] - x[i]
+    distinct = dx != 0
+    if not distinct.any():
+        return 0.0, float(np.median(y)), 0.0, 0.0
+
+    slopes = (y[j] - y[i])[distinct] / dx[distinct]
+    slope = float(np.median(slopes))
+    slope_low, slope_high = np.quantile(slopes, [(1 - band) / 2, (1 + band) / 2])
+    return slope, float(np.median(y - slope * x)), float(slope_low), float(slope_high)
+
+def invalid_import_sets(exercise_types, weights, reps):
+    """Индексы непрошедших проверку подходов импорта с причиной: [(индекс, 'name' | 'data' | 'range')]
+
+    weights и reps - уже разобранные значения (None - не число). Проверки идут в порядке
+    validate_exercise_data: название, затем числа, затем вес и повторения больше 0.
+    """
+    named = np.fromiter((bool(name) for name in exercise_types), dtype=bool, count=len(exercise_types))
+    weights = np.array([np.nan if value is None else value for value in weights], dtype=np.float64)
+    reps = np.array([np.nan if value is None else value for value in reps], dtype=np.float64)
+
+    convertible = ~np.isnan(weights) & ~np.isnan(reps)
+    positive = convertible & (weights > 0) & (reps > 0)
+    reasons = np.select([~named, ~convertible, ~positive], ['name', 'data', 'range'], default='')
+    return [(int(idx), str(reasons[idx])) for idx in np.flatnonzero(reasons != '')]
+
+def weeks_to_target(current, target, weekly_increase):
+    """Недель до цели при линейном росте (0, если цель достигнута; None, если роста нет)"""
+    if target <= current:
+        return 0.0
+    if weekly_increase <= 0:
+        return None
+    return (target - current) / weekly_increase
+
+def linear_schedule(current, target, weekly_increase, max_weeks=52):
+    """Веса по неделям от current с шагом weekly_increase, пока они меньше target (не больше max_weeks)"""
+    weeks = weeks_to_target(current, target, weekly_increase)
+    if not weeks:
+        return np.array([], dtype=np.float64)
+    count = min(max_weeks, int(np.ceil(weeks)))
+    return current + weekly_increase * np.arange(count)